@@ -0,0 +1,6 @@
+"""Benchmarks for the bridge frontend
+
+The benchmarks are run as modules from the root of the repository, for example:
+
+python -m benchmarks.codec
+"""
@@ -0,0 +1,101 @@
+"""Benchmark for the codecs in bridgegui.messaging
+
+This benchmark measures the encode and decode throughput of each available
+codec using messages that appear in the bridge protocol: the reply to a get
+command containing the full state of a deal, the play event, and the call
+command.
+"""
+
+import itertools
+import timeit
+
+import bridgegui.messaging as messaging
+
+RANKS = (
+    "2", "3", "4", "5", "6", "7", "8", "9", "10", "jack", "queen", "king",
+    "ace")
+SUITS = ("clubs", "diamonds", "hearts", "spades")
+POSITIONS = ("north", "east", "south", "west")
+
+
+def _make_get_reply():
+    cards = [
+        {"rank": rank, "suit": suit} for (suit, rank) in
+        itertools.product(SUITS, RANKS)]
+    hands = {
+        position: cards[n::len(POSITIONS)] for (n, position) in
+        enumerate(POSITIONS)}
+    calls = [
+        {"position": POSITIONS[n % 4],
+         "call": {"type": "bid", "bid": {"level": 1 + n // 5, "strain": "clubs"}}}
+        for n in range(20)]
+    calls.extend(
+        {"position": POSITIONS[n % 4], "call": {"type": "pass"}}
+        for n in range(20, 23))
+    tricks = [
+        {"cards": [
+            {"position": position, "card": hands[position][n]}
+            for position in POSITIONS],
+         "winner": POSITIONS[n % 4]}
+        for n in range(13)]
+    return {
+        "pubstate": {
+            "positionInTurn": "north",
+            "calls": calls,
+            "declarer": "north",
+            "contract": {
+                "bid": {"level": 4, "strain": "spades"},
+                "doubling": "undoubled"},
+            "cards": hands,
+            "tricks": tricks,
+            "vulnerability": {"northSouth": True, "eastWest": False},
+        },
+        "privstate": {"cards": {"south": hands["south"]}},
+        "self": {
+            "position": "south",
+            "allowedCalls": [],
+            "allowedCards": hands["south"][:5],
+        },
+    }
+
+
+MESSAGES = {
+    "get reply": _make_get_reply(),
+    "play event": {"position": "north", "card": {"rank": "ace", "suit": "spades"}},
+    "call command": {
+        "game": "b1b9bcda-d4f0-4bd4-be2b-c5b1c1e4cfd3",
+        "player": "2f2c4d1e-8fb3-4c7b-a4a8-2b6f3a1b3d1e",
+        "call": {"type": "bid", "bid": {"level": 1, "strain": "notrump"}}},
+}
+
+
+def _measure(function):
+    # Return the time in seconds taken by one call to the function
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    codecs = []
+    for codec_type in messaging.CODECS:
+        try:
+            codecs.append(messaging.getCodec(codec_type.name))
+        except ImportError:
+            print("Codec %s not available" % codec_type.name)
+    print("%-14s %-8s %-8s %12s %10s" % (
+        "message", "codec", "op", "messages/s", "MB/s"))
+    for (message_name, value) in MESSAGES.items():
+        for codec in codecs:
+            data = codec.encode(value)
+            for (op, function) in (
+                    ("encode", lambda: codec.encode(value)),
+                    ("decode", lambda: codec.decode(data))):
+                duration = _measure(function)
+                print("%-14s %-8s %-8s %12.0f %10.1f" % (
+                    message_name, codec.name, op, 1 / duration,
+                    len(data) / duration / 1e6))
+
+
+if __name__ == "__main__":
+    main()
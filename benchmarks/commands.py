@@ -0,0 +1,52 @@
+"""Benchmark for sending commands with bridgegui.messaging
+
+This benchmark compares the cost of building and sending a play command with
+sendCommand() and with a PreparedCommand whose game and player arguments are
+serialized in advance. The socket discards the messages, so only the cost of
+preparing the frames is measured.
+"""
+
+import timeit
+
+import bridgegui.messaging as messaging
+
+GAME = "b1b9bcda-d4f0-4bd4-be2b-c5b1c1e4cfd3"
+PLAYER = "2f2c4d1e-8fb3-4c7b-a4a8-2b6f3a1b3d1e"
+CARD = {"rank": "ace", "suit": "spades"}
+
+
+class _NullSocket:
+
+    def send_multipart(self, parts):
+        pass
+
+
+def _measure(function):
+    # Return the time in seconds taken by one call to the function
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def main():
+    socket = _NullSocket()
+    for codec_type in messaging.CODECS:
+        try:
+            codec = messaging.getCodec(codec_type.name)
+        except ImportError:
+            print("Codec %s not available" % codec_type.name)
+            continue
+        prepared_command = messaging.PreparedCommand(
+            b'play', _codec=codec, game=GAME, player=PLAYER)
+        for (name, function) in (
+                ("sendCommand", lambda: messaging.sendCommand(
+                    socket, b'play', _codec=codec, game=GAME, player=PLAYER,
+                    card=CARD)),
+                ("PreparedCommand", lambda: prepared_command.send(
+                    socket, card=CARD))):
+            print("%-8s %-16s %10.0f commands/s" % (
+                codec.name, name, 1 / _measure(function)))
+
+
+if __name__ == "__main__":
+    main()
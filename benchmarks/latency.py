@@ -0,0 +1,166 @@
+"""Benchmark for the latency of the frontend on impaired networks
+
+This benchmark runs the stand-in backend (bridgegui.server) and the impairment
+proxy (bridgegui.proxy) in the same process, and plays games where the first
+player at each table connects through the proxy and the others directly to the
+backend. For each impairment profile the benchmark reports the latencies seen
+by the players behind the proxy:
+
+- time-to-join, from starting the client to receiving the initial state
+- event-to-screen, from the backend publishing a play event to the observer of
+  the client being notified of the card played
+
+The events that are dropped by the proxy are not notified as such (the client
+catches up by requesting the state), so they are left out from the
+event-to-screen latencies.
+
+The backend and the proxy are bound to adjacent endpoints starting from the
+base endpoint (see bridgegui.messaging.endpoints()).
+"""
+
+import argparse
+import itertools
+import threading
+import time
+
+import zmq
+
+import bridgegui.client as client
+import bridgegui.deck as deck
+import bridgegui.loadgen as loadgen
+import bridgegui.messaging as messaging
+import bridgegui.positions as positions
+import bridgegui.proxy as proxy
+import bridgegui.server as server
+
+
+class _PublicationRecorder:
+    # Wraps the event socket of the server and records the times the play
+    # events are published
+
+    def __init__(self, socket, codec):
+        self._socket = socket
+        self._codec = codec
+        self._suffix = b':' + client.PLAY_COMMAND
+        self.times = {}
+
+    def send_multipart(self, parts):
+        if parts[0].endswith(self._suffix):
+            arguments = dict(zip(parts[1::2], parts[2::2]))
+            key = (
+                parts[0][:-len(self._suffix)].decode(),
+                positions.asPosition(self._codec.decode(arguments[b'position'])),
+                deck.asCard(self._codec.decode(arguments[b'card'])))
+            self.times[key] = time.monotonic()
+        self._socket.send_multipart(parts)
+
+
+class _MeasuredBot(loadgen.Bot):
+    # Bot recording the event-to-screen latencies of the play events
+
+    def __init__(self, publications, latencies, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._publications = publications
+        self._latencies = latencies
+
+    def cardPlayed(self, position, card):
+        super().cardPlayed(position, card)
+        published = self._publications.times.pop(
+            (self.client().gameUuid(), position, card), None)
+        if published is not None:
+            self._latencies.append(time.monotonic() - published)
+
+
+def _format_latencies(latencies, fractions):
+    latencies = sorted(latencies)
+    return " ".join(
+        "%8.1f" % (1000 * latency) if latency is not None else "%8s" % "-"
+        for latency in (
+            loadgen.percentile(latencies, fraction) for fraction in fractions))
+
+
+def _measure(backend, frontend, publications, tables, duration, seed):
+    statistics = loadgen.Statistics()
+    latencies = []
+    def _create_bot(seat, default_statistics, register, rng, countDeals):
+        if seat == 0:
+            return _MeasuredBot(
+                publications, latencies, statistics, register, rng,
+                countDeals=countDeals)
+        return loadgen.Bot(
+            default_statistics, register, rng, countDeals=countDeals)
+    generator = loadgen.LoadGenerator(
+        backend, tables * loadgen.PLAYERS_PER_TABLE, seed=seed,
+        seatEndpoints=[frontend] + [backend] * (loadgen.PLAYERS_PER_TABLE - 1),
+        botFactory=_create_bot)
+    errors = generator.run(duration).errors()
+    return statistics.latencies(loadgen.JOIN_TAG), latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the latency of the frontend on impaired networks")
+    parser.add_argument(
+        "--endpoint", default="tcp://127.0.0.1:5760",
+        help="""Base endpoint of the backend. The proxy is bound to the
+             endpoints following the backend.""")
+    parser.add_argument(
+        "--profiles", nargs="+", choices=list(proxy.PROFILES),
+        default=list(proxy.PROFILES),
+        help="""The impairment profiles measured.""")
+    parser.add_argument(
+        "--tables", type=int, default=4,
+        help="""The number of tables played for each profile.""")
+    parser.add_argument(
+        "--duration", type=float, default=5,
+        help="""The duration of the measurement of each profile in
+             seconds.""")
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="""The seed of the deals, the bots and the impairments.""")
+    args = parser.parse_args()
+
+    backend, _, frontend = itertools.islice(
+        messaging.endpoints(args.endpoint), 3)
+    zmqctx = zmq.Context.instance()
+    codec = messaging.getCodec()
+    control_socket = zmqctx.socket(zmq.ROUTER)
+    event_socket = zmqctx.socket(zmq.PUB)
+    control_endpoint, event_endpoint = itertools.islice(
+        messaging.endpoints(backend), 2)
+    control_socket.bind(control_endpoint)
+    event_socket.bind(event_endpoint)
+    publications = _PublicationRecorder(event_socket, codec)
+    backend_server = server.Server(
+        control_socket, publications, codec=codec, seed=args.seed)
+    impairment_proxy = proxy.ImpairmentProxy(
+        frontend, backend, seed=args.seed)
+    threads = [
+        threading.Thread(target=backend_server.run),
+        threading.Thread(target=impairment_proxy.run),
+    ]
+    for thread in threads:
+        thread.start()
+
+    fractions = (0.5, 0.9, 0.99)
+    print("%-10s %17s %26s %8s" % (
+        "", "join p50/p90 ms", "event p50/p90/p99 ms", "errors"))
+    try:
+        for name in args.profiles:
+            impairment_proxy.setProfile(proxy.PROFILES[name])
+            join_latencies, event_latencies, errors = _measure(
+                backend, frontend, publications, args.tables, args.duration,
+                args.seed)
+            print("%-10s %17s %26s %8d" % (
+                name, _format_latencies(join_latencies, fractions[:2]),
+                _format_latencies(event_latencies, fractions), errors))
+    finally:
+        backend_server.stop()
+        impairment_proxy.stop()
+        for thread in threads:
+            thread.join()
+        zmqctx.destroy(linger=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,63 +5,51 @@ project. The usage is documented when the script is run with the -h argument.
 """
 
 import argparse
+import asyncio
+import concurrent.futures
+import itertools
 import json
 import logging
 import re
 import sys
-import uuid
+import threading
+import time
 
-from PyQt5.QtCore import QSocketNotifier, QTimer
+from PyQt5.QtCore import pyqtSignal, QSocketNotifier, QTimer
 from PyQt5.QtWidgets import (
     QApplication, QHBoxLayout, QMainWindow, QMessageBox, QVBoxLayout, QWidget)
 import zmq
 
 import bridgegui.bidding as bidding
 import bridgegui.cards as cards
+import bridgegui.client as client
+from bridgegui.client import CLIENT_TAG, HELLO_COMMAND
 import bridgegui.messaging as messaging
-from bridgegui.messaging import sendCommand
-import bridgegui.positions as positions
 from bridgegui.positions import POSITION_TAGS
+import bridgegui.recording as recording
 import bridgegui.score as score
 import bridgegui.tricks as tricks
+import bridgegui.worker as worker
 
-HELLO_COMMAND = b'bridgehlo'
-GAME_COMMAND = b'game'
-JOIN_COMMAND = b'join'
-INITGET_COMMAND = b'initget'
-GET_COMMAND = b'get'
-DEAL_COMMAND = b'deal'
-CALL_COMMAND = b'call'
-BIDDING_COMMAND = b'bidding'
-PLAY_COMMAND = b'play'
-TURN_COMMAND = b'turn'
-DUMMY_COMMAND = b'dummy'
-TRICK_COMMAND = b'trick'
-DEALEND_COMMAND = b'dealend'
-PLAYER_COMMAND = b'player'
-
-CLIENT_TAG = "client"
-POSITION_TAG = "position"
-GAME_TAG = "game"
-PUBSTATE_TAG = "pubstate"
-PRIVSTATE_TAG = "privstate"
-SELF_TAG = "self"
-POSITION_IN_TURN_TAG = "positionInTurn"
-ALLOWED_CALLS_TAG = "allowedCalls"
-CALLS_TAG = "calls"
-DECLARER_TAG = "declarer"
-CONTRACT_TAG = "contract"
-ALLOWED_CARDS_TAG = "allowedCards"
-CARDS_TAG = "cards"
-TRICKS_TAG = "tricks"
-VULNERABILITY_TAG = "vulnerability"
-
-class BridgeWindow(QMainWindow):
-    """The main window of the birdge frontend"""
+HEARTBEAT_INTERVAL = 2
+PROBE_TIMEOUT = 1
+REPLAY_ENDPOINT = "inproc://bridgegui-replay"
+
+class BridgeWindow(QMainWindow, client.GameObserver):
+    """The main window of the birdge frontend
+
+    The communication with the backend and the game state are handled by
+    client.GameClient. The window drives the client from the Qt event loop,
+    and observes the state to update the widgets.
+    """
+
+    _messagesDecoded = pyqtSignal()
 
     def __init__(
             self, control_socket, event_socket, position, game_uuid,
-            create_game, player_uuid):
+            create_game, player_uuid, card_atlas=False, use_asyncio=False,
+            codec=None, pipelined_startup=False, endpoints=(),
+            io_thread=False):
         """Initialize BridgeWindow
 
         Keyword Arguments:
@@ -70,42 +58,157 @@ class BridgeWindow(QMainWindow):
         position       -- the preferred position
         game_uuid      -- the UUID of the game to be joined (optional)
         create_game    -- flag indicating whether the client should create a new game
+        card_atlas     -- flag indicating whether the cards are drawn from an atlas
+        use_asyncio    -- flag indicating whether the messages are handled in asyncio
+                          tasks instead of socket notifiers (requires running
+                          asyncio event loop integrated with Qt)
+        codec          -- the codec used to serialize messages (optional, see
+                          messaging.getCodec())
+        pipelined_startup -- flag indicating whether the commands needed to
+                          join the game are sent without waiting for the
+                          replies to the earlier ones
+        endpoints      -- list of (control endpoint, event endpoint) pairs
+                          of the backends in the order of preference. If
+                          given, the sockets are connected to the first
+                          backend by the window, and moved to the next one if
+                          the connection is lost. Otherwise the sockets are
+                          expected to be connected already. (optional)
+        io_thread      -- flag indicating whether the messages are received
+                          and decoded in a separate thread
         """
         super().__init__()
-        self._position = None
-        self._preferred_position = position
-        self._game_uuid = game_uuid
-        self._player_uuid = player_uuid if player_uuid else str(uuid.uuid4())
-        self._create_game = create_game
+        self._card_atlas = cards.CardAtlas() if card_atlas else None
+        self._use_asyncio = use_asyncio
+        self._worker = worker.MessageWorker(self) if io_thread else None
+        # With the worker thread all messages are already decoded off the GUI
+        # thread
+        self._executor = (
+            None if self._worker else concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="bridgegui-decoder"))
         self._timer = QTimer(self)
         self._timer.setInterval(1000)
-        self._init_sockets(control_socket, event_socket)
+        self._timer.timeout.connect(self._handle_messages)
+        control_socket, event_socket = self._init_sockets(
+            control_socket, event_socket)
+        self._client = client.GameClient(
+            control_socket, event_socket, position, game_uuid, create_game,
+            player_uuid, codec, pipelined_startup, endpoints, observer=self,
+            executor=self._executor,
+            offloadCallback=self._messagesDecoded.emit)
         self._init_widgets()
+        self._client.start()
+        self._schedule_timeouts()
         self.setWindowTitle("Bridge") # TODO: Localization
         self.show()
-        self._timer.start()
+        cards.CARD_IMAGES.warmUp()
+        if not self._use_asyncio:
+            self._timer.start()
+
+    def closeEvent(self, event):
+        """Stop the message worker and the decoder before closing the window"""
+        if self._worker:
+            self._worker.stop()
+            self._worker = None
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        super().closeEvent(event)
+
+    def messageQueueAdded(self, socket, message_queue):
+        """Start receiving messages from the socket"""
+        if isinstance(socket, worker.SocketProxy):
+            self._worker.addQueue(socket, message_queue)
+            return
+        if self._use_asyncio:
+            self._message_tasks.append(
+                asyncio.ensure_future(
+                    self._handle_messages_async(message_queue)))
+            return
+        socket_notifier = QSocketNotifier(socket.fd, QSocketNotifier.Read, self)
+        socket_notifier.activated.connect(self._handle_messages)
+        self._socket_notifiers.append(socket_notifier)
+        # The notifier is edge triggered, so the messages already in the queue
+        # would not be noticed until the next message arrives
+        QTimer.singleShot(0, self._handle_messages)
+
+    def connectionStateChanged(self, connected):
+        """Show the connection state in the status bar"""
+        if not connected:
+            # TODO: Localization
+            self.statusBar().showMessage("Connection lost. Reconnecting...")
+        else:
+            self.statusBar().clearMessage()
+
+    def positionChanged(self, position):
+        """Lay the cards of the player at the bottom of the card area"""
+        self._card_area.setPlayerPosition(position)
+
+    def positionInTurnChanged(self, position):
+        """Mark the position in turn"""
+        self._card_area.setPositionInTurn(position)
+
+    def allowedCallsChanged(self, calls):
+        """Enable the allowed calls in the call panel"""
+        self._call_panel.setAllowedCalls(calls)
+
+    def callsChanged(self, calls):
+        """Display the calls in the call table"""
+        self._call_table.setCalls(calls)
+
+    def callAdded(self, position, call):
+        """Add the call to the call table"""
+        self._call_table.addCall(position, call)
+
+    def biddingResultChanged(self, declarer, contract):
+        """Display the bidding result"""
+        self._bidding_result_label.setBiddingResult(declarer, contract)
+
+    def cardsChanged(self, cards):
+        """Display the hands"""
+        self._card_area.setCards(cards)
+
+    def allowedCardsChanged(self, cards):
+        """Enable the allowed cards in the hands"""
+        self._card_area.setAllowedCards(cards)
+
+    def cardPlayed(self, position, card):
+        """Move the card from the hand to the trick"""
+        self._card_area.playCard(position, card)
+
+    def trickChanged(self, trick):
+        """Display the current trick"""
+        self._card_area.setTrick(trick)
+
+    def tricksWonChanged(self, tricksWon):
+        """Display the number of tricks won"""
+        self._tricks_won_label.setTricksWon(tricksWon)
+
+    def trickCompleted(self, winner):
+        """Award the trick to the partnership of the winner"""
+        self._tricks_won_label.addTrick(winner)
+
+    def vulnerabilityChanged(self, vulnerability):
+        """Display the vulnerabilities in the call table"""
+        self._call_table.setVulnerability(vulnerability)
+
+    def dealEnded(self, result):
+        """Add the result to the score table"""
+        self._score_table.addResult(result)
 
     def _init_sockets(self, control_socket, event_socket):
-        logging.info("Initializing message handlers")
-        zmqctx = zmq.Context.instance()
         self._socket_notifiers = []
-        self._control_socket = control_socket
-        self._control_socket_queue = messaging.MessageQueue(
-            control_socket, "control socket queue",
-            messaging.validateControlReply,
-            {
-                HELLO_COMMAND: self._handle_hello_reply,
-                GAME_COMMAND: self._handle_game_reply,
-                JOIN_COMMAND: self._handle_join_reply,
-                INITGET_COMMAND: self._handle_init_get_reply,
-                GET_COMMAND: self._handle_get_reply,
-                CALL_COMMAND: self._handle_call_reply,
-                PLAY_COMMAND: self._handle_play_reply,
-            })
-        self._connect_socket_to_notifier(
-            control_socket, self._control_socket_queue)
-        self._event_socket = event_socket
-        sendCommand(control_socket, HELLO_COMMAND, version="0.1", role=CLIENT_TAG)
+        self._message_tasks = []
+        self._handle_messages_scheduled = False
+        self._messagesDecoded.connect(self._handle_messages)
+        if self._worker:
+            self._worker.messagesDecoded.connect(self._dispatch_messages)
+            self._worker.start()
+            # The sockets are owned by the worker thread from now on
+            control_socket = self._worker.createProxy(control_socket)
+            event_socket = self._worker.createProxy(event_socket)
+        self._timeout_timer = QTimer(self)
+        self._timeout_timer.setSingleShot(True)
+        self._timeout_timer.timeout.connect(self._handle_timeouts)
+        return control_socket, event_socket
 
     def _init_widgets(self):
         logging.info("Initializing widgets")
@@ -122,238 +225,69 @@ class BridgeWindow(QMainWindow):
         self._tricks_won_label = tricks.TricksWonLabel(self._central_widget)
         self._bidding_layout.addWidget(self._tricks_won_label)
         self._layout.addLayout(self._bidding_layout)
-        self._card_area = cards.CardArea(self._central_widget)
+        self._card_area = cards.CardArea(self._central_widget, self._card_atlas)
         for hand in self._card_area.hands():
             hand.cardPlayed.connect(self._send_play_command)
         self._layout.addWidget(self._card_area)
         self._score_table = score.ScoreTable(self._central_widget)
         self._layout.addWidget(self._score_table)
         self.setCentralWidget(self._central_widget)
-        self._counter = None
-
-    def _is_stale_event(self, counter):
-        if not counter:
-            return False
-        elif self._counter and self._counter > counter:
-            logging.debug(
-                "Stale event, counter: %r, self._counter %r",
-                counter, self._counter)
-            return True
-        else:
-            return False
-
-    def _get_event_type(self, name):
-        return self._game_uuid.encode() + b':' + name
-
-    def _init_game(self, game_uuid):
-        self._game_uuid = game_uuid
-        self._event_socket.setsockopt(zmq.SUBSCRIBE, game_uuid.encode())
-        self._event_socket_queue = messaging.MessageQueue(
-            self._event_socket, "event socket queue", messaging.validateEventMessage,
-            {
-                self._get_event_type(DEAL_COMMAND): self._handle_deal_event,
-                self._get_event_type(TURN_COMMAND): self._handle_turn_event,
-                self._get_event_type(CALL_COMMAND): self._handle_call_event,
-                self._get_event_type(BIDDING_COMMAND): self._handle_bidding_event,
-                self._get_event_type(PLAY_COMMAND): self._handle_play_event,
-                self._get_event_type(DUMMY_COMMAND): self._handle_dummy_event,
-                self._get_event_type(TRICK_COMMAND): self._handle_trick_event,
-                self._get_event_type(DEALEND_COMMAND): self._handle_dealend_event,
-                self._get_event_type(PLAYER_COMMAND): self._handle_player_event,
-            })
-
-    def _start_handling_events(self):
-        self._connect_socket_to_notifier(
-            self._event_socket, self._event_socket_queue)
-
-    def _connect_socket_to_notifier(self, socket, message_queue):
-        def _handle_message_to_queue():
-            if not message_queue.handleMessages():
-                # TODO: Localization
-                QMessageBox.warning(
-                    self, "Server error",
-                    "Error while receiving message from server. Please see logs.")
-                self._timer.timeout.disconnect(_handle_message_to_queue)
-        socket_notifier = QSocketNotifier(socket.fd, QSocketNotifier.Read, self)
-        socket_notifier.activated.connect(_handle_message_to_queue)
-        self._timer.timeout.connect(_handle_message_to_queue)
-        self._socket_notifiers.append(socket_notifier)
 
-    def _request(self, *args):
-        sendCommand(
-            self._control_socket, GET_COMMAND, game=self._game_uuid,
-            player=self._player_uuid, get=args)
-
-    def _send_join_command(self):
-        kwargs = {}
-        if self._preferred_position:
-            kwargs[POSITION_TAG] = self._preferred_position
-        if self._game_uuid:
-            kwargs[GAME_TAG] = self._game_uuid
-        sendCommand(
-            self._control_socket, JOIN_COMMAND,
-            player=self._player_uuid, **kwargs)
-
-    def _send_call_command(self, call):
-        sendCommand(
-            self._control_socket, CALL_COMMAND, game=self._game_uuid,
-            player=self._player_uuid, call=call)
-
-    def _send_play_command(self, card):
-        sendCommand(
-            self._control_socket, PLAY_COMMAND, game=self._game_uuid,
-            player=self._player_uuid, card=card._asdict())
-
-    def _handle_hello_reply(self, **kwargs):
-        logging.info("Handshake successful")
-        if self._create_game:
-            kwargs = { 'game': self._game_uuid } if self._game_uuid else {}
-            sendCommand(self._control_socket, GAME_COMMAND, **kwargs)
+    async def _handle_messages_async(self, message_queue):
+        while True:
+            try:
+                await message_queue.waitForMessages()
+            except zmq.ContextTerminated: # It's okay as we're about to exit
+                return
+            self._handle_messages()
+            await asyncio.sleep(0)
+
+    def _handle_messages(self):
+        self._handle_messages_scheduled = False
+        self._check_server_error(self._client.handleMessages())
+        self._schedule_timeouts()
+        if (self._client.hasMessages() and
+                not self._handle_messages_scheduled):
+            # Let Qt process other events before handling the rest
+            self._handle_messages_scheduled = True
+            QTimer.singleShot(0, self._handle_messages)
+
+    def _dispatch_messages(self, message_queue, messages):
+        self._check_server_error(
+            self._client.dispatchMessages(message_queue, messages))
+        self._schedule_timeouts()
+
+    def _handle_timeouts(self):
+        self._check_server_error(self._client.handleTimeouts())
+        self._schedule_timeouts()
+
+    def _schedule_timeouts(self):
+        deadline = self._client.nextDeadline()
+        if deadline is None:
+            self._timeout_timer.stop()
         else:
-            self._send_join_command()
-
-    def _handle_game_reply(self, game=None, **kwargs):
-        logging.info("Created game %r", game)
-        self._game_uuid = game
-        self._send_join_command()
-
-    def _handle_join_reply(self, game=None, **kwargs):
-        logging.info("Joined game %r", game)
-        if game:
-            self._init_game(game)
-            sendCommand(
-                self._control_socket, GET_COMMAND, INITGET_COMMAND,
-                game=game, player=self._player_uuid)
-        else:
-            logging.error("Unable to join game")
+            timeout = max(0, deadline - time.monotonic())
+            self._timeout_timer.start(int(timeout * 1000) + 1)
 
-    def _handle_init_get_reply(self, get=None, counter=None, **kwargs):
-        self._handle_get_reply(get, counter, **kwargs)
-        self._start_handling_events()
+    def _check_server_error(self, success):
+        if not success:
+            self._timer.stop()
+            self._show_server_error()
 
-    def _handle_get_reply(self, get=None, counter=None, **kwargs):
-        if counter is not None:
-            self._counter = counter
-        else:
-            logging.warning("No counter included in get reply")
-        missing = object()
-        pubstate = get.get(PUBSTATE_TAG) or {}
-        privstate = get.get(PRIVSTATE_TAG) or {}
-        _self = get.get(SELF_TAG) or {}
-        position = _self.get(POSITION_TAG, missing)
-        if position is not missing and position != self._position:
-            self._position = position
-            self._card_area.setPlayerPosition(position)
-        position_in_turn = _self.get(POSITION_IN_TURN_TAG, missing)
-        if position_in_turn is not missing:
-            self._card_area.setPositionInTurn(position_in_turn)
-        allowed_calls = _self.get(ALLOWED_CALLS_TAG, missing)
-        if allowed_calls is not missing:
-            self._call_panel.setAllowedCalls(allowed_calls)
-        calls = pubstate.get(CALLS_TAG, missing)
-        if calls is not missing:
-            self._call_table.setCalls(calls)
-        declarer = pubstate.get(DECLARER_TAG, missing)
-        contract = pubstate.get(CONTRACT_TAG, missing)
-        if declarer is not missing and contract is not missing:
-            self._bidding_result_label.setBiddingResult(
-                declarer, contract)
-        cards = pubstate.get(CARDS_TAG, {})
-        cards.update(privstate.get(CARDS_TAG, {}))
-        if cards:
-            self._card_area.setCards(cards)
-        allowed_cards = _self.get(ALLOWED_CARDS_TAG, missing)
-        if allowed_cards is not missing:
-            self._card_area.setAllowedCards(allowed_cards)
-        tricks = pubstate.get(TRICKS_TAG, missing)
-        if tricks is not missing:
-            if tricks:
-                trick = tricks[-1].get("cards")
-                if trick:
-                    self._card_area.setTrick(trick)
-            tricks_won = {
-                partnership: 0 for partnership in positions.Partnership
-            }
-            for trick in tricks:
-                winner = trick.get("winner")
-                if winner:
-                    tricks_won[positions.partnershipFor(winner)] += 1
-            self._tricks_won_label.setTricksWon(tricks_won)
-        vulnerability = pubstate.get(VULNERABILITY_TAG, missing)
-        if vulnerability is not missing:
-            self._call_table.setVulnerability(vulnerability)
-
-    def _handle_call_reply(self, **kwargs):
-        logging.debug("Call successful")
-
-    def _handle_play_reply(self, **kwargs):
-        logging.debug("Play successful")
-
-    def _handle_deal_event(
-            self, opener=None, vulnerability=None, counter=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug("Cards dealt")
-        self._card_area.setPositionInTurn(opener)
-        self._call_table.setVulnerability(vulnerability)
-        self._bidding_result_label.setBiddingResult(None, None)
-        self._request(PUBSTATE_TAG, PRIVSTATE_TAG)
-
-    def _handle_turn_event(self, position=None, counter=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug("Position in turn: %r", position)
-        self._card_area.setPositionInTurn(position)
-        if position == self._position:
-            self._request(SELF_TAG)
-        else:
-            self._call_panel.setAllowedCalls([])
-            self._card_area.setAllowedCards([])
+    def _show_server_error(self):
+        # TODO: Localization
+        QMessageBox.warning(
+            self, "Server error",
+            "Error while receiving message from server. Please see logs.")
 
-    def _handle_call_event(
-            self, position=None, call=None, counter=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug("Call made. Position: %r, Call: %r", position, call)
-        self._call_table.addCall(position, call)
-
-    def _handle_bidding_event(
-            self, declarer=None, contract=None, counter=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug(
-            "Bidding completed. Declarer: %r, Contract: %r", declarer, contract)
-        self._bidding_result_label.setBiddingResult(declarer, contract)
-
-    def _handle_play_event(
-            self, position=None, card=None, counter=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug("Card played. Position: %r, Card: %r", position, card)
-        self._card_area.playCard(position, card)
-
-    def _handle_dummy_event(
-            self, counter=None, position=None, cards=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug("Dummy hand revealed")
-        self._card_area.setCards({ position: cards })
-
-    def _handle_trick_event(self, winner, counter=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug("Trick completed. Winner: %r", winner)
-        self._tricks_won_label.addTrick(winner)
+    def _send_call_command(self, call):
+        self._client.call(call)
+        self._schedule_timeouts()
 
-    def _handle_dealend_event(self, result, counter=None, **kwargs):
-        if self._is_stale_event(counter):
-            return
-        logging.debug("Deal ended. Result: %r", result)
-        self._score_table.addResult(result)
-        self._call_table.setCalls([])
+    def _send_play_command(self, card):
+        self._client.play(card)
+        self._schedule_timeouts()
 
-    def _handle_player_event(self, player, position, **kwargs):
-        logging.debug("Player joined. Player: %r. Position: %r", player, position)
 
 def _get_key_from_file(f):
     if f:
@@ -365,9 +299,14 @@ def main():
     parser = argparse.ArgumentParser(
         description="A lightweight bridge application")
     parser.add_argument(
-        "endpoint",
+        "endpoint", nargs="*",
         help="""Base endpoint of the bridge backend. Follows ZeroMQ transmit
-             protocol syntax. For example: tcp://bridge.example.com:5555""")
+             protocol syntax. For example: tcp://bridge.example.com:5555. The
+             ipc and inproc transports are also supported, for example:
+             ipc:///run/bridge/control. If several endpoints are given, the
+             backend with the lowest round trip time is connected to, and the
+             others are used if the connection is lost. Required unless
+             --replay is given.""")
     parser.add_argument(
         "--server-key-file",
         help="""File to read CURVE server key from. If provided, the sockets are
@@ -403,6 +342,54 @@ def main():
     parser.add_argument(
         '--player',
         help="""UUID of the player. If omitted, an UUID is generated.""")
+    parser.add_argument(
+        '--card-atlas', action="store_true",
+        help="""If given, the cards are drawn from a single pixmap containing
+             all card images. This reduces the cost of painting on slow
+             graphics systems.""")
+    parser.add_argument(
+        '--asyncio', action="store_true",
+        help="""If given, the messages from the backend are handled in an
+             asyncio event loop running on top of the Qt event loop instead of
+             socket notifiers. Requires the qasync package.""")
+    parser.add_argument(
+        '--codec', choices=[codec.name for codec in messaging.CODECS],
+        help="""The codec used to serialize messages. If omitted, the fastest
+             available codec is used.""")
+    parser.add_argument(
+        '--pipelined-startup', action="store_true",
+        help="""If given, the commands needed to join the game are sent without
+             waiting for the replies to the earlier commands. This reduces the
+             time to join the game over high latency connections.""")
+    parser.add_argument(
+        '--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL,
+        help="""Interval in seconds of the heartbeats sent to the backend. If
+             the backend does not respond in three intervals, the connection
+             is considered lost, and the application reconnects and resumes
+             the game. Zero disables heartbeats.""")
+    parser.add_argument(
+        '--probe-timeout', type=float, default=PROBE_TIMEOUT,
+        help="""Time in seconds to wait for the backends to reply to the
+             handshake when several endpoints are given.""")
+    parser.add_argument(
+        '--io-thread', action="store_true",
+        help="""If given, the messages from the backend are received and
+             decoded in a separate thread, and only the decoded messages are
+             handled in the GUI thread.""")
+    parser.add_argument(
+        '--record',
+        help="""File the messages sent to and received from the backend are
+             recorded to. The session is appended to the file if it
+             exists.""")
+    parser.add_argument(
+        '--replay',
+        help="""File the session replayed instead of connecting to a backend is
+             read from. The first session in the file is replayed.""")
+    parser.add_argument(
+        '--replay-speed', type=float,
+        help="""The speed of the replay relative to the recorded timestamps,
+             for example 1 for real time. If omitted, the session is replayed
+             as fast as possible.""")
     parser.add_argument(
         "--verbose", "-v", action="count", default=0,
         help="""Increase logging levels. Repeat for even more logging.""")
@@ -416,27 +403,104 @@ def main():
     logging.basicConfig(
         format='%(asctime)s %(levelname)-8s %(message)s', level=logging_level)
 
+    if not args.endpoint and not args.replay:
+        parser.error("endpoint is required unless --replay is given")
+    replayer = None
+    if args.replay:
+        try:
+            replayer = recording.Replayer(
+                recording.readSession(args.replay), REPLAY_ENDPOINT,
+                speed=args.replay_speed)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        args.endpoint = [REPLAY_ENDPOINT]
+        args.game = replayer.gameUuid()
+        args.create_game = False
+    recorder = None
+    if args.record:
+        try:
+            recorder = recording.Recorder(args.record)
+        except OSError as e:
+            parser.error(str(e))
+        messaging.setRecorder(recorder)
+
     logging.info("Initializing sockets")
     zmqctx = zmq.Context.instance()
-    endpoint_generator = messaging.endpoints(args.endpoint)
-    control_socket = zmqctx.socket(zmq.DEALER)
     curve_server_key = _get_key_from_file(args.server_key_file)
     curve_secret_key = _get_key_from_file(args.secret_key_file)
     curve_public_key = _get_key_from_file(args.public_key_file)
-    messaging.setupCurve(control_socket, curve_server_key, curve_secret_key, curve_public_key)
-    control_socket.connect(next(endpoint_generator))
+    def _setup_control_socket(socket):
+        messaging.setupCurve(
+            socket, curve_server_key, curve_secret_key, curve_public_key)
+    base_endpoints = args.endpoint
+    try:
+        endpoints = [
+            tuple(itertools.islice(messaging.endpoints(base), 2))
+            for base in base_endpoints]
+    except ValueError as e:
+        parser.error(str(e))
+    if len(base_endpoints) > 1:
+        logging.info("Probing backends")
+        reachable = [
+            base for (_, base) in messaging.probeEndpoints(
+                base_endpoints, HELLO_COMMAND, args.probe_timeout,
+                _setup_control_socket, zmqctx, version="0.1", role=CLIENT_TAG)]
+        if not reachable:
+            logging.warning("No backend replied to the handshake")
+        # The backends that did not reply are still tried if the connection
+        # to the others is lost
+        order = reachable + [
+            base for base in base_endpoints if base not in reachable]
+        endpoints = [
+            endpoints[base_endpoints.index(base)] for base in order]
+    # The sockets are connected by the window
+    control_socket = zmqctx.socket(zmq.DEALER)
+    _setup_control_socket(control_socket)
+    messaging.setupHeartbeat(control_socket, args.heartbeat_interval)
     event_socket = zmqctx.socket(zmq.SUB)
     messaging.setupCurve(event_socket, curve_server_key)
-    event_socket.connect(next(endpoint_generator))
+    messaging.setupHeartbeat(event_socket, args.heartbeat_interval)
+
+    replay_thread = None
+    if replayer:
+        logging.info("Replaying %s", args.replay)
+        replay_thread = threading.Thread(
+            target=replayer.run, kwargs={"keepOpen": True})
+        replay_thread.start()
 
     logging.info("Starting main window")
     app = QApplication(sys.argv)
+    loop = None
+    if args.asyncio:
+        try:
+            import qasync
+        except ImportError:
+            parser.error("--asyncio requires the qasync package")
+        loop = qasync.QEventLoop(app)
+        asyncio.set_event_loop(loop)
+    try:
+        codec = messaging.getCodec(args.codec)
+    except ImportError:
+        parser.error("codec %s is not available" % args.codec)
     window = BridgeWindow(
         control_socket, event_socket, args.position, args.game,
-        args.create_game, args.player)
-    code = app.exec_()
+        args.create_game, args.player, args.card_atlas, args.asyncio, codec,
+        args.pipelined_startup, endpoints, args.io_thread)
+    if loop:
+        with loop:
+            loop.run_forever()
+        # The asyncio loop does not pass the exit code of the Qt event loop
+        code = 0
+    else:
+        code = app.exec_()
 
     logging.info("Main window closed. Closing sockets.")
+    if replay_thread:
+        replayer.stop()
+        replay_thread.join()
+    if recorder:
+        messaging.setRecorder(None)
+        recorder.close()
     zmqctx.destroy(linger=0)
     return code
 
@@ -0,0 +1,161 @@
+"""Utilities for handling calls
+
+This module contains functions that can be used to convert calls between the
+serialized representation specified by the bridge protocol specification, and
+the internal representation used by the frontend. The module does not depend
+on Qt, so it can also be used by clients without user interface.
+
+The internal call representation is Call named tuple, containing type and bid
+fields. The bid is either None or Bid named tuple, containing level and strain
+fields.
+
+Functions:
+asBid        -- convert serialized bid into internal representation
+asCall       -- convert serialized bid into internal representation
+makePass     -- make pass call object
+makeBid      -- make bid call object
+makeDouble   -- make double call object
+makeRedouble -- make redouble call object
+formatBid    -- retrieve human readable text representation of bid
+formatCall   -- retrieve human readable text representation of call
+"""
+
+from collections import namedtuple
+
+import bridgegui.messaging as messaging
+
+TYPE_TAG = "type"
+BID_TAG = "bid"
+LEVEL_TAG = "level"
+STRAIN_TAG = "strain"
+PASS_TAG = "pass"
+DOUBLE_TAG = "double"
+REDOUBLE_TAG = "redouble"
+CLUBS_TAG = "clubs"
+DIAMONDS_TAG = "diamonds"
+HEARTS_TAG = "hearts"
+SPADES_TAG = "spades"
+NOTRUMP_TAG = "notrump"
+BID_TAG = "bid"
+DOUBLING_TAG = "doubling"
+UNDOUBLED_TAG = "undoubled"
+DOUBLED_TAG = "doubled"
+REDOUBLED_TAG = "redoubled"
+
+TYPE_TAGS = (BID_TAG, PASS_TAG, DOUBLE_TAG, REDOUBLE_TAG)
+LEVELS = 7
+STRAIN_TAGS = (CLUBS_TAG, DIAMONDS_TAG, HEARTS_TAG, SPADES_TAG, NOTRUMP_TAG)
+DOUBLING_TAGS = (UNDOUBLED_TAG, DOUBLED_TAG, REDOUBLED_TAG)
+
+# TODO: Localization
+CALL_TYPE_FORMATS = { PASS_TAG: "PASS", DOUBLE_TAG: "X", REDOUBLE_TAG: "XX" }
+STRAIN_FORMATS = {
+    CLUBS_TAG: "C", DIAMONDS_TAG: "D", HEARTS_TAG: "H", SPADES_TAG: "S",
+    NOTRUMP_TAG: "NT"
+}
+DOUBLING_FORMATS = { UNDOUBLED_TAG: "", DOUBLED_TAG: "X", REDOUBLED_TAG: "XX" }
+
+Bid = namedtuple("Bid", [LEVEL_TAG, STRAIN_TAG])
+Call = namedtuple("Call", [TYPE_TAG, BID_TAG])
+
+def _make_call(type_, **kwargs):
+    kwargs.update({ TYPE_TAG: type_ })
+    return kwargs
+
+
+def asBid(bid):
+    """Convert serialized bid representation into Bid object
+
+    The serialized representation is a dictionary containing level and strain
+    keys (see bridge protocol specification). This function converts the
+    serialized representation into the representation used by this module, which
+    is a named tuple containing level and strain fields (in this order).
+
+    This function also does validation of the serialized bid, raising
+    ProtocolError if the format is not valid.
+
+    This function is idempotent, meaning that it is safe to call it with Bid
+    object.
+
+    Keyword Arguments:
+    bid -- bid object
+    """
+    if isinstance(bid, Bid):
+        return bid
+    try:
+        bid = Bid(bid[LEVEL_TAG], bid[STRAIN_TAG])
+    except Exception:
+        raise messaging.ProtocolError("Invalid bid: %r" % bid)
+    if not (0 <= bid.level <= LEVELS) or bid.strain not in STRAIN_TAGS:
+        raise messaging.ProtocolError(
+            "Invalid level or strain in bid: %r" % bid)
+    return bid
+
+
+def asCall(call):
+    """Convert serialized call representation into Call object
+
+    The serialized representation is a dictionary containing type and bid
+    keys (see bridge protocol specification). This function converts the
+    serialized representation into the representation used by this module, which
+    is a named tuple containing type and bid fields (in this order).
+
+    This function also does validation of the serialized call (and recursively
+    the bid if present), raising ProtocolError if the format is not valid.
+
+    This function is idempotent, meaning that it is safe to call it with Call
+    object.
+
+    Keyword Arguments:
+    call -- call object
+    """
+    if isinstance(call, Call):
+        return call
+    try:
+        type_ = call[TYPE_TAG]
+        if type_ == BID_TAG:
+            return Call(type_, asBid(call[BID_TAG]))
+    except Exception:
+        raise messaging.ProtocolError("Invalid call: %r" % call)
+    if type_ not in TYPE_TAGS:
+        raise messaging.ProtocolError(
+            "Invalid type in call: %r" % call)
+    return Call(type_, None)
+
+
+def makePass():
+    """Return Call object representing pass"""
+    return Call(PASS_TAG, None)
+
+
+def makeBid(level, strain):
+    """Return Call object representing bid
+
+    The function accepts level and strain as arguments
+    """
+    return Call(BID_TAG, Bid(level, strain))
+
+
+def makeDouble():
+    """Return Call object representing double"""
+    return Call(DOUBLE_TAG, None)
+
+
+def makeRedouble():
+    """Return Call object representing redouble"""
+    return Call(REDOUBLE_TAG, None)
+
+
+def formatBid(bid):
+    """Return human readable text representation of bid"""
+    bid = asBid(bid)
+    return "%d%s" % (bid.level, STRAIN_FORMATS[bid.strain])
+
+
+def formatCall(call):
+    """Return human readable text representation of call"""
+    call = asCall(call)
+    s = CALL_TYPE_FORMATS.get(call.type, None)
+    if s:
+        return s
+    return formatBid(call.bid)
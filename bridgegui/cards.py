@@ -1,57 +1,82 @@
 """Card widgets for bridge frontend
 
 This module contains widgets that are used to represent cards in hands and
-tricks.
+tricks. The functions for handling cards are defined in the Qt independent
+bridgegui.deck module, and are also available from this module.
 
 Functions:
 asCard -- convert serialized card into internal representation
 
 Classes:
-HandPanel  -- widget for presenting hand
-TrickPanel -- widget for presenting trick
-CardArea   -- widget that holds HandPanel and TrickPanel objects
+CardImageCache -- lazily loaded cache of card images
+CardAtlas      -- card images packed into single pixmap
+HandPanel      -- widget for presenting hand
+TrickPanel     -- widget for presenting trick
+CardArea       -- widget that holds HandPanel and TrickPanel objects
 """
 
 import itertools
-from collections import namedtuple
+import math
+from collections import OrderedDict
 
-from PyQt5.QtCore import pyqtSignal, QPoint, QRectF, Qt, QSize, QTimer
-from PyQt5.QtGui import QFont, QPainter
+from PyQt5.QtCore import pyqtSignal, QPoint, QPointF, QRectF, Qt, QSize, QTimer
+from PyQt5.QtGui import QFont, QImage, QPainter, QPixmap, QRegion
 from PyQt5.QtWidgets import QGridLayout, QLabel, QWidget
 
+# The card constants and functions used to be defined in this module, and are
+# re-exported for the code importing them from here
+from bridgegui.deck import (
+    RANK_TAG, SUIT_TAG, RANK_TAGS, SUIT_TAGS, Card, asCard)
 import bridgegui.messaging as messaging
 import bridgegui.positions as positions
 import bridgegui.util as util
 
 POSITION_TAG = "position"
 CARD_TAG = "card"
-RANK_TAG = "rank"
-SUIT_TAG = "suit"
 
-RANK_TAGS = (
-    "2", "3", "4", "5", "6", "7", "8", "9", "10", "jack", "queen", "king",
-    "ace"
-)
-SUIT_TAGS = ("clubs", "diamonds", "hearts", "spades")
+__all__ = [
+    "POSITION_TAG", "CARD_TAG", "RANK_TAG", "SUIT_TAG", "RANK_TAGS",
+    "SUIT_TAGS", "Card", "asCard", "CARD_IMAGES", "BACK_IMAGE_FILENAME",
+    "CardImageCache", "CardAtlas", "HandPanel", "TrickPanel", "CardArea",
+]
 
-Card = namedtuple("Card", (RANK_TAG, SUIT_TAG))
+BACK_IMAGE_FILENAME = "back.png"
 
-CARD_IMAGES = {}
-for rank, suit in itertools.product(RANK_TAGS, SUIT_TAGS):
-    card = Card(rank, suit)
-    CARD_IMAGES[card] = util.getImage("%s_of_%s.png" % (rank, suit))
-BACK_IMAGE = util.getImage("back.png")
+def _get_image_filename(card):
+    if card is None:
+        return BACK_IMAGE_FILENAME
+    return "%s_of_%s.png" % (card.rank, card.suit)
 
-_IMAGE_WIDTH = next(iter(CARD_IMAGES.values())).width()
-_IMAGE_HEIGHT = next(iter(CARD_IMAGES.values())).height()
+_IMAGE_SIZE = util.getImageSize(BACK_IMAGE_FILENAME)
+_IMAGE_WIDTH = _IMAGE_SIZE.width()
+_IMAGE_HEIGHT = _IMAGE_SIZE.height()
 _MARGIN = _IMAGE_WIDTH / 4
 
-def _draw_image(painter, rect, image, shift=False):
-    if shift:
-        rect = rect.adjusted(0, -_MARGIN, 0, -_MARGIN)
+def _draw_image(painter, rect, image):
     painter.drawImage(rect, image)
     painter.drawRect(rect)
 
+def _draw_cards(painter, cards, atlas=None):
+    if atlas:
+        atlas.drawCards(painter, cards)
+        return
+    for card, rect, opacity in cards:
+        painter.setOpacity(opacity)
+        _draw_image(painter, rect, CARD_IMAGES.image(card))
+
+def _raise_rect(rect):
+    return rect.adjusted(0, -_MARGIN, 0, -_MARGIN)
+
+def _get_painted_rect(rect):
+    # Area covered by a card, including the right and bottom edges of its border
+    return rect.adjusted(0, 0, 1, 1).toAlignedRect()
+
+def _size(width, height):
+    return QSize(int(width), int(height))
+
+def _point(x, y):
+    return QPoint(int(x), int(y))
+
 def _is_position(position):
     return position in positions.POSITION_TAGS or position in positions.Position
 
@@ -61,32 +86,158 @@ def _mark_turn(label, hasTurn):
     label.setFont(font)
 
 
-def asCard(card):
-    """Convert serialized card representation into Card object
+class CardImageCache:
+    """Cache for lazily loaded card images
 
-    The serialized representation is a dictionary containing rank and suit keys
-    (see bridge protocol specification). This function converts the serialized
-    representation into the representation used by this module, which is a named
-    tuple containing rank and suit fields (in this order).
+    Decoding the card images is postponed until they are first needed. The
+    cache holds at most maxSize images, discarding the least recently used
+    ones when the limit is reached. The images can also be loaded ahead of time
+    with warmUp(), which decodes them one by one while the event loop is idle.
+    """
 
-    This function also does validation of the serialized card, raising
-    ProtocolError if the format is not valid.
+    def __init__(self, maxSize=len(RANK_TAGS) * len(SUIT_TAGS) + 1):
+        """Initialize card image cache
 
-    This function is idempotent, meaning that it is safe to call it with Card
-    object.
+        Keyword Arguments:
+        maxSize -- the maximum number of images held in the cache
+        """
+        self._max_size = maxSize
+        self._images = OrderedDict()
+        self._warm_up_queue = []
+
+    def image(self, card):
+        """Return image for the card
+
+        The image is loaded if it is not already in the cache. If card is None,
+        the image for the back of a card is returned.
 
-    Keyword Arguments:
-    card -- card object
+        Keyword Arguments:
+        card -- the card (in the internal representation) or None
+        """
+        image = self._images.get(card)
+        if image is None:
+            image = util.getImage(_get_image_filename(card))
+            self._images[card] = image
+            while len(self._images) > self._max_size:
+                self._images.popitem(last=False)
+        else:
+            self._images.move_to_end(card)
+        return image
+
+    def loadedCards(self):
+        """Return list of cards whose images are currently in the cache"""
+        return list(self._images)
+
+    def warmUp(self):
+        """Start loading images in the background
+
+        The images not yet in the cache are loaded one at a time, letting the
+        event loop process other events in between. This method should be
+        called after the event loop has been started, for instance after the
+        main window has been shown.
+        """
+        cards = [
+            Card(rank, suit) for (suit, rank) in
+            itertools.product(SUIT_TAGS, RANK_TAGS)]
+        cards.append(None)
+        self._warm_up_queue = [
+            card for card in cards if card not in self._images][
+                :max(0, self._max_size - len(self._images))]
+        if self._warm_up_queue:
+            QTimer.singleShot(0, self._warm_up_next)
+
+    def _warm_up_next(self):
+        if not self._warm_up_queue:
+            return
+        card = self._warm_up_queue.pop()
+        if card not in self._images:
+            self.image(card)
+        if self._warm_up_queue:
+            QTimer.singleShot(0, self._warm_up_next)
+
+
+CARD_IMAGES = CardImageCache()
+
+
+class CardAtlas:
+    """Card images packed into single pixmap
+
+    The atlas contains all card faces and the back of a card (including the
+    card borders) in one pixmap, which is created on first use from the images
+    in CARD_IMAGES. The cards are then drawn with a single
+    QPainter.drawPixmapFragments() call, which is cheaper than drawing each
+    card from a separate image.
     """
-    if isinstance(card, Card):
-        return card
-    try:
-        card = Card(card[RANK_TAG], card[SUIT_TAG])
-    except Exception:
-        raise messaging.ProtocolError("Invalid card: %r" % card)
-    if card.rank not in RANK_TAGS or card.suit not in SUIT_TAGS:
-        raise messaging.ProtocolError("Invalid rank or suit in card: %r" % card)
-    return card
+
+    _TILE_WIDTH = _IMAGE_WIDTH + 1
+    _TILE_HEIGHT = _IMAGE_HEIGHT + 1
+
+    def __init__(self):
+        """Initialize card atlas"""
+        self._pixmap = None
+        self._source_rects = {}
+
+    def pixmap(self):
+        """Return the pixmap containing the card images"""
+        if self._pixmap is None:
+            self._pixmap = self._create_pixmap()
+        return self._pixmap
+
+    def sourceRect(self, card):
+        """Return rectangle of the card inside the pixmap
+
+        If card is None, the rectangle of the back of a card is returned.
+
+        Keyword Arguments:
+        card -- the card (in the internal representation) or None
+        """
+        self.pixmap()
+        return self._source_rects[card]
+
+    def drawCards(self, painter, cards):
+        """Draw cards using the atlas
+
+        The cards are given as an iterable of card, rect, opacity triples. The
+        cards are drawn in order, so the latter cards are drawn on top of the
+        earlier ones.
+
+        Keyword Arguments:
+        painter -- the painter used to draw the cards
+        cards   -- the card, rect, opacity triples
+        """
+        pixmap = self.pixmap()
+        offset = QPointF(self._TILE_WIDTH / 2, self._TILE_HEIGHT / 2)
+        fragments = [
+            QPainter.PixmapFragment.create(
+                rect.topLeft() + offset, self._source_rects[card], 1, 1, 0,
+                opacity)
+            for (card, rect, opacity) in cards]
+        if fragments:
+            painter.drawPixmapFragments(fragments, pixmap)
+
+    def _create_pixmap(self):
+        cards = [
+            Card(rank, suit) for (suit, rank) in
+            itertools.product(SUIT_TAGS, RANK_TAGS)]
+        cards.append(None)
+        columns = len(RANK_TAGS)
+        rows = (len(cards) + columns - 1) // columns
+        image = QImage(
+            columns * self._TILE_WIDTH, rows * self._TILE_HEIGHT,
+            QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        painter = QPainter()
+        painter.begin(image)
+        for n, card in enumerate(cards):
+            row, column = divmod(n, columns)
+            rect = QRectF(
+                column * self._TILE_WIDTH, row * self._TILE_HEIGHT,
+                _IMAGE_WIDTH, _IMAGE_HEIGHT)
+            _draw_image(painter, rect, CARD_IMAGES.image(card))
+            self._source_rects[card] = QRectF(
+                rect.x(), rect.y(), self._TILE_WIDTH, self._TILE_HEIGHT)
+        painter.end()
+        return QPixmap.fromImage(image)
 
 
 class HandPanel(QWidget):
@@ -94,18 +245,20 @@ class HandPanel(QWidget):
 
     cardPlayed = pyqtSignal(Card)
 
-    _VERTICAL_SIZE = QSize(_IMAGE_WIDTH + 1, _IMAGE_HEIGHT + 13 * _MARGIN + 1)
-    _HORIZONTAL_SIZE = QSize(
+    _VERTICAL_SIZE = _size(_IMAGE_WIDTH + 1, _IMAGE_HEIGHT + 13 * _MARGIN + 1)
+    _HORIZONTAL_SIZE = _size(
         _IMAGE_WIDTH + 12 * _MARGIN + 1, _IMAGE_HEIGHT + _MARGIN + 1)
 
-    def __init__(self, parent=None, vertical=False):
+    def __init__(self, parent=None, vertical=False, atlas=None):
         """Initialize hand panel
 
         Keyword Arguments:
         parent    -- the parent widget
         vecrtical -- if True, the cards should be laid out vertically
+        atlas     -- CardAtlas object used to draw the cards (optional)
         """
         super().__init__(parent)
+        self._atlas = atlas
         self.setMouseTracking(True)
         self.setMinimumSize(
             self._VERTICAL_SIZE if vertical else self._HORIZONTAL_SIZE)
@@ -113,6 +266,7 @@ class HandPanel(QWidget):
         self._cards = []
         self._allowed_cards = set()
         self._selected_card_n = None
+        self._pixmap = None
 
     def setCards(self, cards):
         """Set the cards held
@@ -134,18 +288,21 @@ class HandPanel(QWidget):
         cards.sort(key=get_key)
         new_cards = []
         for card, x in zip(cards, itertools.count(0, _MARGIN)):
-            image = CARD_IMAGES[card] if card else BACK_IMAGE
             point = (0, x + _MARGIN) if self._vertical else (x, _MARGIN)
             rect = QRectF(*point, _IMAGE_WIDTH, _IMAGE_HEIGHT)
-            new_cards.append((card, rect, image))
+            new_cards.append((card, rect))
         self._cards, self._allowed_cards = new_cards, set()
-        self.repaint()
+        self._selected_card_n = None
+        self._pixmap = None
+        self.update()
 
     def setAllowedCards(self, cards):
         """Set cards that are allowed to be played"""
         try:
             self._allowed_cards = {asCard(card) for card in cards}
-            self.repaint()
+            self._selected_card_n = None
+            self._pixmap = None
+            self.update()
         except:
             raise messaging.ProtocolError("Invalid allowed cards: %r" % cards)
 
@@ -172,7 +329,6 @@ class HandPanel(QWidget):
         if pop_n is not None:
             self._cards.pop(pop_n)
             self.setCards(card[0] for card in self._cards)
-            self.repaint()
 
     def cards(self):
         """Return list of cards and their rectangles
@@ -180,24 +336,45 @@ class HandPanel(QWidget):
         This method generates list of tuples containing cards and their
         corresponding rectangles, respectively, inside the panel.
         """
-        return [(card, rect) for (card, rect, _) in self._cards]
+        return list(self._cards)
 
     def paintEvent(self, event):
-        """Paint cards"""
+        """Paint cards
+
+        The cards are drawn from a cached pixmap, which is created when the
+        panel is painted the first time after the cards have changed. The
+        selected card is raised from the others, so the area it covers is
+        painted separately.
+        """
+        pixel_ratio = self.devicePixelRatioF()
+        if (self._pixmap is None or
+                self._pixmap.devicePixelRatioF() != pixel_ratio or
+                self._pixmap.size() != self.size() * pixel_ratio):
+            self._pixmap = self._create_pixmap(pixel_ratio)
         painter = QPainter()
         painter.begin(self)
-        for n, (card, rect, image) in enumerate(self._cards):
-            if self._allowed_cards and card not in self._allowed_cards:
-                painter.setOpacity(0.8)
-            else:
-                painter.setOpacity(1)
-            _draw_image(painter, rect, image, n == self._selected_card_n)
+        if self._selected_card_n is None:
+            painter.drawPixmap(0, 0, self._pixmap)
+        else:
+            region = self._get_card_region(self._selected_card_n)
+            painter.setClipRegion(QRegion(self.rect()).subtracted(region))
+            painter.drawPixmap(0, 0, self._pixmap)
+            painter.setClipRegion(region)
+            bounding_rect = QRectF(region.boundingRect())
+            cards = [
+                item for item in self._get_cards_to_draw(self._selected_card_n)
+                if item[1].intersects(bounding_rect)]
+            _draw_cards(painter, cards, self._atlas)
         painter.end()
 
     def mouseMoveEvent(self, event):
         """Handle mouse move event"""
+        selected_card_n = self._selected_card_n
         self._determine_selected_card(event)
-        self.repaint()
+        if selected_card_n != self._selected_card_n:
+            for n in (selected_card_n, self._selected_card_n):
+                if n is not None:
+                    self.update(self._get_card_region(n))
 
     def mousePressEvent(self, event):
         """Handle mouse press event"""
@@ -206,15 +383,54 @@ class HandPanel(QWidget):
             self.cardPlayed.emit(self._cards[self._selected_card_n][0])
             self._allowed_cards = set()
             self._selected_card_n = None
+            self._pixmap = None
+            self.update()
+
+    def _get_cards_to_draw(self, raised_card_n=None):
+        cards = []
+        for n, (card, rect) in enumerate(self._cards):
+            if self._allowed_cards and card not in self._allowed_cards:
+                opacity = 0.8
+            else:
+                opacity = 1
+            if n == raised_card_n:
+                rect = _raise_rect(rect)
+            cards.append((card, rect, opacity))
+        return cards
+
+    def _get_card_region(self, n):
+        # The region affected by raising the nth card
+        rect = self._cards[n][1]
+        return QRegion(_get_painted_rect(rect)).united(
+            QRegion(_get_painted_rect(_raise_rect(rect))))
+
+    def _create_pixmap(self, pixelRatio):
+        pixmap = QPixmap(self.size() * pixelRatio)
+        pixmap.setDevicePixelRatio(pixelRatio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter()
+        painter.begin(pixmap)
+        _draw_cards(painter, self._get_cards_to_draw(), self._atlas)
+        painter.end()
+        return pixmap
 
     def _determine_selected_card(self, event):
+        # The cards are laid out _MARGIN apart, so only the few cards whose
+        # offset along the hand is within one card length from the cursor
+        # can contain it. They are checked from the topmost card down.
         self._selected_card_n = None
-        pos = event.pos()
-        for n, (card, rect, image) in enumerate(reversed(self._cards)):
-            if rect.contains(pos):
-                if card in self._allowed_cards:
-                    self._selected_card_n = len(self._cards) - n - 1
-                    break
+        pos = QPointF(event.pos())
+        if self._vertical:
+            offset, length = pos.y() - _MARGIN, _IMAGE_HEIGHT
+        else:
+            offset, length = pos.x(), _IMAGE_WIDTH
+        last_n = min(math.floor(offset / _MARGIN), len(self._cards) - 1)
+        first_n = max(math.ceil((offset - length) / _MARGIN), 0)
+        for n in range(last_n, first_n - 1, -1):
+            card, rect = self._cards[n]
+            if rect.contains(pos) and card in self._allowed_cards:
+                self._selected_card_n = n
+                break
 
 
 class TrickPanel(QWidget):
@@ -233,17 +449,19 @@ class TrickPanel(QWidget):
             _IMAGE_WIDTH, _IMAGE_HEIGHT),
     )
 
-    _SIZE = QSize(
+    _SIZE = _size(
         _CARD_RECTS[3].x() + _IMAGE_WIDTH + 1,
         _CARD_RECTS[0].y() + _IMAGE_HEIGHT + 1)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, atlas=None):
         """Initialize trick panel
 
         Keyword Arguments:
         parent -- the parent widget
+        atlas  -- CardAtlas object used to draw the cards (optional)
         """
         super().__init__(parent)
+        self._atlas = atlas
         self.setMinimumSize(self._SIZE)
         self._rect_map = {}
         self._cards = []
@@ -283,7 +501,7 @@ class TrickPanel(QWidget):
         if new_cards:
             self._cards = new_cards
             self._timer.stop()
-            self.repaint()
+            self.update()
         elif self._cards:
             self._timer.start()
 
@@ -305,7 +523,7 @@ class TrickPanel(QWidget):
             card = asCard(card)
             self._cards.append((position, card))
             self._timer.stop()
-            self.repaint()
+            self.update()
         if len(self._cards) == len(positions.Position):
             self._timer.start()
 
@@ -322,12 +540,16 @@ class TrickPanel(QWidget):
         """Paint cards"""
         painter = QPainter()
         painter.begin(self)
-        for (position, card) in self._cards:
-            _draw_image(painter, self._rect_map[position], CARD_IMAGES[card])
+        _draw_cards(
+            painter,
+            [(card, self._rect_map[position], 1) for
+             (position, card) in self._cards],
+            self._atlas)
+        painter.end()
 
     def _clear_cards(self):
         del self._cards[:]
-        self.repaint()
+        self.update()
 
 
 class CardArea(QWidget):
@@ -338,43 +560,44 @@ class CardArea(QWidget):
     """
 
     _HAND_POSITIONS = (
-        QPoint(
+        _point(
             HandPanel._VERTICAL_SIZE.width(),
             (HandPanel._HORIZONTAL_SIZE.height() +
              HandPanel._VERTICAL_SIZE.height() + _MARGIN)),
-        QPoint(0, HandPanel._HORIZONTAL_SIZE.height() + _MARGIN),
-        QPoint(HandPanel._VERTICAL_SIZE.width(), 0),
-        QPoint(
+        _point(0, HandPanel._HORIZONTAL_SIZE.height() + _MARGIN),
+        _point(HandPanel._VERTICAL_SIZE.width(), 0),
+        _point(
             (HandPanel._HORIZONTAL_SIZE.width() +
              HandPanel._VERTICAL_SIZE.width()),
             HandPanel._HORIZONTAL_SIZE.height() + _MARGIN)
     )
 
-    _SIZE = QSize(
+    _SIZE = _size(
         _HAND_POSITIONS[3].x() + HandPanel._VERTICAL_SIZE.width(),
         _HAND_POSITIONS[0].y() + HandPanel._HORIZONTAL_SIZE.height())
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, atlas=None):
         """Initialize card area
 
         Keyword Arguments:
-        parent  -- the parent widget"""
+        parent  -- the parent widget
+        atlas   -- CardAtlas object used to draw the cards (optional)"""
         super().__init__(parent)
         self.setMinimumSize(self._SIZE)
         self._position_in_turn = None
         self._hand_panels = []
         self._hand_map = {}
         for n, point in enumerate(self._HAND_POSITIONS):
-            hand_panel = HandPanel(self, n % 2 == 1)
+            hand_panel = HandPanel(self, n % 2 == 1, atlas)
             hand_panel.move(point)
             self._hand_panels.append(hand_panel)
         self._position_labels = [
             self._get_position_label(position) for
             position in positions.Position]
-        self._trick_panel = TrickPanel(self)
+        self._trick_panel = TrickPanel(self, atlas)
         self._trick_panel.move(
-            (self._SIZE.width() - TrickPanel._SIZE.width()) / 2,
-            (self._SIZE.height() - TrickPanel._SIZE.height()) / 2)
+            (self._SIZE.width() - TrickPanel._SIZE.width()) // 2,
+            (self._SIZE.height() - TrickPanel._SIZE.height()) // 2)
 
     def setPlayerPosition(self, position):
         """Set position of the current player
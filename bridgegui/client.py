@@ -0,0 +1,1016 @@
+"""Headless client for bridge frontend
+
+This module contains the part of the frontend that communicates with the
+backend and keeps track of the game state. It does not depend on Qt, so the
+same client drives the main window and bots or spectators running without a
+display, any number of them in one process.
+
+The client never blocks. The application receives messages from the sockets
+reported with GameObserver.messageQueueAdded() (or returned by
+GameClient.sockets()) and calls GameClient.handleMessages() whenever they
+become readable. It also calls GameClient.handleTimeouts() at the time
+returned by GameClient.nextDeadline(). The deadline may change after any call
+to the client.
+
+Classes:
+GameObserver -- interface for observing the client and the game state
+GameState    -- model of the game state
+GameClient   -- client joining and following a game
+"""
+
+import logging
+import time
+import uuid
+
+import zmq
+
+import bridgegui.calls as calls
+import bridgegui.deck as deck
+import bridgegui.messaging as messaging
+from bridgegui.messaging import sendCommand
+import bridgegui.positions as positions
+import bridgegui.state as state
+
+HELLO_COMMAND = b'bridgehlo'
+GAME_COMMAND = b'game'
+JOIN_COMMAND = b'join'
+INITGET_COMMAND = b'initget'
+GET_COMMAND = b'get'
+DEAL_COMMAND = b'deal'
+CALL_COMMAND = b'call'
+BIDDING_COMMAND = b'bidding'
+PLAY_COMMAND = b'play'
+TURN_COMMAND = b'turn'
+DUMMY_COMMAND = b'dummy'
+TRICK_COMMAND = b'trick'
+DEALEND_COMMAND = b'dealend'
+PLAYER_COMMAND = b'player'
+
+CLIENT_TAG = "client"
+POSITION_TAG = "position"
+GAME_TAG = "game"
+PUBSTATE_TAG = "pubstate"
+PRIVSTATE_TAG = "privstate"
+SELF_TAG = "self"
+POSITION_IN_TURN_TAG = "positionInTurn"
+ALLOWED_CALLS_TAG = "allowedCalls"
+CALLS_TAG = "calls"
+CALL_TAG = "call"
+DECLARER_TAG = "declarer"
+CONTRACT_TAG = "contract"
+ALLOWED_CARDS_TAG = "allowedCards"
+CARDS_TAG = "cards"
+CARD_TAG = "card"
+TRICKS_TAG = "tricks"
+WINNER_TAG = "winner"
+VULNERABILITY_TAG = "vulnerability"
+
+MESSAGE_TIME_SLICE = 0.02
+FAILOVER_TIMEOUT = 5
+COMMAND_TIMEOUT = 10
+EVENT_GAP_TIMEOUT = 0.2
+# Replies at least this large (in bytes) are decoded in the executor given to
+# the client, so that joining a game in progress does not block the caller
+OFFLOAD_THRESHOLD = 8192
+
+_TRICK_SIZE = len(positions.Position)
+
+
+class GameObserver:
+    """Interface for observing the client and the game state
+
+    GameClient and GameState call the methods of their observer when the
+    state changes. The methods of this class do nothing, so observers only need
+    to override the notifications they are interested in.
+
+    The values are in the format of the bridge protocol specification, except
+    that the cards, calls and positions in hands and events may already be
+    converted into their internal representations.
+    """
+
+    def messageQueueAdded(self, socket, queue):
+        """Called when the client starts receiving messages from the socket
+
+        The messages are handled by GameClient.handleMessages(), so the
+        application needs to call it when the socket becomes readable.
+        """
+
+    def connectionStateChanged(self, connected):
+        """Called when the connection to the backend is lost or regained"""
+
+    def positionChanged(self, position):
+        """Called when the position of the player changes"""
+
+    def positionInTurnChanged(self, position):
+        """Called when the position in turn changes"""
+
+    def allowedCallsChanged(self, calls):
+        """Called when the calls the player is allowed to make change"""
+
+    def callsChanged(self, calls):
+        """Called when the whole list of calls changes"""
+
+    def callAdded(self, position, call):
+        """Called when a call is made"""
+
+    def biddingResultChanged(self, declarer, contract):
+        """Called when the declarer and the contract change"""
+
+    def cardsChanged(self, cards):
+        """Called with mapping from positions to the hands that changed"""
+
+    def allowedCardsChanged(self, cards):
+        """Called when the cards the player is allowed to play change"""
+
+    def cardPlayed(self, position, card):
+        """Called when a card is played"""
+
+    def trickChanged(self, trick):
+        """Called when the whole current trick changes"""
+
+    def tricksWonChanged(self, tricksWon):
+        """Called when the number of tricks won by the partnerships changes"""
+
+    def trickCompleted(self, winner):
+        """Called when a trick is completed"""
+
+    def vulnerabilityChanged(self, vulnerability):
+        """Called when the vulnerabilities change"""
+
+    def dealEnded(self, result):
+        """Called with the result of the deal when a deal ends"""
+
+
+class GameState:
+    """Model of the game state
+
+    GameClient updates the state from the replies and events received from
+    the backend. Each change is notified to the observer after the model has
+    been updated, so the observer can also read the rest of the state.
+    """
+
+    def __init__(self, observer=None):
+        """Initialize game state
+
+        Keyword Arguments:
+        observer -- the GameObserver notified of the changes (optional)
+        """
+        self._observer = observer or GameObserver()
+        self._position = None
+        self._position_in_turn = None
+        self._allowed_calls = []
+        self._calls = []
+        self._declarer = None
+        self._contract = None
+        self._cards = {}
+        self._allowed_cards = []
+        self._trick = []
+        self._tricks_won = {
+            partnership: 0 for partnership in positions.Partnership }
+        self._vulnerability = None
+        self._results = []
+
+    def position(self):
+        """Return the position of the player"""
+        return self._position
+
+    def setPosition(self, position):
+        """Set the position of the player"""
+        self._position = position
+        self._observer.positionChanged(position)
+
+    def positionInTurn(self):
+        """Return the position in turn"""
+        return self._position_in_turn
+
+    def setPositionInTurn(self, position):
+        """Set the position in turn"""
+        self._position_in_turn = position
+        self._observer.positionInTurnChanged(position)
+
+    def allowedCalls(self):
+        """Return the calls the player is allowed to make"""
+        return list(self._allowed_calls)
+
+    def setAllowedCalls(self, calls):
+        """Set the calls the player is allowed to make"""
+        self._allowed_calls = list(calls)
+        self._observer.allowedCallsChanged(calls)
+
+    def calls(self):
+        """Return the list of position call pairs made in the deal"""
+        return list(self._calls)
+
+    def setCalls(self, calls):
+        """Set the list of calls made in the deal"""
+        self._calls = list(calls)
+        self._observer.callsChanged(calls)
+
+    def addCall(self, position, call):
+        """Add a call made by the player in the position"""
+        self._calls.append({ POSITION_TAG: position, CALL_TAG: call })
+        self._observer.callAdded(position, call)
+
+    def declarer(self):
+        """Return the declarer, or None if the bidding is not completed"""
+        return self._declarer
+
+    def contract(self):
+        """Return the contract, or None if the bidding is not completed"""
+        return self._contract
+
+    def setBiddingResult(self, declarer, contract):
+        """Set the declarer and the contract"""
+        self._declarer = declarer
+        self._contract = contract
+        self._observer.biddingResultChanged(declarer, contract)
+
+    def cards(self):
+        """Return mapping from positions to the cards held by the players
+
+        The cards not visible to the player are None.
+        """
+        return { position: list(hand) for (position, hand) in self._cards.items() }
+
+    def setCards(self, cards):
+        """Set the hands of the positions in the mapping
+
+        The hands of the positions not included in the mapping are kept.
+        """
+        if not isinstance(cards, dict):
+            raise messaging.ProtocolError("Invalid cards format: %r" % cards)
+        cards = {
+            positions.asPosition(position): hand
+            for (position, hand) in cards.items()
+            if _is_position(position) and isinstance(hand, list)
+        }
+        self._cards.update(cards)
+        self._observer.cardsChanged(cards)
+
+    def allowedCards(self):
+        """Return the cards the player is allowed to play"""
+        return list(self._allowed_cards)
+
+    def setAllowedCards(self, cards):
+        """Set the cards the player is allowed to play"""
+        self._allowed_cards = list(cards)
+        self._observer.allowedCardsChanged(cards)
+
+    def playCard(self, position, card):
+        """Remove the card from the hand and add it to the current trick"""
+        hand = self._cards.get(positions.asPosition(position))
+        if hand is not None:
+            if card in hand:
+                hand.remove(card)
+            elif None in hand:
+                hand.remove(None)
+        if len(self._trick) >= _TRICK_SIZE:
+            self._trick = []
+        self._trick.append({ POSITION_TAG: position, CARD_TAG: card })
+        self._observer.cardPlayed(position, card)
+
+    def trick(self):
+        """Return the list of position card pairs in the current trick"""
+        return list(self._trick)
+
+    def setTrick(self, trick):
+        """Set the current trick"""
+        self._trick = list(trick)
+        self._observer.trickChanged(trick)
+
+    def tricksWon(self):
+        """Return mapping from partnerships to the number of tricks won"""
+        return dict(self._tricks_won)
+
+    def setTricksWon(self, tricksWon):
+        """Set the number of tricks won by each partnership"""
+        self._tricks_won = dict(tricksWon)
+        self._observer.tricksWonChanged(tricksWon)
+
+    def addTrick(self, winner):
+        """Award a trick to the partnership of the winner"""
+        self._tricks_won[positions.partnershipFor(winner)] += 1
+        self._observer.trickCompleted(winner)
+
+    def vulnerability(self):
+        """Return the vulnerabilities of the partnerships"""
+        return self._vulnerability
+
+    def setVulnerability(self, vulnerability):
+        """Set the vulnerabilities of the partnerships"""
+        self._vulnerability = vulnerability
+        self._observer.vulnerabilityChanged(vulnerability)
+
+    def results(self):
+        """Return the results of the deals played"""
+        return list(self._results)
+
+    def addResult(self, result):
+        """Add the result of a deal"""
+        self._results.append(result)
+        self._observer.dealEnded(result)
+
+
+class GameClient:
+    """Client joining and following a game
+
+    The client performs the handshake with the backend, joins (and optionally
+    creates) a game, and keeps GameState up to date from the replies and
+    events. It resumes the game after reconnecting, and moves to the next
+    backend if the connection cannot be restored (see bridge protocol
+    specification).
+    """
+
+    def __init__(
+            self, controlSocket, eventSocket, position=None, gameUuid=None,
+            createGame=False, playerUuid=None, codec=None,
+            pipelinedStartup=False, endpoints=(), observer=None, executor=None,
+            offloadCallback=None):
+        """Initialize game client
+
+        The client does not communicate with the backend before start() is
+        called.
+
+        Keyword Arguments:
+        controlSocket -- the control socket used to send commands
+        eventSocket   -- the event socket used to subscribe events
+        position      -- the preferred position (optional)
+        gameUuid      -- the UUID of the game to be joined (optional)
+        createGame    -- flag indicating whether the client should create a
+                         new game
+        playerUuid    -- the UUID of the player (optional)
+        codec         -- the codec used to serialize messages (optional, see
+                         messaging.getCodec())
+        pipelinedStartup -- flag indicating whether the commands needed to
+                         join the game are sent without waiting for the
+                         replies to the earlier ones
+        endpoints     -- list of (control endpoint, event endpoint) pairs of
+                         the backends in the order of preference. If given,
+                         the sockets are connected to the first backend by
+                         the client, and moved to the next one if the
+                         connection is lost. Otherwise the sockets are
+                         expected to be connected already. A game created by
+                         the client is created again on the next backend.
+                         (optional)
+        observer      -- the GameObserver notified of the changes (optional)
+        executor      -- the executor used to decode large replies (optional,
+                         see MessageQueue)
+        offloadCallback -- function called when decoding a reply in the
+                         executor has finished (optional, see MessageQueue)
+        """
+        self._observer = observer or GameObserver()
+        self._state = GameState(self._observer)
+        self._control_socket = controlSocket
+        self._event_socket = eventSocket
+        self._preferred_position = position
+        self._game_uuid = gameUuid
+        self._create_game = createGame
+        self._player_uuid = playerUuid if playerUuid else str(uuid.uuid4())
+        self._codec = codec or messaging.getCodec()
+        self._pipelined_startup = pipelinedStartup
+        self._endpoints = list(endpoints)
+        self._executor = executor
+        self._offload_callback = offloadCallback
+        self._sockets = []
+        self._message_scheduler = messaging.MessageScheduler()
+        self._tracker = state.StateTracker()
+        self._command_errors = False
+        self._disconnected = False
+        self._failed_over = False
+        self._failover_deadline = None
+        self._get_requests = messaging.RequestAggregator(self._send_get_command)
+        self._event_sequencer = messaging.EventSequencer(
+            self._resync, EVENT_GAP_TIMEOUT)
+        self._connection_monitor = None
+        self._control_socket_queue = None
+        self._event_socket_queue = None
+        self._handling_events = False
+
+    def start(self):
+        """Connect to the backend and start joining the game"""
+        logging.info("Initializing message handlers")
+        self._connection_monitor = messaging.ConnectionMonitor(
+            self._control_socket, "control socket monitor",
+            self._handle_connection_state)
+        self._add_queue(
+            self._connection_monitor.monitorSocket(), self._connection_monitor)
+        if self._endpoints:
+            # Connecting only after starting the monitor ensures that the
+            # monitor sees the first connection
+            control_endpoint, event_endpoint = self._endpoints[0]
+            logging.info("Connecting to %s", control_endpoint)
+            self._control_socket.connect(control_endpoint)
+            self._event_socket.connect(event_endpoint)
+        self._control_socket_queue = messaging.CommandQueue(
+            self._control_socket, "control socket queue",
+            {
+                HELLO_COMMAND: self._handle_hello_reply,
+                GAME_COMMAND: self._handle_game_reply,
+                JOIN_COMMAND: self._handle_join_reply,
+                INITGET_COMMAND: self._handle_init_get_reply,
+            }, timeout=COMMAND_TIMEOUT, timeSlice=MESSAGE_TIME_SLICE,
+            copy=False, codec=self._codec,
+            converters={
+                INITGET_COMMAND: _convert_get_reply,
+                GET_COMMAND: _convert_get_reply,
+            }, executor=self._executor, offloadThreshold=OFFLOAD_THRESHOLD,
+            offloadCallback=self._offload_callback)
+        self._add_queue(self._control_socket, self._control_socket_queue)
+        self._send_handshake()
+        if len(self._endpoints) > 1:
+            # Fail over also if the first connection cannot be established
+            self._start_failover_timer()
+
+    def state(self):
+        """Return the GameState of the client"""
+        return self._state
+
+    def gameUuid(self):
+        """Return the UUID of the game, or None if not known yet"""
+        return self._game_uuid
+
+    def playerUuid(self):
+        """Return the UUID of the player"""
+        return self._player_uuid
+
+    def endpoints(self):
+        """Return the endpoints, starting from the current backend"""
+        return list(self._endpoints)
+
+    def isConnected(self):
+        """Return the connection state, or None if not known yet"""
+        if self._connection_monitor is None:
+            return None
+        return self._connection_monitor.isConnected()
+
+    def sockets(self):
+        """Return the sockets the client receives messages from"""
+        return list(self._sockets)
+
+    def hasMessages(self):
+        """Return True if there are messages to be handled"""
+        return self._message_scheduler.hasMessages()
+
+    def handleMessages(self):
+        """Handle messages from the sockets
+
+        The messages are handled in the order of priority of the sockets, up
+        to the time slice of each queue. hasMessages() can be used to check
+        whether there are messages left. If handling any message or reply
+        results in an error, False is returned. Otherwise True is returned.
+        """
+        return self._finish_batch(self._message_scheduler.handleMessages())
+
+    def dispatchMessages(self, queue, messages):
+        """Dispatch messages decoded in another thread
+
+        Keyword Arguments:
+        queue    -- the message queue the messages were decoded with
+        messages -- the decoded messages (see MessageQueue.dispatchMessages())
+        """
+        return self._finish_batch(queue.dispatchMessages(messages))
+
+    def nextDeadline(self):
+        """Return the time handleTimeouts() needs to be called next
+
+        The time is compared to time.monotonic(). None is returned if there is
+        nothing to time out.
+        """
+        return min(
+            (deadline for deadline in (
+                self._control_socket_queue.nextDeadline(),
+                self._event_sequencer.nextDeadline(),
+                self._failover_deadline)
+             if deadline is not None), default=None)
+
+    def handleTimeouts(self, now=None):
+        """Handle the timeouts that have expired
+
+        Returns False if a command timed out, and True otherwise.
+
+        Keyword Arguments:
+        now -- the current time (default: time.monotonic())
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._failover_deadline is not None and now >= self._failover_deadline:
+            self._failover_deadline = None
+            self._fail_over()
+        self._control_socket_queue.expireCommands(now)
+        self._event_sequencer.checkGaps(now)
+        return self._finish_batch(True)
+
+    def call(self, call):
+        """Make a call
+
+        Returns future for the reply (see CommandQueue.sendCommand()).
+
+        Keyword Arguments:
+        call -- the call, either serialized or Call object
+        """
+        call = calls.asCall(call)
+        if call.bid is not None:
+            call = dict(call._asdict(), bid=call.bid._asdict())
+        else:
+            call = { calls.TYPE_TAG: call.type }
+        return self._send_tracked_command(
+            self._call_command, self._handle_call_reply, call=call)
+
+    def play(self, card):
+        """Play a card
+
+        Returns future for the reply (see CommandQueue.sendCommand()).
+
+        Keyword Arguments:
+        card -- the card, either serialized or Card object
+        """
+        return self._send_tracked_command(
+            self._play_command, self._handle_play_reply,
+            card=deck.asCard(card)._asdict())
+
+    def _add_queue(self, socket, message_queue):
+        # The queues are added to the scheduler in the order of priority, so
+        # the control socket queue is always served before the event queue
+        self._message_scheduler.addQueue(message_queue)
+        self._sockets.append(socket)
+        self._observer.messageQueueAdded(socket, message_queue)
+
+    def _finish_batch(self, success):
+        if self._command_errors:
+            self._command_errors = False
+            success = False
+        self._get_requests.flush()
+        return success
+
+    def _start_failover_timer(self):
+        self._failover_deadline = time.monotonic() + FAILOVER_TIMEOUT
+
+    def _handle_connection_state(self, connected):
+        if not connected:
+            logging.warning("Connection to the backend lost")
+            # The replies to the commands sent over the lost connection will
+            # never arrive
+            self._control_socket_queue.cancelCommands()
+            if len(self._endpoints) > 1:
+                self._start_failover_timer()
+        else:
+            self._failover_deadline = None
+            if self._disconnected:
+                logging.info("Reconnected to the backend")
+                self._resume()
+        self._disconnected = not connected
+        self._observer.connectionStateChanged(connected)
+
+    def _fail_over(self):
+        control_endpoint, event_endpoint = self._endpoints.pop(0)
+        self._endpoints.append((control_endpoint, event_endpoint))
+        next_control_endpoint, next_event_endpoint = self._endpoints[0]
+        logging.warning(
+            "Unable to reconnect to %s. Connecting to %s.",
+            control_endpoint, next_control_endpoint)
+        self._control_socket.disconnect(control_endpoint)
+        self._event_socket.disconnect(event_endpoint)
+        self._control_socket.connect(next_control_endpoint)
+        self._event_socket.connect(next_event_endpoint)
+        # The commands queued for the previous backend were dropped, so the
+        # handshake is done again once connected
+        self._control_socket_queue.cancelCommands()
+        self._disconnected = True
+        self._failed_over = True
+        # Keep trying the other backends until the connection is established
+        self._start_failover_timer()
+
+    def _resume(self):
+        failed_over, self._failed_over = self._failed_over, False
+        if self._event_socket_queue is None:
+            self._send_handshake()
+            return
+        # The backend identifies the client by the player UUID, so joining the
+        # same game again restores the seat. The full state is requested to
+        # catch up with the events missed while disconnected. Only the changed
+        # parts of the state are applied.
+        kwargs = self._get_join_arguments()
+        if self._state.position():
+            kwargs[POSITION_TAG] = self._state.position()
+        self._send_tracked_command(
+            HELLO_COMMAND, self._handle_pipelined_hello_reply, version="0.1",
+            role=CLIENT_TAG)
+        if failed_over:
+            # Another backend does not know the game, and its counters are
+            # unrelated to the ones seen so far. A game created by the client
+            # is created again with the same UUID, so that the event handlers
+            # stay valid. A game created by someone else can be rejoined only
+            # if the backend happens to know it.
+            self._tracker.reset()
+            self._event_sequencer.reset()
+            if self._create_game:
+                self._send_tracked_command(
+                    GAME_COMMAND, self._handle_pipelined_game_reply,
+                    game=self._game_uuid)
+        self._send_tracked_command(
+            JOIN_COMMAND, self._handle_rejoin_reply, **kwargs)
+        self._send_tracked_command(
+            self._get_command, self._handle_resync_reply,
+            _rollback=self._event_sequencer.resyncFailed)
+
+    def _handle_rejoin_reply(self, game=None, **kwargs):
+        logging.info("Rejoined game %r", game)
+        if game != self._game_uuid:
+            raise messaging.ProtocolError("Unable to rejoin game")
+
+    def _get_event_type(self, name):
+        return self._game_uuid.encode() + b':' + name
+
+    def _init_game(self, game_uuid):
+        self._game_uuid = game_uuid
+        self._get_command, self._call_command, self._play_command = (
+            messaging.PreparedCommand(
+                command, _codec=self._codec, game=game_uuid,
+                player=self._player_uuid)
+            for command in (GET_COMMAND, CALL_COMMAND, PLAY_COMMAND))
+        self._event_socket.setsockopt(zmq.SUBSCRIBE, game_uuid.encode())
+        self._event_socket_queue = messaging.MessageQueue(
+            self._event_socket, "event socket queue", messaging.validateEventMessage,
+            {
+                self._get_event_type(DEAL_COMMAND):
+                    self._sequenced(self._handle_deal_event),
+                self._get_event_type(TURN_COMMAND):
+                    self._sequenced(self._handle_turn_event),
+                self._get_event_type(CALL_COMMAND):
+                    self._sequenced(self._handle_call_event),
+                self._get_event_type(BIDDING_COMMAND):
+                    self._sequenced(self._handle_bidding_event),
+                self._get_event_type(PLAY_COMMAND):
+                    self._sequenced(self._handle_play_event),
+                self._get_event_type(DUMMY_COMMAND):
+                    self._sequenced(self._handle_dummy_event),
+                self._get_event_type(TRICK_COMMAND):
+                    self._sequenced(self._handle_trick_event),
+                self._get_event_type(DEALEND_COMMAND):
+                    self._sequenced(self._handle_dealend_event),
+                self._get_event_type(PLAYER_COMMAND): self._handle_player_event,
+            }, timeSlice=MESSAGE_TIME_SLICE, codec=self._codec,
+            converters={
+                self._get_event_type(command): converter
+                for (command, converter) in _EVENT_CONVERTERS.items()
+            })
+
+    def _sequenced(self, handler):
+        return lambda **kwargs: self._event_sequencer.handleEvent(
+            handler, **kwargs)
+
+    def _leave_game(self):
+        if self._event_socket_queue is not None:
+            self._event_socket.setsockopt(
+                zmq.UNSUBSCRIBE, self._game_uuid.encode())
+            self._event_socket_queue = None
+
+    def _start_handling_events(self):
+        if not self._handling_events:
+            self._handling_events = True
+            self._add_queue(self._event_socket, self._event_socket_queue)
+
+    def _send_command(self, command, **kwargs):
+        sendCommand(self._control_socket, command, _codec=self._codec, **kwargs)
+
+    def _send_tracked_command(self, command, handler, _rollback=None, **kwargs):
+        future = self._control_socket_queue.sendCommand(command, **kwargs)
+        future.add_done_callback(
+            lambda future: self._handle_command_reply(
+                handler, _rollback, future))
+        return future
+
+    def _handle_command_reply(self, handler, rollback, future):
+        if future.cancelled():
+            return
+        try:
+            handler(**future.result())
+        except (
+                messaging.ProtocolError, messaging.CommandFailure,
+                messaging.CommandTimeout) as e:
+            logging.error("%s", e)
+            self._command_errors = True
+            if rollback:
+                rollback()
+
+    def _send_handshake(self):
+        if self._pipelined_startup:
+            self._send_pipelined_handshake()
+        else:
+            self._send_command(HELLO_COMMAND, version="0.1", role=CLIENT_TAG)
+
+    def _send_pipelined_handshake(self):
+        # The backend handles the commands from the socket in order, so the
+        # whole handshake can be sent at once. If any of the commands fails,
+        # the replies to the later ones are no longer interesting.
+        logging.info("Sending handshake commands")
+        futures = []
+        def _rollback():
+            for future in futures:
+                future.cancel()
+            self._leave_game()
+        def _send(command, handler, **kwargs):
+            futures.append(
+                self._send_tracked_command(
+                    command, handler, _rollback=_rollback, **kwargs))
+        _send(
+            HELLO_COMMAND, self._handle_pipelined_hello_reply, version="0.1",
+            role=CLIENT_TAG)
+        if self._create_game:
+            # The UUID is generated here so that the join command can refer to
+            # the game before it has been created
+            if not self._game_uuid:
+                self._game_uuid = str(uuid.uuid4())
+            _send(
+                GAME_COMMAND, self._handle_pipelined_game_reply,
+                game=self._game_uuid)
+        _send(
+            JOIN_COMMAND, self._handle_pipelined_join_reply,
+            **self._get_join_arguments())
+        if self._game_uuid:
+            self._init_game(self._game_uuid)
+            _send(self._get_command, self._handle_init_get_reply)
+
+    def _handle_pipelined_hello_reply(self, **kwargs):
+        logging.info("Handshake successful")
+
+    def _handle_pipelined_game_reply(self, game=None, **kwargs):
+        logging.info("Created game %r", game)
+        if game != self._game_uuid:
+            raise messaging.ProtocolError(
+                "Unexpected game created: %r" % game)
+
+    def _handle_pipelined_join_reply(self, game=None, **kwargs):
+        logging.info("Joined game %r", game)
+        if not game:
+            raise messaging.ProtocolError("Unable to join game")
+        if self._event_socket_queue is None:
+            # The backend chose the game, so the initial state can be
+            # requested only now
+            self._init_game(game)
+            self._send_tracked_command(
+                self._get_command, self._handle_init_get_reply,
+                _rollback=self._leave_game)
+        elif game != self._game_uuid:
+            raise messaging.ProtocolError("Unexpected game joined: %r" % game)
+
+    def _request(self, *args, counter=None):
+        # The requests made while handling a batch of messages are sent
+        # together after the batch
+        self._get_requests.request(*args, counter=counter)
+
+    def _send_get_command(self, keys):
+        return self._send_tracked_command(
+            self._get_command, self._handle_get_reply, get=keys)
+
+    def _get_join_arguments(self):
+        kwargs = { 'player': self._player_uuid }
+        if self._preferred_position:
+            kwargs[POSITION_TAG] = self._preferred_position
+        if self._game_uuid:
+            kwargs[GAME_TAG] = self._game_uuid
+        return kwargs
+
+    def _send_join_command(self):
+        self._send_command(JOIN_COMMAND, **self._get_join_arguments())
+
+    def _handle_hello_reply(self, **kwargs):
+        logging.info("Handshake successful")
+        if self._create_game:
+            kwargs = { 'game': self._game_uuid } if self._game_uuid else {}
+            self._send_command(GAME_COMMAND, **kwargs)
+        else:
+            self._send_join_command()
+
+    def _handle_game_reply(self, game=None, **kwargs):
+        logging.info("Created game %r", game)
+        self._game_uuid = game
+        self._send_join_command()
+
+    def _handle_join_reply(self, game=None, **kwargs):
+        logging.info("Joined game %r", game)
+        if game:
+            self._init_game(game)
+            self._get_command.send(self._control_socket, INITGET_COMMAND)
+        else:
+            logging.error("Unable to join game")
+
+    def _handle_init_get_reply(self, get=None, counter=None, **kwargs):
+        self._handle_full_get_reply(get, counter)
+
+    def _resync(self, counter):
+        # The events since the counter were lost, so the whole state is
+        # requested again
+        self._send_tracked_command(
+            self._get_command, self._handle_resync_reply,
+            _rollback=self._event_sequencer.resyncFailed)
+
+    def _handle_resync_reply(self, get=None, counter=None, **kwargs):
+        # The lost events did not change the state applied, so comparing the
+        # snapshot to the tracked state is enough to find the parts to apply
+        logging.info("Resynchronized state at counter %r", counter)
+        self._handle_full_get_reply(get, counter)
+
+    def _handle_full_get_reply(self, get, counter):
+        self._handle_get_reply(get, counter)
+        # The events before the counter are included in the state
+        if counter is not None:
+            self._event_sequencer.setCounter(counter)
+        # The connection may have been lost before the initial state was
+        # received, in which case the state comes from the resync reply
+        self._start_handling_events()
+
+    def _handle_get_reply(self, get=None, counter=None, **kwargs):
+        if counter is None:
+            logging.warning("No counter included in get reply")
+        changed = self._tracker.update(
+            counter,
+            state.flattenState(get, (PUBSTATE_TAG, PRIVSTATE_TAG, SELF_TAG)))
+        if not changed:
+            return
+        missing = object()
+        position = changed.get((SELF_TAG, POSITION_TAG), missing)
+        if position is not missing and position != self._state.position():
+            self._state.setPosition(position)
+        position_in_turn = changed.get(
+            (SELF_TAG, POSITION_IN_TURN_TAG), missing)
+        if position_in_turn is not missing:
+            self._state.setPositionInTurn(position_in_turn)
+        allowed_calls = changed.get((SELF_TAG, ALLOWED_CALLS_TAG), missing)
+        if allowed_calls is not missing:
+            self._state.setAllowedCalls(allowed_calls)
+        calls = changed.get((PUBSTATE_TAG, CALLS_TAG), missing)
+        if calls is not missing:
+            self._state.setCalls(calls)
+        if ((PUBSTATE_TAG, DECLARER_TAG) in changed or
+                (PUBSTATE_TAG, CONTRACT_TAG) in changed):
+            declarer = self._tracker.value((PUBSTATE_TAG, DECLARER_TAG), missing)
+            contract = self._tracker.value((PUBSTATE_TAG, CONTRACT_TAG), missing)
+            if declarer is not missing and contract is not missing:
+                self._state.setBiddingResult(declarer, contract)
+        if ((PUBSTATE_TAG, CARDS_TAG) in changed or
+                (PRIVSTATE_TAG, CARDS_TAG) in changed):
+            cards = dict(self._tracker.value((PUBSTATE_TAG, CARDS_TAG)) or {})
+            cards.update(self._tracker.value((PRIVSTATE_TAG, CARDS_TAG)) or {})
+            if cards:
+                self._state.setCards(cards)
+        allowed_cards = changed.get((SELF_TAG, ALLOWED_CARDS_TAG), missing)
+        if allowed_cards is not missing:
+            self._state.setAllowedCards(allowed_cards)
+        tricks = changed.get((PUBSTATE_TAG, TRICKS_TAG), missing)
+        if tricks is not missing:
+            if tricks:
+                trick = tricks[-1].get(CARDS_TAG)
+                if trick:
+                    self._state.setTrick(trick)
+            tricks_won = {
+                partnership: 0 for partnership in positions.Partnership
+            }
+            for trick in tricks:
+                winner = trick.get(WINNER_TAG)
+                if winner:
+                    tricks_won[positions.partnershipFor(winner)] += 1
+            self._state.setTricksWon(tricks_won)
+        vulnerability = changed.get((PUBSTATE_TAG, VULNERABILITY_TAG), missing)
+        if vulnerability is not missing:
+            self._state.setVulnerability(vulnerability)
+
+    def _handle_call_reply(self, **kwargs):
+        logging.debug("Call successful")
+
+    def _handle_play_reply(self, **kwargs):
+        logging.debug("Play successful")
+
+    def _handle_deal_event(
+            self, opener=None, vulnerability=None, counter=None, **kwargs):
+        logging.debug("Cards dealt")
+        self._tracker.invalidate(
+            counter, (SELF_TAG, POSITION_IN_TURN_TAG),
+            (PUBSTATE_TAG, VULNERABILITY_TAG), (PUBSTATE_TAG, DECLARER_TAG),
+            (PUBSTATE_TAG, CONTRACT_TAG), (PUBSTATE_TAG, CARDS_TAG),
+            (PRIVSTATE_TAG, CARDS_TAG), (PUBSTATE_TAG, TRICKS_TAG))
+        self._state.setPositionInTurn(opener)
+        self._state.setVulnerability(vulnerability)
+        self._state.setBiddingResult(None, None)
+        self._request(PUBSTATE_TAG, PRIVSTATE_TAG, counter=counter)
+
+    def _handle_turn_event(self, position=None, counter=None, **kwargs):
+        logging.debug("Position in turn: %r", position)
+        self._tracker.invalidate(
+            counter, (SELF_TAG, POSITION_IN_TURN_TAG),
+            (SELF_TAG, ALLOWED_CALLS_TAG), (SELF_TAG, ALLOWED_CARDS_TAG))
+        self._state.setPositionInTurn(position)
+        if self._is_controlled(position):
+            self._request(SELF_TAG, counter=counter)
+        else:
+            self._state.setAllowedCalls([])
+            self._state.setAllowedCards([])
+
+    def _is_controlled(self, position):
+        # The declarer also plays the cards of the dummy
+        own_position = self._state.position()
+        if position is None or own_position is None:
+            return False
+        position = positions.asPosition(position)
+        own_position = positions.asPosition(own_position)
+        if position == own_position:
+            return True
+        declarer = self._state.declarer()
+        return (
+            declarer is not None and
+            positions.asPosition(declarer) == own_position and
+            position == positions.partner(own_position))
+
+    def _handle_call_event(
+            self, position=None, call=None, counter=None, **kwargs):
+        logging.debug("Call made. Position: %r, Call: %r", position, call)
+        self._tracker.invalidate(counter, (PUBSTATE_TAG, CALLS_TAG))
+        self._state.addCall(position, call)
+
+    def _handle_bidding_event(
+            self, declarer=None, contract=None, counter=None, **kwargs):
+        logging.debug(
+            "Bidding completed. Declarer: %r, Contract: %r", declarer, contract)
+        self._tracker.invalidate(
+            counter, (PUBSTATE_TAG, DECLARER_TAG), (PUBSTATE_TAG, CONTRACT_TAG))
+        self._state.setBiddingResult(declarer, contract)
+
+    def _handle_play_event(
+            self, position=None, card=None, counter=None, **kwargs):
+        logging.debug("Card played. Position: %r, Card: %r", position, card)
+        self._tracker.invalidate(
+            counter, (PUBSTATE_TAG, CARDS_TAG), (PRIVSTATE_TAG, CARDS_TAG),
+            (PUBSTATE_TAG, TRICKS_TAG))
+        self._state.playCard(position, card)
+
+    def _handle_dummy_event(
+            self, counter=None, position=None, cards=None, **kwargs):
+        logging.debug("Dummy hand revealed")
+        self._tracker.invalidate(counter, (PUBSTATE_TAG, CARDS_TAG))
+        self._state.setCards({ position: cards })
+
+    def _handle_trick_event(self, winner, counter=None, **kwargs):
+        logging.debug("Trick completed. Winner: %r", winner)
+        self._tracker.invalidate(counter, (PUBSTATE_TAG, TRICKS_TAG))
+        self._state.addTrick(winner)
+
+    def _handle_dealend_event(self, result, counter=None, **kwargs):
+        logging.debug("Deal ended. Result: %r", result)
+        self._tracker.invalidate(counter, (PUBSTATE_TAG, CALLS_TAG))
+        self._state.addResult(result)
+        self._state.setCalls([])
+
+    def _handle_player_event(self, player, position, **kwargs):
+        logging.debug("Player joined. Player: %r. Position: %r", player, position)
+
+
+def _is_position(position):
+    return (
+        isinstance(position, positions.Position) or
+        position in positions.POSITION_TAGS)
+
+def _convert_hands(hands):
+    return {
+        position: [card and deck.asCard(card) for card in hand]
+        if isinstance(hand, list) else hand
+        for (position, hand) in hands.items()
+    }
+
+def _convert_get_reply(kwargs):
+    # Converting the cards is the most expensive part of validating the state,
+    # so it is done while decoding the message
+    get = kwargs.get(GET_COMMAND.decode())
+    if not isinstance(get, dict):
+        raise messaging.ProtocolError("Invalid get reply: %r" % get)
+    for tag in (PUBSTATE_TAG, PRIVSTATE_TAG):
+        state = get.get(tag)
+        if isinstance(state, dict) and isinstance(state.get(CARDS_TAG), dict):
+            state[CARDS_TAG] = _convert_hands(state[CARDS_TAG])
+    _self = get.get(SELF_TAG)
+    if isinstance(_self, dict) and isinstance(_self.get(ALLOWED_CARDS_TAG), list):
+        _self[ALLOWED_CARDS_TAG] = [
+            deck.asCard(card) for card in _self[ALLOWED_CARDS_TAG]]
+    return kwargs
+
+def _convert_arguments(**converters):
+    def _convert(kwargs):
+        for key, converter in converters.items():
+            if key in kwargs:
+                kwargs[key] = converter(kwargs[key])
+        return kwargs
+    return _convert
+
+def _convert_card_list(card_list):
+    if not isinstance(card_list, list):
+        raise messaging.ProtocolError("Invalid cards: %r" % card_list)
+    return [deck.asCard(card) for card in card_list]
+
+_EVENT_CONVERTERS = {
+    CALL_COMMAND: _convert_arguments(
+        position=positions.asPosition, call=calls.asCall),
+    PLAY_COMMAND: _convert_arguments(
+        position=positions.asPosition, card=deck.asCard),
+    DUMMY_COMMAND: _convert_arguments(
+        position=positions.asPosition, cards=_convert_card_list),
+    TRICK_COMMAND: _convert_arguments(winner=positions.asPosition),
+}
@@ -0,0 +1,53 @@
+"""Utilities for handling cards
+
+This module contains functions that can be used to convert cards between the
+serialized representation specified by the bridge protocol specification, and
+the internal representation used by the frontend. The module does not depend
+on Qt, so it can also be used by clients without user interface.
+
+Functions:
+asCard -- convert serialized card into internal representation
+"""
+
+from collections import namedtuple
+
+import bridgegui.messaging as messaging
+
+RANK_TAG = "rank"
+SUIT_TAG = "suit"
+
+RANK_TAGS = (
+    "2", "3", "4", "5", "6", "7", "8", "9", "10", "jack", "queen", "king",
+    "ace"
+)
+SUIT_TAGS = ("clubs", "diamonds", "hearts", "spades")
+
+Card = namedtuple("Card", (RANK_TAG, SUIT_TAG))
+
+
+def asCard(card):
+    """Convert serialized card representation into Card object
+
+    The serialized representation is a dictionary containing rank and suit keys
+    (see bridge protocol specification). This function converts the serialized
+    representation into the representation used by the frontend, which is a
+    named tuple containing rank and suit fields (in this order).
+
+    This function also does validation of the serialized card, raising
+    ProtocolError if the format is not valid.
+
+    This function is idempotent, meaning that it is safe to call it with Card
+    object.
+
+    Keyword Arguments:
+    card -- card object
+    """
+    if isinstance(card, Card):
+        return card
+    try:
+        card = Card(card[RANK_TAG], card[SUIT_TAG])
+    except Exception:
+        raise messaging.ProtocolError("Invalid card: %r" % card)
+    if card.rank not in RANK_TAGS or card.suit not in SUIT_TAGS:
+        raise messaging.ProtocolError("Invalid rank or suit in card: %r" % card)
+    return card
@@ -0,0 +1,463 @@
+"""Load generator for the bridge backend
+
+This module contains a command line tool that simulates many players from one
+process to measure the capacity of the backend. Each player has its own
+control and event socket pair, and is driven by client.GameClient, so the
+players exercise the same protocol as the frontend. The players are seated at
+tables of four. The first player at each table creates the game, and the
+others join it. The players make calls from the allowed calls and play cards
+from the allowed cards until the time is up, and the tool then reports the
+throughput and the latency percentiles of the commands.
+
+The tool does not depend on Qt. The usage is documented when the module is
+run with the -h argument.
+
+Functions:
+percentile -- return percentile of sorted values
+
+Classes:
+Statistics    -- latency and throughput statistics
+Bot           -- player making random calls and plays
+LoadGenerator -- object running bots in one event loop
+"""
+
+import argparse
+import itertools
+import logging
+import math
+import random
+import sys
+import time
+import uuid
+
+import zmq
+
+import bridgegui.calls as calls
+import bridgegui.client as client
+import bridgegui.messaging as messaging
+import bridgegui.positions as positions
+
+JOIN_TAG = "join"
+CALL_TAG = "call"
+PLAY_TAG = "play"
+
+PLAYERS_PER_TABLE = len(positions.Position)
+PERCENTILES = (0.5, 0.9, 0.99)
+# Maximum time to wait for messages before checking the timeouts of the clients
+POLL_INTERVAL = 0.01
+
+
+def percentile(values, fraction):
+    """Return percentile of sorted values
+
+    The nearest rank method is used. None is returned if there are no values.
+
+    Keyword Arguments:
+    values   -- the values sorted in ascending order
+    fraction -- the percentile as a fraction between 0 and 1
+    """
+    if not values:
+        return None
+    rank = math.ceil(fraction * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+class Statistics:
+    """Latency and throughput statistics
+
+    The statistics collect the latencies of the commands by the type of the
+    command, and count the events and errors seen by the players. The rates
+    are computed from the measured duration of the run.
+    """
+
+    def __init__(self):
+        """Initialize statistics"""
+        self._latencies = {}
+        self._failures = {}
+        self._events = 0
+        self._deals = 0
+        self._errors = 0
+        self._duration = 0
+
+    def setDuration(self, duration):
+        """Set the measured duration of the run in seconds"""
+        self._duration = duration
+
+    def addLatency(self, name, latency):
+        """Record the latency of a command that succeeded"""
+        self._latencies.setdefault(name, []).append(latency)
+
+    def addFailure(self, name):
+        """Record a command that failed or timed out"""
+        self._failures[name] = self._failures.get(name, 0) + 1
+
+    def addEvent(self):
+        """Record an event received by a player"""
+        self._events += 1
+
+    def addDeal(self):
+        """Record a deal that ended"""
+        self._deals += 1
+
+    def addError(self):
+        """Record an error while handling messages"""
+        self._errors += 1
+
+    def latencies(self, name):
+        """Return the sorted latencies of the commands with the name"""
+        return sorted(self._latencies.get(name, []))
+
+    def failures(self, name):
+        """Return the number of commands with the name that failed"""
+        return self._failures.get(name, 0)
+
+    def events(self):
+        """Return the number of events received"""
+        return self._events
+
+    def deals(self):
+        """Return the number of deals that ended"""
+        return self._deals
+
+    def errors(self):
+        """Return the number of errors"""
+        return self._errors
+
+    def duration(self):
+        """Return the measured duration of the run in seconds"""
+        return self._duration
+
+    def report(self, file=sys.stdout):
+        """Print report of the statistics
+
+        Keyword Arguments:
+        file -- the file the report is written to (default: stdout)
+        """
+        duration = max(self._duration, sys.float_info.epsilon)
+        print("%-6s %8s %8s %8s %s" % (
+            "", "count", "failed", "per s", " ".join(
+                "%8s" % ("p%g ms" % (100 * fraction))
+                for fraction in PERCENTILES + (1,))),
+              file=file)
+        for name in (JOIN_TAG, CALL_TAG, PLAY_TAG):
+            latencies = self.latencies(name)
+            print("%-6s %8d %8d %8.1f %s" % (
+                name, len(latencies), self.failures(name),
+                len(latencies) / duration, " ".join(
+                    _format_latency(percentile(latencies, fraction))
+                    for fraction in PERCENTILES + (1,))),
+                  file=file)
+        print("events %8d %17.1f" % (self._events, self._events / duration),
+              file=file)
+        print("deals  %8d %17.1f" % (self._deals, self._deals / duration),
+              file=file)
+        print("errors %8d" % self._errors, file=file)
+
+
+class Bot(client.GameObserver):
+    """Player making random calls and plays
+
+    The bot makes a call or plays a card whenever the allowed calls or cards
+    of the player are known. Passing is preferred with the given probability,
+    so that the bidding ends in a few rounds. The latencies of joining and the
+    commands are recorded to the statistics.
+    """
+
+    def __init__(
+            self, statistics, register, rng=None, passProbability=0.75,
+            countDeals=False):
+        """Initialize bot
+
+        Keyword Arguments:
+        statistics      -- the Statistics the latencies are recorded to
+        register        -- function called with the socket and the bot when
+                           the bot starts receiving messages from the socket
+        rng             -- random.Random used to make the decisions (optional)
+        passProbability -- the probability of passing when allowed
+        countDeals      -- flag indicating whether the bot records the deals
+                           ended (only one bot at each table should)
+        """
+        self._statistics = statistics
+        self._register = register
+        self._rng = rng or random.Random()
+        self._pass_probability = passProbability
+        self._count_deals = countDeals
+        self._client = None
+        self._join_time = None
+        self._joined = False
+        self._command_in_flight = False
+
+    def start(self, gameClient):
+        """Start the client and join the game"""
+        self._client = gameClient
+        self._join_time = time.monotonic()
+        gameClient.start()
+
+    def client(self):
+        """Return the GameClient of the bot"""
+        return self._client
+
+    def hasJoined(self):
+        """Return True if the bot has received the initial state"""
+        return self._joined
+
+    def messageQueueAdded(self, socket, queue):
+        self._register(socket, self)
+
+    def positionChanged(self, position):
+        if not self._joined:
+            self._joined = True
+            self._statistics.addLatency(
+                JOIN_TAG, time.monotonic() - self._join_time)
+
+    def allowedCallsChanged(self, calls):
+        if calls:
+            self._send(CALL_TAG, self._client.call, self._choose_call(calls))
+
+    def allowedCardsChanged(self, cards):
+        if cards:
+            self._send(PLAY_TAG, self._client.play, self._rng.choice(cards))
+
+    def callAdded(self, position, call):
+        self._statistics.addEvent()
+
+    def cardPlayed(self, position, card):
+        self._statistics.addEvent()
+
+    def trickCompleted(self, winner):
+        self._statistics.addEvent()
+
+    def dealEnded(self, result):
+        self._statistics.addEvent()
+        if self._count_deals:
+            self._statistics.addDeal()
+
+    def _choose_call(self, allowed_calls):
+        allowed_calls = [calls.asCall(call) for call in allowed_calls]
+        pass_call = calls.asCall(calls.makePass())
+        if (pass_call in allowed_calls and
+                self._rng.random() < self._pass_probability):
+            return pass_call
+        return self._rng.choice(allowed_calls)
+
+    def _send(self, name, send, argument):
+        # The replies to the get commands sent before this command arrive
+        # before its reply, so the changes seen while waiting are stale
+        if self._command_in_flight:
+            return
+        send_time = time.monotonic()
+        self._command_in_flight = True
+        def _handle_reply(future):
+            self._command_in_flight = False
+            if future.cancelled() or future.exception():
+                self._statistics.addFailure(name)
+            else:
+                self._statistics.addLatency(
+                    name, time.monotonic() - send_time)
+        send(argument).add_done_callback(_handle_reply)
+
+
+class LoadGenerator:
+    """Object running bots in one event loop
+
+    The bots are seated at tables of four. The first bot at each table
+    creates the game, and the others start joining only after it has joined,
+    so that the game exists when they join.
+    """
+
+    def __init__(
+            self, endpoint, players, context=None, codec=None, seed=None,
+            rampUp=0, setup=None, seatEndpoints=None, botFactory=None):
+        """Initialize load generator
+
+        Keyword Arguments:
+        endpoint -- the base endpoint of the backend
+        players  -- the number of players
+        context  -- the ZeroMQ context (default: the global instance)
+        codec    -- the codec used to serialize messages (optional)
+        seed     -- the seed of the random decisions (optional)
+        rampUp   -- the time in seconds over which the tables are started
+        setup    -- function called with each control socket before it is
+                    connected, for instance to set up CURVE (optional)
+        seatEndpoints -- list of the base endpoints the players at each seat
+                    of a table connect to, for instance to route some of
+                    them through a proxy (default: endpoint for every seat)
+        botFactory -- function called with the seat, the Statistics, the
+                    registration function, the random.Random and the
+                    countDeals flag, returning the bot (default: Bot)
+        """
+        self._context = context or zmq.Context.instance()
+        self._seat_endpoints = [
+            tuple(itertools.islice(messaging.endpoints(base), 2))
+            for base in (seatEndpoints or [endpoint] * PLAYERS_PER_TABLE)
+        ]
+        self._bot_factory = botFactory or (
+            lambda seat, *args, **kwargs: Bot(*args, **kwargs))
+        self._players = players
+        self._codec = codec or messaging.getCodec()
+        self._rng = random.Random(seed)
+        self._ramp_up = rampUp
+        self._setup = setup
+        self._statistics = Statistics()
+        self._poller = zmq.Poller()
+        self._bots_by_socket = {}
+        self._bots = []
+        self._sockets = []
+        self._tables = []
+
+    def statistics(self):
+        """Return the Statistics of the run"""
+        return self._statistics
+
+    def bots(self):
+        """Return the bots started so far"""
+        return list(self._bots)
+
+    def run(self, duration):
+        """Run the bots for the duration in seconds and return the statistics"""
+        start_time = time.monotonic()
+        end_time = start_time + duration
+        tables = (self._players + PLAYERS_PER_TABLE - 1) // PLAYERS_PER_TABLE
+        pending_tables = list(range(tables))
+        busy_bots = set()
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= end_time:
+                    break
+                while (pending_tables and now >= start_time +
+                       self._ramp_up * pending_tables[0] / tables):
+                    self._start_table(pending_tables.pop(0))
+                self._start_joiners()
+                timeout = 0 if busy_bots else POLL_INTERVAL
+                events = self._poller.poll(int(timeout * 1000))
+                ready_bots = busy_bots | {
+                    self._bots_by_socket[socket] for (socket, _) in events }
+                busy_bots = set()
+                for bot in ready_bots:
+                    if not bot.client().handleMessages():
+                        self._statistics.addError()
+                    if bot.client().hasMessages():
+                        busy_bots.add(bot)
+                self._handle_timeouts()
+        finally:
+            # The last iteration may overrun the requested duration
+            self._statistics.setDuration(time.monotonic() - start_time)
+            self._close()
+        return self._statistics
+
+    def _start_table(self, table):
+        game_uuid = str(uuid.uuid4())
+        seats = min(PLAYERS_PER_TABLE, self._players - table * PLAYERS_PER_TABLE)
+        creator = self._create_bot(game_uuid, 0, createGame=True)
+        # The other players wait until the game has been created
+        self._tables.append((creator, game_uuid, seats))
+
+    def _start_joiners(self):
+        tables = []
+        for (creator, game_uuid, seats) in self._tables:
+            if creator.hasJoined():
+                for seat in range(1, seats):
+                    self._create_bot(game_uuid, seat)
+            else:
+                tables.append((creator, game_uuid, seats))
+        self._tables = tables
+
+    def _create_bot(self, game_uuid, seat, createGame=False):
+        control_socket = self._context.socket(zmq.DEALER)
+        if self._setup:
+            self._setup(control_socket)
+        event_socket = self._context.socket(zmq.SUB)
+        self._sockets.extend((control_socket, event_socket))
+        bot = self._bot_factory(
+            seat, self._statistics, self._register,
+            random.Random(self._rng.random()), countDeals=createGame)
+        game_client = client.GameClient(
+            control_socket, event_socket, gameUuid=game_uuid,
+            createGame=createGame, codec=self._codec, pipelinedStartup=True,
+            endpoints=[self._seat_endpoints[seat % len(self._seat_endpoints)]],
+            observer=bot)
+        self._bots.append(bot)
+        bot.start(game_client)
+        return bot
+
+    def _register(self, socket, bot):
+        self._poller.register(socket, zmq.POLLIN)
+        self._bots_by_socket[socket] = bot
+
+    def _handle_timeouts(self):
+        now = time.monotonic()
+        for bot in self._bots:
+            deadline = bot.client().nextDeadline()
+            if deadline is not None and deadline <= now:
+                if not bot.client().handleTimeouts(now):
+                    self._statistics.addError()
+
+    def _close(self):
+        # The monitor sockets are created by the clients, so they are known
+        # only through the registrations
+        for socket in set(self._sockets).union(self._bots_by_socket):
+            socket.close(linger=0)
+
+
+def _format_latency(latency):
+    if latency is None:
+        return "%8s" % "-"
+    return "%8.1f" % (1000 * latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load generator for the bridge backend")
+    parser.add_argument(
+        "endpoint",
+        help="""Base endpoint of the bridge backend. Follows ZeroMQ transmit
+             protocol syntax. For example: tcp://bridge.example.com:5555.""")
+    parser.add_argument(
+        "--players", type=int, default=PLAYERS_PER_TABLE,
+        help="""The number of simulated players. The players are seated at
+             tables of four.""")
+    parser.add_argument(
+        "--duration", type=float, default=10,
+        help="""The duration of the measurement in seconds.""")
+    parser.add_argument(
+        "--ramp-up", type=float, default=0,
+        help="""The time in seconds over which the tables are started.""")
+    parser.add_argument(
+        "--seed", type=int,
+        help="""The seed of the random calls and plays.""")
+    parser.add_argument(
+        '--codec', choices=[codec.name for codec in messaging.CODECS],
+        help="""The codec used to serialize messages. If omitted, the fastest
+             available codec is used.""")
+    parser.add_argument(
+        "--verbose", "-v", action="count", default=0,
+        help="""Increase logging levels. Repeat for even more logging.""")
+    args = parser.parse_args()
+
+    logging_level = logging.ERROR
+    if args.verbose == 1:
+        logging_level = logging.INFO
+    elif args.verbose >= 2:
+        logging_level = logging.DEBUG
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s', level=logging_level)
+
+    try:
+        codec = messaging.getCodec(args.codec)
+    except ImportError:
+        parser.error("codec %s is not available" % args.codec)
+    try:
+        generator = LoadGenerator(
+            args.endpoint, args.players, codec=codec, seed=args.seed,
+            rampUp=args.ramp_up)
+    except ValueError as e:
+        parser.error(str(e))
+    statistics = generator.run(args.duration)
+    statistics.report()
+    zmq.Context.instance().destroy(linger=0)
+    return 0 if not statistics.errors() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
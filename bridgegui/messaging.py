@@ -1,34 +1,105 @@
-"""Messaging utilities for the bridge frontend"""
+"""Messaging utilities for the bridge frontend
 
+The arguments of the commands and events are serialized as JSON. The codec used
+to encode and decode them can be chosen with getCodec(). By default the fastest
+available codec is used.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
 import re
 import logging
+import sys
+import time
 
 import json
 import zmq
+from zmq.utils.monitor import parse_monitor_message
 
 EMPTY_FRAME = b''
 REPLY_SUCCESS_PREFIX = [EMPTY_FRAME, b'success']
+COUNTER_TAG = "counter"
 
 ENDPOINT_REGEX = re.compile(r"tcp://(.+):(\d+)")
+LOCAL_ENDPOINT_REGEX = re.compile(r"(ipc|inproc)://(.*?)(\d*)$")
+
+# Frames received without copying that are shorter than this are converted to
+# bytes, because for them copying is cheaper than keeping the frame object
+FRAME_COPY_THRESHOLD = 1024
+
+# The channel the sent commands are recorded under
+SENT_CHANNEL = "control socket"
+
+_MAX_KEY_CACHE_SIZE = 256
+_key_cache = {}
+_recorder = None
 
 
 def _failed_status_code(code):
     return code[:2] != b'OK'
 
 
+def _frame_to_part(frame):
+    if len(frame) < FRAME_COPY_THRESHOLD:
+        return frame.bytes
+    return frame
+
+
+def _decode_key(part):
+    key = _key_cache.get(part)
+    if key is None:
+        key = sys.intern(str(memoryview(part), 'utf-8'))
+        if isinstance(part, bytes) and len(_key_cache) < _MAX_KEY_CACHE_SIZE:
+            _key_cache[part] = key
+    return key
+
+
+class _PartsFormatter:
+    # Formats message parts containing both bytes and frames for logging
+
+    def __init__(self, parts):
+        self._parts = parts
+
+    def __repr__(self):
+        return repr([bytes(part) for part in self._parts])
+
+
 def endpoints(base):
     """Generate successive endpoints starting from given base
 
-    This generator consumes a base endpoint as its only argument. Each element
-    is generated by keeping the address of the endpoint and increasing the port
-    number by one.
+    This generator consumes a base endpoint as its only argument. For tcp
+    endpoints each element is generated by keeping the address of the endpoint
+    and increasing the port number by one.
+
+    For ipc and inproc endpoints the number at the end of the address is
+    increased by one, keeping its width. If the address does not end with a
+    number, the base endpoint is followed by the address suffixed with -1,
+    -2 etc. For example ipc:///tmp/bridge is followed by ipc:///tmp/bridge-1.
+
+    ValueError is raised if the endpoint is not supported.
     """
     match = ENDPOINT_REGEX.match(base)
-    address = match.group(1)
-    port = int(match.group(2))
-    while True:
-        yield "tcp://%s:%d" % (address, port)
-        port += 1
+    if match:
+        address = match.group(1)
+        port = int(match.group(2))
+        while True:
+            yield "tcp://%s:%d" % (address, port)
+            port += 1
+    match = LOCAL_ENDPOINT_REGEX.match(base)
+    if not match:
+        raise ValueError("Unsupported endpoint: %r" % base)
+    transport, address, number = match.groups()
+    if number:
+        width = len(number)
+        number = int(number)
+        while True:
+            yield "%s://%s%0*d" % (transport, address, width, number)
+            number += 1
+    yield base
+    for number in itertools.count(1):
+        yield "%s://%s-%d" % (transport, address, number)
 
 
 def setupCurve(socket, serverKey, secretKey=None, publicKey=None):
@@ -57,25 +128,225 @@ def setupCurve(socket, serverKey, secretKey=None, publicKey=None):
     socket.curve_secretkey = secretKey + b'\0'
 
 
+def setupHeartbeat(socket, interval, reconnectInterval=0.1,
+                   maxReconnectInterval=5):
+    """Setup heartbeats and reconnection on socket
+
+    This function sets the options on the socket to make it send heartbeats
+    to the peer, and close the connection if the peer does not respond to
+    them in three intervals. ZeroMQ then reconnects the socket automatically,
+    doubling the reconnection interval after each failed attempt up to the
+    maximum. The options need to be set before connecting the socket.
+
+    Keyword Arguments:
+    socket               -- the ZeroMQ socket
+    interval             -- the heartbeat interval in seconds (falsy to
+                            disable heartbeats)
+    reconnectInterval    -- the initial reconnection interval in seconds
+    maxReconnectInterval -- the maximum reconnection interval in seconds
+    """
+    socket.reconnect_ivl = int(reconnectInterval * 1000)
+    socket.reconnect_ivl_max = int(maxReconnectInterval * 1000)
+    if not interval:
+        return
+    socket.heartbeat_ivl = int(interval * 1000)
+    socket.heartbeat_timeout = int(3 * interval * 1000)
+    socket.heartbeat_ttl = int(3 * interval * 1000)
+
+
+
+class JsonCodec:
+    """Codec using the json module of the standard library"""
+
+    name = "json"
+
+    def encode(self, value):
+        """Serialize value into bytes"""
+        return json.dumps(value).encode()
+
+    def decode(self, data):
+        """Deserialize value from bytes or other buffer
+
+        ValueError is raised if the data is not valid UTF-8 encoded JSON.
+        """
+        return json.loads(str(memoryview(data), 'utf-8'))
+
+
+def _orjson_default(value):
+    # Named tuples are serialized as arrays, like the json module does
+    if isinstance(value, tuple):
+        return list(value)
+    raise TypeError("Type is not JSON serializable: %s" % type(value).__name__)
+
+
+class OrjsonCodec:
+    """Codec using the orjson library
+
+    orjson is considerably faster than the json module, and it decodes buffers
+    without first copying them into str objects. It is an optional dependency.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        """Initialize orjson codec
+
+        ImportError is raised if orjson is not installed.
+        """
+        import orjson
+        self._orjson = orjson
+        self._options = orjson.OPT_NON_STR_KEYS
+
+    def encode(self, value):
+        """Serialize value into bytes"""
+        return self._orjson.dumps(
+            value, default=_orjson_default, option=self._options)
+
+    def decode(self, data):
+        """Deserialize value from bytes or other buffer
+
+        ValueError is raised if the data is not valid UTF-8 encoded JSON.
+        """
+        if not isinstance(data, bytes):
+            data = memoryview(data)
+        return self._orjson.loads(data)
+
+
+CODECS = (OrjsonCodec, JsonCodec)
+
+_codecs = {}
+
+
+def getCodec(name=None):
+    """Return codec for serializing arguments
+
+    The codec is an object with encode() and decode() methods converting values
+    to and from JSON encoded bytes. If name is given, the codec with that name
+    is returned, and ImportError is raised if the library it needs is not
+    installed. If name is omitted, the fastest available codec is returned.
+
+    Keyword Arguments:
+    name -- the name of the codec ("json" or "orjson"), or None
+    """
+    if name in _codecs:
+        return _codecs[name]
+    codec_types = [
+        codec_type for codec_type in CODECS if name in (None, codec_type.name)]
+    if not codec_types:
+        raise ValueError("Unknown codec: %r" % name)
+    for codec_type in codec_types:
+        try:
+            codec = codec_type()
+        except ImportError:
+            if name is not None:
+                raise
+        else:
+            _codecs[name] = codec
+            return codec
+
+
+def setRecorder(recorder):
+    """Set the recorder of the messages sent and received
+
+    The recorder is notified of each message received by a message queue by
+    calling its recordReceived() method, and of each command sent by calling
+    its recordSent() method (see bridgegui.recording.Recorder). The methods
+    may be called from several threads.
+
+    Keyword Arguments:
+    recorder -- the recorder, or None to stop recording
+    """
+    global _recorder
+    _recorder = recorder
+
+
+def recordReceived(channel, parts):
+    """Record message received, if a recorder has been set
+
+    Keyword Arguments:
+    channel -- the name of the channel the message was received from
+    parts   -- the frames of the message
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.recordReceived(channel, parts)
+
+
+def _send_parts(socket, parts):
+    logging.debug("Sending command: %r", parts)
+    recorder = _recorder
+    if recorder is not None:
+        recorder.recordSent(SENT_CHANNEL, parts)
+    try:
+        socket.send_multipart(parts)
+    except zmq.ZMQError as e:
+        logging.error(
+            "Error %d while sending message %r: %s", e.errno, parts, str(e))
+
 
-def sendCommand(socket, command, _tag=None, **kwargs):
+def sendCommand(socket, command, _tag=None, _codec=None, **kwargs):
     """Send command to the backend application using the bridge protocol
 
     Keyword Arguments:
     socket   -- the socket used for sending the command
     command  -- (bytes) the command to be sent (also used as tag unless _tag is given)
     _tag     -- (bytes) the tag to be sent (overrides the default)
+    _codec   -- the codec used to serialize the arguments (default: getCodec())
     **kwargs -- The arguments of the command (the values are serialized as JSON)
     """
+    codec = _codec or getCodec()
     parts = [b'', _tag or command, command]
     for (key, value) in kwargs.items():
-        parts.extend((key.encode(), json.dumps(value).encode()))
-    logging.debug("Sending command: %r", parts)
-    try:
-        socket.send_multipart(parts)
-    except zmq.ZMQError as e:
-        logging.error(
-            "Error %d while sending message %r: %s", e.errno, parts, str(e))
+        parts.extend((key.encode(), codec.encode(value)))
+    _send_parts(socket, parts)
+
+
+class PreparedCommand:
+    """Command with arguments serialized in advance
+
+    A prepared command holds the frames of a command that stay the same
+    between sends, such as the command itself and the game and player
+    arguments. Only the arguments given to send() are serialized each time the
+    command is sent.
+    """
+
+    def __init__(self, command, _tag=None, _codec=None, **kwargs):
+        """Initialize prepared command
+
+        Keyword Arguments:
+        command  -- (bytes) the command (also used as tag unless _tag is given)
+        _tag     -- (bytes) the tag to be sent (overrides the default)
+        _codec   -- the codec used to serialize the arguments (default: getCodec())
+        **kwargs -- the arguments sent with every command
+        """
+        self._command = command
+        self._tag = _tag or command
+        self._codec = _codec or getCodec()
+        self._arguments = []
+        for (key, value) in kwargs.items():
+            self._arguments.extend((key.encode(), self._codec.encode(value)))
+        self._keys = {}
+
+    def command(self):
+        """Return the command"""
+        return self._command
+
+    def send(self, socket, _tag=None, **kwargs):
+        """Send the command
+
+        Keyword Arguments:
+        socket   -- the socket used for sending the command
+        _tag     -- (bytes) the tag to be sent (overrides the prepared tag)
+        **kwargs -- the arguments in addition to the prepared ones
+        """
+        parts = [b'', _tag or self._tag, self._command]
+        parts.extend(self._arguments)
+        for (key, value) in kwargs.items():
+            encoded_key = self._keys.get(key)
+            if encoded_key is None:
+                encoded_key = self._keys[key] = key.encode()
+            parts.extend((encoded_key, self._codec.encode(value)))
+        _send_parts(socket, parts)
 
 
 def validateControlReply(parts):
@@ -105,15 +376,84 @@ def validateEventMessage(parts):
     return parts[0], parts[1:]
 
 
+def probeEndpoints(
+        baseEndpoints, command, timeout=1, setup=None, context=None,
+        **kwargs):
+    """Measure the round trip times to backends
+
+    This function sends the command (typically the handshake) to the control
+    endpoint of each backend at the same time, and measures the time until the
+    successful reply is received. A list of (round trip time, base endpoint)
+    pairs of the backends that replied in time is returned, fastest first.
+
+    Keyword Arguments:
+    baseEndpoints -- the base endpoints of the backends (see endpoints())
+    command       -- the command to be sent
+    timeout       -- the time in seconds to wait for the replies
+    setup         -- function called with each socket before connecting it,
+                     for example to setup CURVE (optional)
+    context       -- the ZeroMQ context (default: the global instance)
+    **kwargs      -- the arguments of the command
+    """
+    context = context or zmq.Context.instance()
+    poller = zmq.Poller()
+    probes = {}
+    results = []
+    try:
+        for base in baseEndpoints:
+            socket = context.socket(zmq.DEALER)
+            socket.linger = 0
+            probes[socket] = (base, None)
+            if setup:
+                setup(socket)
+            socket.connect(next(endpoints(base)))
+            sendCommand(socket, command, **kwargs)
+            probes[socket] = (base, time.monotonic())
+            poller.register(socket, zmq.POLLIN)
+        deadline = time.monotonic() + timeout
+        while poller.sockets:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for socket, _ in poller.poll(remaining * 1000):
+                parts = socket.recv_multipart()
+                now = time.monotonic()
+                poller.unregister(socket)
+                base, sent = probes[socket]
+                if validateControlReply(parts)[0] == command:
+                    logging.debug("Round trip time to %s: %f", base, now - sent)
+                    results.append((now - sent, base))
+                else:
+                    logging.warning("Invalid reply from %s: %r", base, parts)
+    finally:
+        for socket in probes:
+            socket.close()
+    return sorted(results)
+
+
 class ProtocolError(Exception):
     """Error indicating unexpected message from bridge server"""
     pass
 
 
+class CommandFailure(Exception):
+    """Error indicating that the bridge server failed to execute a command"""
+    pass
+
+
+class CommandTimeout(Exception):
+    """Error indicating that no reply to a command arrived in time"""
+    pass
+
+
 class MessageQueue:
     """Object for handling messages coming from the bridge server"""
 
-    def __init__(self, socket, name, validator, handlers):
+    def __init__(
+            self, socket, name, validator, handlers, maxMessages=None,
+            timeSlice=None, copy=True, codec=None,
+            converters=None, executor=None, offloadThreshold=None,
+            offloadCallback=None):
         """Initialize message queue
 
         Message queue keeps a reference to the given socket and wraps it into a
@@ -130,29 +470,124 @@ class MessageQueue:
         validateControlReply and events can be validated using the (trivial)
         validateEventMessage.
 
+        The number of messages handled by each call to handleMessages() can be
+        limited by giving maxMessages, the maximum number of messages, or
+        timeSlice, the time in seconds after which no new messages are
+        handled. The remaining messages are left to the next call.
+
+        If copy is False, the messages are received without copying them into
+        bytes objects, and the arguments are decoded directly from the frame
+        buffers. This is faster for messages with large arguments.
+
+        The arguments are deserialized using the codec given as argument, or
+        the one returned by getCodec() if the codec is omitted. The converters
+        map commands to functions that receive the deserialized arguments as a
+        dictionary, and return them converted to the form the handlers expect.
+        The conversion is done as part of decoding, so it is done in the
+        worker thread when the messages are decoded in one.
+
+        If executor (such as concurrent.futures.ThreadPoolExecutor) and
+        offloadThreshold are given, messages whose total size in bytes is at
+        least the threshold are decoded in the executor instead of the calling
+        thread. The queue is paused until the message has been decoded, so the
+        messages are still handled in the order they were received. Because
+        the caller needs to know when to resume handling messages,
+        offloadCallback is called (in the executor thread) when decoding has
+        finished. After that, the next call to handleMessages() dispatches the
+        decoded message.
+
         Keyword Arguments:
-        socket    -- the ZMQ socket the message queue is backed by
-        name      -- the name of the queue (for logging)
-        validator -- Function for validating successful message
-        handlers  -- mapping between commands and message handlers
+        socket      -- the ZMQ socket the message queue is backed by
+        name        -- the name of the queue (for logging)
+        validator   -- Function for validating successful message
+        handlers    -- mapping between commands and message handlers
+        maxMessages -- the maximum number of messages handled at once (optional)
+        timeSlice   -- the time limit for handling messages at once (optional)
+        copy        -- if False, the messages are received without copying
+        codec       -- the codec used to deserialize the arguments (optional)
+        converters  -- mapping between commands and argument converters
+                       (optional)
+        executor    -- the executor used to decode large messages (optional)
+        offloadThreshold -- the size of the messages decoded in the executor
+                       (optional)
+        offloadCallback -- function called when decoding a message in the
+                       executor has finished (optional)
         """
         self._socket = socket
         self._name = str(name)
         self._validator = validator
         self._handlers = dict(handlers)
+        self._max_messages = maxMessages
+        self._time_slice = timeSlice
+        self._copy = copy
+        self._codec = codec or getCodec()
+        self._converters = dict(converters or {})
+        self._executor = executor
+        self._offload_threshold = offloadThreshold
+        self._offload_callback = offloadCallback
+        self._offloaded = None
+        self._async_socket = None
+
+    def name(self):
+        """Return the name of the queue"""
+        return self._name
+
+    def hasMessages(self):
+        """Return True if there are messages to be handled"""
+        if self._offloaded is not None:
+            return self._offloaded.done()
+        try:
+            return bool(self._socket.events & zmq.POLLIN)
+        except zmq.ContextTerminated:
+            return False
+
+    async def waitForMessages(self):
+        """Wait until there are messages to be handled
+
+        This coroutine can be used to drive the message queue from an asyncio
+        event loop instead of QSocketNotifier. It completes when the socket has
+        messages to receive, after which handleMessages() can be called to
+        handle them.
+        """
+        if self._offloaded is not None:
+            await asyncio.wait([asyncio.wrap_future(self._offloaded)])
+            return
+        if self._async_socket is None:
+            from zmq.asyncio import Socket as AsyncSocket
+            self._async_socket = AsyncSocket.shadow(self._socket.underlying)
+        await self._async_socket.poll(flags=zmq.POLLIN)
 
     def handleMessages(self):
         """Notify the message queue that messages can be handled
 
         The message queue handles messages from its socket until there are no
-        messages to receive or handling of a message results in an error. If
-        handling messages stops due to an error, False is returned. Otherwise
-        True is returned.
+        messages to receive or the limits given to the message queue are
+        reached. If handling any message results in an error, False is
+        returned. Otherwise True is returned. hasMessages() can be used to
+        check whether there are messages left to be handled.
         """
         ret = True
+        count = 0
+        deadline = (
+            time.monotonic() + self._time_slice if self._time_slice is not None
+            else None)
+        if self._offloaded is not None:
+            if not self._offloaded.done():
+                return True
+            future, self._offloaded = self._offloaded, None
+            count += 1
+            ret = self._dispatch_offloaded(future)
         while self._socket.events & zmq.POLLIN:
+            if self._max_messages is not None and count >= self._max_messages:
+                break
+            if deadline is not None and count and time.monotonic() >= deadline:
+                break
+            count += 1
             try:
-                parts = self._socket.recv_multipart()
+                parts = self._socket.recv_multipart(copy=self._copy)
+                recordReceived(self._name, parts)
+                if not self._copy:
+                    parts = [_frame_to_part(frame) for frame in parts]
             except zmq.ContextTerminated: # It's okay as we're about to exit
                 return True
             except zmq.ZMQError as e:
@@ -161,33 +596,604 @@ class MessageQueue:
                     e.errno, self._name, str(e))
                 ret = False
             else:
+                if self._should_offload(parts):
+                    self._offload(parts)
+                    break
                 try:
                     self._handle_message(parts)
                 except ProtocolError as e:
                     logging.warning(
                         "Unexpected event while handling message %r from %s: %s",
-                        parts, self._name, str(e))
+                        _PartsFormatter(parts), self._name, str(e))
                     ret = False
         return ret
 
-    def _handle_message(self, parts):
-        logging.debug("Received message: %r", parts)
+    def _should_offload(self, parts):
+        return (
+            self._executor is not None and
+            self._offload_threshold is not None and
+            sum(len(part) for part in parts) >= self._offload_threshold)
+
+    def _offload(self, parts):
+        logging.debug(
+            "Decoding message %r from %s in executor",
+            _PartsFormatter(parts), self._name)
+        self._offloaded = self._executor.submit(self.decodeMessage, parts)
+        if self._offload_callback:
+            self._offloaded.add_done_callback(
+                lambda future: self._offload_callback())
+
+    def _dispatch_offloaded(self, future):
+        try:
+            self.dispatchMessage(future.result())
+        except ProtocolError as e:
+            logging.warning(
+                "Unexpected event while handling message from %s: %s",
+                self._name, str(e))
+            return False
+        except Exception:
+            # The error raised in the executor would otherwise propagate to
+            # the caller handling the messages
+            logging.exception(
+                "Error while handling offloaded message from %s", self._name)
+            return False
+        return True
+
+    def decodeMessage(self, parts):
+        """Decode message received from the socket
+
+        This method validates the message and deserializes its arguments, and
+        returns the decoded message that can be passed to dispatchMessage(). It
+        does not change the state of the queue, so it can be called from a
+        thread other than the one handling the messages. ProtocolError is raised
+        if the message is not valid.
+
+        Keyword Arguments:
+        parts -- the message frames
+        """
         command, parts = self._validator(parts)
         if command is None or parts is None:
-            raise ProtocolError("Invalid message parts: %r" % parts)
+            raise ProtocolError(
+                "Invalid message parts: %r" % _PartsFormatter(parts or []))
+        return command, self._convert_arguments(
+            command, self._decode_arguments(parts))
+
+    def dispatchMessage(self, message):
+        """Call the handler of a message returned by decodeMessage()"""
+        command, kwargs = message
         command_handler = self._handlers.get(command, None)
         if not command_handler:
             raise ProtocolError("Unrecognized command: %r" % command)
+        command_handler(**kwargs)
+
+    def dispatchMessages(self, messages):
+        """Dispatch messages decoded in another thread
+
+        The messages are either the messages returned by decodeMessage(), or
+        ProtocolError instances raised by it. If any of the messages results in an error, False is returned.
+        Otherwise True is returned.
+
+        Keyword Arguments:
+        messages -- the decoded messages
+        """
+        ret = True
+        for message in messages:
+            try:
+                if isinstance(message, ProtocolError):
+                    raise message
+                self.dispatchMessage(message)
+            except ProtocolError as e:
+                logging.warning(
+                    "Unexpected event while handling message from %s: %s",
+                    self._name, str(e))
+                ret = False
+        return ret
+
+    def _handle_message(self, parts):
+        logging.debug("Received message: %r", _PartsFormatter(parts))
+        self.dispatchMessage(self.decodeMessage(parts))
+
+    def _convert_arguments(self, command, kwargs):
+        converter = self._converters.get(command)
+        return converter(kwargs) if converter else kwargs
+
+    def _decode_arguments(self, parts):
         if len(parts) % 2 != 0:
             raise ProtocolError(
-                "Expecting even number of parameter frames, got: %r" % parts)
+                "Expecting even number of parameter frames, got: %r" %
+                _PartsFormatter(parts))
         kwargs = {}
         for n in range(0, len(parts), 2):
-            key = parts[n].decode()
-            value = parts[n+1].decode()
             try:
-                value = json.loads(value)
-            except json.decoder.JSONDecodeError as e:
-                raise ProtocolError("Error while parsing %r: %r" % (value, e))
+                key = _decode_key(parts[n])
+                value = self._codec.decode(parts[n+1])
+            except ValueError as e:
+                raise ProtocolError(
+                    "Error while parsing %r: %r" % (bytes(parts[n+1]), e))
             kwargs[key] = value
-        command_handler(**kwargs)
+        return kwargs
+
+
+def _get_command_for_tag(tag):
+    command, separator, number = tag.rpartition(b'.')
+    return command if separator and number.isdigit() else tag
+
+
+class CommandQueue(MessageQueue):
+    """Message queue for sending commands and matching the replies to them
+
+    Each command sent with sendCommand() gets a unique tag, and a future
+    (concurrent.futures.Future) is returned for it. When the reply with the
+    same tag is received, the future is completed with the reply arguments as
+    a dictionary, or the CommandFailure exception if the backend reports
+    failure. Any number of commands can be waiting for replies at the same
+    time.
+
+    If a timeout is given for the command, the future is failed with the
+    CommandTimeout exception unless the reply arrives in time. The timeouts are
+    not checked automatically: expireCommands() needs to be called when the
+    time returned by nextDeadline() is reached. Cancelling the future makes the
+    queue ignore the reply.
+
+    Replies with tags not generated by the queue are handled by the handlers
+    given to the queue, just like in MessageQueue.
+    """
+
+    _MAX_EXPIRED_TAGS = 1024
+
+    def __init__(self, socket, name, handlers=(), timeout=None, **kwargs):
+        """Initialize command queue
+
+        Keyword Arguments:
+        socket   -- the ZMQ socket the command queue is backed by
+        name     -- the name of the queue (for logging)
+        handlers -- mapping between tags and handlers for other replies
+        timeout  -- the default timeout in seconds for commands (optional)
+        **kwargs -- other arguments passed to MessageQueue
+        """
+        super().__init__(socket, name, validateControlReply, handlers, **kwargs)
+        self._timeout = timeout
+        self._tag_counter = itertools.count(1)
+        self._pending = {}
+        self._expired_tags = collections.OrderedDict()
+
+    def sendCommand(self, command, _timeout=None, **kwargs):
+        """Send command and return future for the reply
+
+        Keyword Arguments:
+        command  -- (bytes) the command to be sent, or PreparedCommand object
+        _timeout -- the timeout in seconds (overrides the default)
+        **kwargs -- the arguments of the command
+        """
+        if isinstance(command, PreparedCommand):
+            tag = self._generate_tag(command.command())
+            command.send(self._socket, tag, **kwargs)
+        else:
+            tag = self._generate_tag(command)
+            sendCommand(self._socket, command, tag, self._codec, **kwargs)
+        timeout = _timeout if _timeout is not None else self._timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        future = concurrent.futures.Future()
+        self._pending[tag] = (future, deadline)
+        return future
+
+    def pendingCommands(self):
+        """Return the number of commands waiting for reply"""
+        return len(self._pending)
+
+    def nextDeadline(self):
+        """Return the earliest deadline of the commands waiting for reply
+
+        The deadline is expressed in the time of time.monotonic(). None is
+        returned if no command waiting for reply has a timeout.
+        """
+        return min(
+            (deadline for (_, deadline) in self._pending.values()
+             if deadline is not None), default=None)
+
+    def expireCommands(self, now=None):
+        """Fail the commands whose deadline has passed
+
+        The futures of the commands are failed with CommandTimeout exception.
+        The replies to the commands are ignored if they arrive later.
+
+        Keyword Arguments:
+        now -- the current time (default: time.monotonic())
+        """
+        if now is None:
+            now = time.monotonic()
+        expired_tags = [
+            tag for (tag, (_, deadline)) in self._pending.items()
+            if deadline is not None and deadline <= now]
+        for tag in expired_tags:
+            future, _ = self._pending.pop(tag)
+            self._add_expired_tag(tag)
+            if not future.cancelled():
+                future.set_exception(
+                    CommandTimeout("No reply to command %r" % tag))
+        return len(expired_tags)
+
+    def cancelCommands(self):
+        """Cancel all commands waiting for reply
+
+        The replies to the commands are ignored if they arrive later.
+        """
+        pending, self._pending = self._pending, {}
+        for (tag, (future, _)) in pending.items():
+            self._add_expired_tag(tag)
+            future.cancel()
+
+    def _generate_tag(self, command):
+        return b'%s.%d' % (command, next(self._tag_counter))
+
+    def _add_expired_tag(self, tag):
+        self._expired_tags[tag] = None
+        while len(self._expired_tags) > self._MAX_EXPIRED_TAGS:
+            self._expired_tags.popitem(last=False)
+
+    def decodeMessage(self, parts):
+        """Decode reply received from the socket
+
+        The decoded reply contains the tag, the status, and either the
+        arguments, None if the status indicates failure, or the ProtocolError
+        raised while decoding the arguments. The error is only raised when the
+        reply is dispatched, so that the future can be failed with it.
+        """
+        if len(parts) < 3 or parts[0] != EMPTY_FRAME:
+            raise ProtocolError(
+                "Invalid message parts: %r" % _PartsFormatter(parts))
+        tag, status = parts[1], parts[2]
+        if _failed_status_code(status):
+            return tag, status, None
+        try:
+            arguments = self._convert_arguments(
+                _get_command_for_tag(tag), self._decode_arguments(parts[3:]))
+        except ProtocolError as e:
+            arguments = e
+        return tag, status, arguments
+
+    def dispatchMessage(self, message):
+        """Complete the future of the reply returned by decodeMessage()
+
+        If the reply is not to a command sent with sendCommand(), its handler
+        is called instead.
+        """
+        tag, status, arguments = message
+        if tag in self._pending:
+            future, _ = self._pending.pop(tag)
+            if future.cancelled():
+                return
+            if arguments is None:
+                future.set_exception(
+                    CommandFailure(
+                        "Command %r failed with status %r" % (tag, status)))
+            elif isinstance(arguments, ProtocolError):
+                future.set_exception(arguments)
+                raise arguments
+            else:
+                future.set_result(arguments)
+        elif tag in self._expired_tags:
+            logging.debug("Ignoring late reply to %r", tag)
+            del self._expired_tags[tag]
+        elif arguments is None:
+            raise ProtocolError(
+                "Command %r failed with status %r" % (tag, status))
+        elif isinstance(arguments, ProtocolError):
+            raise arguments
+        else:
+            super().dispatchMessage((tag, arguments))
+
+
+class ConnectionMonitor(MessageQueue):
+    """Message queue for following the connection state of a socket
+
+    The queue receives the events from the monitor socket of the socket given
+    to it, and calls the handler with True when a connection to the peer is
+    established (including the ZeroMQ handshake), and with False when it is
+    lost. The handler is only called when the state changes.
+    """
+
+    _CONNECTED_EVENT = getattr(
+        zmq, "EVENT_HANDSHAKE_SUCCEEDED", zmq.EVENT_CONNECTED)
+    _DISCONNECTED_EVENT = zmq.EVENT_DISCONNECTED
+
+    def __init__(self, socket, name, handler, **kwargs):
+        """Initialize connection monitor
+
+        Keyword Arguments:
+        socket   -- the ZMQ socket to be monitored
+        name     -- the name of the queue (for logging)
+        handler  -- the handler called with the connection state
+        **kwargs -- other arguments passed to MessageQueue
+        """
+        monitor_socket = socket.get_monitor_socket(
+            self._CONNECTED_EVENT | self._DISCONNECTED_EVENT)
+        super().__init__(monitor_socket, name, None, {}, **kwargs)
+        self._state_handler = handler
+        self._connected = None
+
+    def monitorSocket(self):
+        """Return the monitor socket the events are received from"""
+        return self._socket
+
+    def isConnected(self):
+        """Return the connection state, or None if not known yet"""
+        return self._connected
+
+    def decodeMessage(self, parts):
+        """Decode event received from the monitor socket"""
+        try:
+            return parse_monitor_message(parts)
+        except Exception:
+            raise ProtocolError("Invalid monitor event: %r" % parts)
+
+    def dispatchMessage(self, event):
+        """Call the handler if the event changes the connection state"""
+        logging.debug(
+            "Monitor event %r from %s at %r",
+            event["event"], self._name, event["endpoint"])
+        connected = event["event"] == self._CONNECTED_EVENT
+        if connected != self._connected:
+            self._connected = connected
+            self._state_handler(connected)
+
+
+class RequestAggregator:
+    """Object for merging requests for state into as few commands as possible
+
+    Keys requested with request() are collected until flush() is called, and
+    then all of them are requested with a single command. A key that is
+    already requested by a command waiting for reply is not requested again.
+
+    The request may require the reply to include the event with a given
+    counter (see bridge protocol specification), i.e. the counter of the reply
+    needs to be greater than the counter of the event. If the reply to the
+    command that was already waiting for reply turns out to be older, the key
+    is requested again on the next flush.
+    """
+
+    def __init__(self, send):
+        """Initialize request aggregator
+
+        Keyword Arguments:
+        send -- function that sends a command requesting the keys given as a
+                tuple, and returns future for the reply (see CommandQueue)
+        """
+        self._send = send
+        self._pending = {}
+        self._in_flight = {}
+
+    def request(self, *keys, counter=None):
+        """Request keys to be sent on the next flush
+
+        Keyword Arguments:
+        *keys   -- the keys requested
+        counter -- the counter of the event the reply must include (optional)
+        """
+        for key in keys:
+            if key in self._in_flight:
+                requests = self._in_flight
+            else:
+                requests = self._pending
+            requests[key] = _max_counter(requests.get(key), counter)
+
+    def pendingKeys(self):
+        """Return tuple of keys requested but not yet sent"""
+        return tuple(self._pending)
+
+    def inFlightKeys(self):
+        """Return tuple of keys sent and waiting for reply"""
+        return tuple(self._in_flight)
+
+    def flush(self):
+        """Send command requesting the pending keys
+
+        Returns the future for the reply, or None if no keys were pending.
+        """
+        if not self._pending:
+            return None
+        keys = tuple(self._pending)
+        self._in_flight.update(self._pending)
+        self._pending = {}
+        future = self._send(keys)
+        future.add_done_callback(lambda future: self._handle_reply(keys, future))
+        return future
+
+    def _handle_reply(self, keys, future):
+        counter = None
+        if not future.cancelled() and future.exception() is None:
+            counter = future.result().get(COUNTER_TAG)
+        for key in keys:
+            required_counter = self._in_flight.pop(key, None)
+            if (counter is not None and required_counter is not None and
+                    counter <= required_counter):
+                logging.debug(
+                    "Reply to %r older than required: %r <= %r",
+                    key, counter, required_counter)
+                self.request(key, counter=required_counter)
+
+
+class EventSequencer:
+    """Object for handling events in the order of their counters
+
+    Each event carries a counter that increases by one for each event in the
+    game (see bridge protocol specification). The sequencer passes the events
+    to their handlers in the order of the counters, and drops the events that
+    are older than the state already applied.
+
+    Events arriving ahead of the next expected counter are buffered. If the
+    missing events have not arrived before the gap timeout, or too many events
+    are buffered, the missing events are assumed to be lost. The resync
+    function is then called, and the state should be requested again. The
+    timeouts are not checked automatically: checkGaps() needs to be called
+    when the time returned by nextDeadline() is reached.
+    """
+
+    def __init__(self, resync, gapTimeout=0, maxBuffered=64):
+        """Initialize event sequencer
+
+        Keyword Arguments:
+        resync      -- function called with the first missing counter when
+                       events are lost
+        gapTimeout  -- the time in seconds to wait for the missing events
+        maxBuffered -- the maximum number of events buffered
+        """
+        self._resync = resync
+        self._gap_timeout = gapTimeout
+        self._max_buffered = maxBuffered
+        self._next_counter = None
+        self._buffer = {}
+        self._gap_deadline = None
+        self._resyncing = False
+
+    def setCounter(self, counter):
+        """Set the counter of the next event expected
+
+        This method should be called when the full state is applied, with the
+        counter of the state. It completes the resync if one was started.
+        """
+        self._next_counter = counter
+        self._resyncing = False
+        self._gap_deadline = None
+        for stale_counter in [c for c in self._buffer if c < counter]:
+            del self._buffer[stale_counter]
+        self._deliver_events()
+
+    def reset(self):
+        """Forget the counter and the buffered events
+
+        This method should be called when the counters start over, e.g. when
+        the game is joined on another backend. The events are handled
+        immediately until setCounter() is called again.
+        """
+        self._next_counter = None
+        self._buffer.clear()
+        self._resyncing = False
+        self._gap_deadline = None
+
+    def handleEvent(self, handler, counter=None, **kwargs):
+        """Handle event or buffer it until the earlier events are handled
+
+        The handler is called with the counter and the other arguments as
+        keyword arguments. Events without counter are handled immediately.
+
+        Keyword Arguments:
+        handler  -- the handler of the event
+        counter  -- the counter of the event
+        **kwargs -- the other arguments of the event
+        """
+        if counter is None or self._next_counter is None:
+            handler(counter=counter, **kwargs)
+            return
+        if counter < self._next_counter or counter in self._buffer:
+            logging.debug(
+                "Stale event, counter: %r, next counter %r",
+                counter, self._next_counter)
+            return
+        self._buffer[counter] = (handler, kwargs)
+        self._deliver_events()
+
+    def bufferedEvents(self):
+        """Return the number of events waiting for the earlier ones"""
+        return len(self._buffer)
+
+    def nextDeadline(self):
+        """Return the time the missing events are waited for
+
+        The deadline is expressed in the time of time.monotonic(). None is
+        returned if no events are missing, or if resync is in progress.
+        """
+        return None if self._resyncing else self._gap_deadline
+
+    def checkGaps(self, now=None):
+        """Start resync if the missing events were not received in time
+
+        Returns True if resync was started, False otherwise.
+
+        Keyword Arguments:
+        now -- the current time (default: time.monotonic())
+        """
+        if now is None:
+            now = time.monotonic()
+        deadline = self.nextDeadline()
+        if deadline is None or deadline > now:
+            return False
+        self._start_resync()
+        return True
+
+    def resyncFailed(self):
+        """Notify that the state could not be requested
+
+        The resync is started again after the gap timeout.
+        """
+        self._resyncing = False
+        if self._buffer:
+            self._gap_deadline = time.monotonic() + self._gap_timeout
+
+    def _deliver_events(self):
+        while self._next_counter in self._buffer:
+            counter = self._next_counter
+            handler, kwargs = self._buffer.pop(counter)
+            self._next_counter += 1
+            handler(counter=counter, **kwargs)
+        if not self._buffer:
+            self._gap_deadline = None
+        elif len(self._buffer) > self._max_buffered:
+            if not self._resyncing:
+                self._start_resync()
+        elif self._gap_deadline is None:
+            self._gap_deadline = time.monotonic() + self._gap_timeout
+
+    def _start_resync(self):
+        logging.warning("Missing events from counter %r", self._next_counter)
+        self._resyncing = True
+        self._gap_deadline = None
+        self._resync(self._next_counter)
+
+
+def _max_counter(counter1, counter2):
+    if counter1 is None:
+        return counter2
+    if counter2 is None:
+        return counter1
+    return max(counter1, counter2)
+
+
+class MessageScheduler:
+    """Object for handling messages from several message queues
+
+    The scheduler handles messages from message queues in the order of their
+    priority. Each call to handleMessages() gives every queue a turn, so
+    limiting the number of messages handled by each queue makes the scheduler
+    share the time fairly between the queues, while the queues with higher
+    priority are still served first.
+    """
+
+    def __init__(self, queues=()):
+        """Initialize message scheduler
+
+        Keyword Arguments:
+        queues -- the initial message queues in the order of priority
+        """
+        self._queues = list(queues)
+
+    def addQueue(self, queue):
+        """Add message queue with priority lower than the existing ones"""
+        self._queues.append(queue)
+
+    def hasMessages(self):
+        """Return True if any of the queues has messages to be handled"""
+        return any(queue.hasMessages() for queue in self._queues)
+
+    def handleMessages(self):
+        """Handle messages from all queues
+
+        Each queue handles messages up to its limit, starting from the queue
+        with the highest priority. If handling messages results in an error in
+        any queue, False is returned. Otherwise True is returned.
+        """
+        ret = True
+        for queue in list(self._queues):
+            if not queue.handleMessages():
+                ret = False
+        return ret
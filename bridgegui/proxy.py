@@ -0,0 +1,296 @@
+"""Network impairment proxy for bridge frontend
+
+This module contains a proxy that sits between the frontend and the backend
+and makes the network worse in a reproducible way. The frontend connects to
+the proxy as it would connect to the backend, and the proxy forwards the
+messages on both the control and the event channel after an impairment
+profile has been applied to them:
+
+- Every message is delayed by the delay of the profile plus a random jitter.
+  Messages in the same direction stay in order, unless they are reordered.
+- The replies and the events are reordered with the given probability, by
+  holding the message back so that the later messages overtake it.
+- The events are dropped with the given probability. The commands and replies
+  are never dropped, because ZeroMQ delivers them reliably, while the
+  publisher of the backend drops events when a subscriber falls behind.
+
+Like the frontend, the proxy follows the convention of the control and event
+endpoints being adjacent (see messaging.endpoints()). The usage of the command
+line tool is documented when the module is run with the -h argument.
+
+Classes:
+Profile         -- impairment profile
+ImpairmentProxy -- object forwarding messages with impairments
+"""
+
+import argparse
+import collections
+import heapq
+import itertools
+import logging
+import random
+import sys
+import time
+
+import zmq
+
+import bridgegui.messaging as messaging
+
+Profile = collections.namedtuple(
+    "Profile", ("delay", "jitter", "reorder", "drop"))
+Profile.__doc__ = """Impairment profile
+
+The delay and the jitter are in seconds, and apply to each direction. The
+reorder and drop fields are the probabilities of reordering and dropping a
+message.
+"""
+
+PROFILES = {
+    "none": Profile(0, 0, 0, 0),
+    "lan": Profile(0.001, 0.0005, 0, 0),
+    "broadband": Profile(0.015, 0.005, 0, 0),
+    "wifi": Profile(0.01, 0.03, 0.01, 0.001),
+    "mobile": Profile(0.06, 0.04, 0.02, 0.005),
+    "lossy": Profile(0.03, 0.01, 0.05, 0.02),
+    "satellite": Profile(0.3, 0.02, 0, 0),
+}
+
+# The maximum time in seconds ImpairmentProxy.run() waits for messages before
+# checking whether it has been stopped
+POLL_INTERVAL = 0.1
+# The minimum time in seconds a reordered message is held back
+REORDER_DELAY = 0.01
+
+
+class ImpairmentProxy:
+    """Object forwarding messages with impairments
+
+    The control channel is forwarded through a ROUTER socket facing the
+    frontends and a DEALER socket for each frontend facing the backend, so
+    that the backend sees each frontend as a separate peer. The event channel
+    is forwarded through an XPUB and an XSUB socket.
+
+    The proxy is run either with run() in a thread of its own, or by calling
+    handleMessages() and handleTimeouts() from an event loop.
+    """
+
+    def __init__(
+            self, frontend, backend, profile=None, seed=None, context=None):
+        """Initialize impairment proxy
+
+        Keyword Arguments:
+        frontend -- the base endpoint the proxy binds to
+        backend  -- the base endpoint of the backend
+        profile  -- the impairment Profile (default: no impairments)
+        seed     -- the seed of the random impairments (optional)
+        context  -- the ZeroMQ context (default: the global instance)
+        """
+        self._context = context or zmq.Context.instance()
+        frontend_control, frontend_event = itertools.islice(
+            messaging.endpoints(frontend), 2)
+        self._backend_control, backend_event = itertools.islice(
+            messaging.endpoints(backend), 2)
+        self._profile = profile or PROFILES["none"]
+        self._rng = random.Random(seed)
+        self._frontend_control_socket = self._context.socket(zmq.ROUTER)
+        self._frontend_control_socket.bind(frontend_control)
+        self._frontend_event_socket = self._context.socket(zmq.XPUB)
+        self._frontend_event_socket.bind(frontend_event)
+        self._backend_event_socket = self._context.socket(zmq.XSUB)
+        self._backend_event_socket.connect(backend_event)
+        self._backend_control_sockets = {}
+        self._identities = {}
+        self._poller = zmq.Poller()
+        for socket in (
+                self._frontend_control_socket, self._frontend_event_socket,
+                self._backend_event_socket):
+            self._poller.register(socket, zmq.POLLIN)
+        self._handlers = {
+            self._frontend_control_socket: self._handle_command,
+            self._frontend_event_socket: self._handle_subscription,
+            self._backend_event_socket: self._handle_event,
+        }
+        self._scheduled = []
+        self._sequence = itertools.count()
+        self._last_due = {}
+        self._running = False
+
+    def profile(self):
+        """Return the impairment profile"""
+        return self._profile
+
+    def setProfile(self, profile):
+        """Set the impairment profile
+
+        The profile applies to the messages received after the call. It is
+        safe to call this method from another thread.
+        """
+        self._profile = profile
+
+    def handleMessages(self):
+        """Receive the messages ready to be received and schedule them"""
+        self._receive(self._poller.poll(0))
+
+    def nextDeadline(self):
+        """Return the time the next message is due, or None
+
+        The time is compared to time.monotonic().
+        """
+        return self._scheduled[0][0] if self._scheduled else None
+
+    def handleTimeouts(self, now=None):
+        """Forward the messages that are due
+
+        Keyword Arguments:
+        now -- the current time (default: time.monotonic())
+        """
+        if now is None:
+            now = time.monotonic()
+        while self._scheduled and self._scheduled[0][0] <= now:
+            _, _, socket, parts = heapq.heappop(self._scheduled)
+            try:
+                socket.send_multipart(parts, zmq.NOBLOCK)
+            except zmq.ZMQError as e:
+                logging.warning(
+                    "Error %d while forwarding message: %s", e.errno, str(e))
+
+    def run(self):
+        """Forward messages until stop() is called
+
+        The sockets are closed when the method returns.
+        """
+        self._running = True
+        try:
+            while self._running:
+                timeout = POLL_INTERVAL
+                deadline = self.nextDeadline()
+                if deadline is not None:
+                    timeout = max(0, min(timeout, deadline - time.monotonic()))
+                self._receive(self._poller.poll(int(timeout * 1000)))
+                self.handleTimeouts()
+        finally:
+            self.close()
+
+    def stop(self):
+        """Stop forwarding
+
+        The proxy stops within POLL_INTERVAL. It is safe to call this method
+        from another thread.
+        """
+        self._running = False
+
+    def close(self):
+        """Close the sockets of the proxy"""
+        for socket in itertools.chain(
+                self._handlers, self._backend_control_sockets.values()):
+            socket.close(linger=0)
+
+    def _receive(self, events):
+        for socket, _ in events:
+            handler = self._handlers.get(socket, self._handle_reply)
+            while socket.events & zmq.POLLIN:
+                handler(socket, socket.recv_multipart())
+
+    def _handle_command(self, socket, parts):
+        identity, *parts = parts
+        backend_socket = self._backend_control_sockets.get(identity)
+        if backend_socket is None:
+            backend_socket = self._context.socket(zmq.DEALER)
+            backend_socket.connect(self._backend_control)
+            self._poller.register(backend_socket, zmq.POLLIN)
+            self._backend_control_sockets[identity] = backend_socket
+            self._identities[backend_socket] = identity
+        self._schedule(backend_socket, parts)
+
+    def _handle_reply(self, socket, parts):
+        self._schedule(
+            self._frontend_control_socket, [self._identities[socket]] + parts,
+            reorder=True)
+
+    def _handle_subscription(self, socket, parts):
+        self._schedule(self._backend_event_socket, parts)
+
+    def _handle_event(self, socket, parts):
+        self._schedule(
+            self._frontend_event_socket, parts, reorder=True, drop=True)
+
+    def _schedule(self, socket, parts, reorder=False, drop=False):
+        profile = self._profile
+        if drop and self._rng.random() < profile.drop:
+            logging.debug("Dropping message: %r", parts)
+            return
+        now = time.monotonic()
+        due = now + profile.delay + self._rng.uniform(0, profile.jitter)
+        if reorder and self._rng.random() < profile.reorder:
+            # Held back without holding back the later messages
+            due += max(profile.delay, REORDER_DELAY)
+        else:
+            due = max(due, self._last_due.get(socket, now))
+            self._last_due[socket] = due
+        heapq.heappush(
+            self._scheduled, (due, next(self._sequence), socket, parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Network impairment proxy for bridge frontend")
+    parser.add_argument(
+        "backend",
+        help="""Base endpoint of the bridge backend. Follows ZeroMQ transmit
+             protocol syntax. For example: tcp://bridge.example.com:5555.""")
+    parser.add_argument(
+        "--listen", default="tcp://127.0.0.1:5655",
+        help="""Base endpoint the frontend connects to instead of the
+             backend.""")
+    parser.add_argument(
+        "--profile", choices=sorted(PROFILES), default="none",
+        help="""The impairment profile. The options below override the parts
+             of the profile.""")
+    parser.add_argument(
+        "--delay", type=float,
+        help="""The delay of the messages in each direction in seconds.""")
+    parser.add_argument(
+        "--jitter", type=float,
+        help="""The maximum random delay added to the messages in seconds.""")
+    parser.add_argument(
+        "--reorder", type=float,
+        help="""The probability of reordering a reply or an event.""")
+    parser.add_argument(
+        "--drop", type=float,
+        help="""The probability of dropping an event.""")
+    parser.add_argument(
+        "--seed", type=int,
+        help="""The seed of the random impairments.""")
+    parser.add_argument(
+        "--verbose", "-v", action="count", default=0,
+        help="""Increase logging levels. Repeat for even more logging.""")
+    args = parser.parse_args()
+
+    logging_level = logging.WARNING
+    if args.verbose == 1:
+        logging_level = logging.INFO
+    elif args.verbose >= 2:
+        logging_level = logging.DEBUG
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s', level=logging_level)
+
+    profile = PROFILES[args.profile]._replace(**{
+        field: getattr(args, field) for field in Profile._fields
+        if getattr(args, field) is not None
+    })
+    try:
+        proxy = ImpairmentProxy(
+            args.listen, args.backend, profile, seed=args.seed)
+    except (ValueError, zmq.ZMQError) as e:
+        parser.error(str(e))
+    logging.info("Forwarding %s to %s with %r", args.listen, args.backend, profile)
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        pass
+    zmq.Context.instance().destroy(linger=0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
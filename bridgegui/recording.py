@@ -0,0 +1,563 @@
+"""Session recording and replay for bridge frontend
+
+This module contains tools for recording the messages exchanged between the
+frontend and the backend, and for replaying a recorded session. The recordings
+give repeatable workloads for profiling the frontend, and make it possible to
+reproduce the behavior of the frontend in a session offline.
+
+The recorder is installed with messaging.setRecorder(). It records the
+multipart messages received by the message queues and the commands sent, with
+the time.monotonic() timestamps of receiving and sending them. The recording is
+an append-only binary file. It starts with the MAGIC header, and consists of
+records of the following form (all integers little-endian):
+
+- the type of the record (one byte): CHANNEL_RECORD, RECEIVED_RECORD or
+  SENT_RECORD
+- the channel (one byte): the index of the channel name among the channel
+  records of the session
+- the timestamp (double)
+- the number of parts (unsigned 16-bit integer)
+- for each part its length (unsigned 32-bit integer) followed by the part
+
+A channel record has the UTF-8 encoded channel name as its only part. Each
+recorder starts a new session by writing the MAGIC header, so several sessions
+can be appended to the same file.
+
+The replayer acts as a backend for a live client: it publishes the recorded
+events, and replies to the commands of the client with the recorded replies.
+The replies are matched to the commands by the command, and sent with the tag
+of the command of the live client. The recorded replies to the commands sent
+due to the actions of the user are skipped if the live client has not sent
+such a command. The usage of the command line tool replaying a recording into
+a headless client is documented when the module is run with the -h argument.
+bridgegui.__main__ has options for recording and replaying the sessions of the
+graphical frontend.
+
+Functions:
+readRecords -- read records from a recording
+readSession -- read the records of one session from a recording
+
+Classes:
+Record   -- recorded message
+Recorder -- object writing messages to a recording
+Replayer -- object replaying a recorded session to a live client
+"""
+
+import argparse
+import collections
+import itertools
+import logging
+import struct
+import sys
+import threading
+import time
+
+import zmq
+
+import bridgegui.client as client
+import bridgegui.messaging as messaging
+
+MAGIC = b'\x89BGREC\r\n'
+CHANNEL_RECORD = 0
+RECEIVED_RECORD = 1
+SENT_RECORD = 2
+
+# The maximum time in seconds the replayer waits for the live client to send
+# a command the recorded client sent before it skips the reply
+STALL_TIMEOUT = 0.5
+# The maximum time in seconds Replayer.run() waits for messages before
+# checking whether it has been stopped
+POLL_INTERVAL = 0.1
+
+# The commands a live client does not necessarily send, because they depend
+# on the options given to the client or on the actions of the user
+_OPTIONAL_COMMANDS = frozenset(
+    (client.GAME_COMMAND, client.CALL_COMMAND, client.PLAY_COMMAND))
+
+_GAME_KEY = client.GAME_TAG.encode()
+# The size of the first frame of the messages of the socket monitor
+_MONITOR_EVENT_SIZE = 6
+_RECORD_HEADER = struct.Struct("<BBdH")
+_PART_HEADER = struct.Struct("<I")
+
+Record = collections.namedtuple(
+    "Record", ("type", "channel", "timestamp", "parts"))
+Record.__doc__ = """Recorded message
+
+The type is RECEIVED_RECORD or SENT_RECORD, the channel is the name of the
+channel, the timestamp is the time.monotonic() time of recording the message,
+and the parts are the frames of the message (list of bytes).
+"""
+
+
+class Recorder:
+    """Object writing messages to a recording
+
+    The recorder can be used from several threads. The records are buffered,
+    and the buffer is written to the file when it is full, and when flush() or
+    close() is called.
+    """
+
+    def __init__(self, file):
+        """Initialize recorder
+
+        Keyword Arguments:
+        file -- the binary file object opened for appending, or the name of
+                the file
+        """
+        if isinstance(file, str):
+            file = open(file, "ab")
+        self._file = file
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._file.write(MAGIC)
+
+    def recordReceived(self, channel, parts):
+        """Record message received from channel
+
+        Keyword Arguments:
+        channel -- the name of the channel
+        parts   -- the frames of the message (bytes or zmq.Frame objects)
+        """
+        self._record(RECEIVED_RECORD, channel, parts)
+
+    def recordSent(self, channel, parts):
+        """Record message sent to channel
+
+        Keyword Arguments:
+        channel -- the name of the channel
+        parts   -- the frames of the message (bytes or zmq.Frame objects)
+        """
+        self._record(SENT_RECORD, channel, parts)
+
+    def flush(self):
+        """Write the buffered records to the file"""
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        """Flush and close the file"""
+        with self._lock:
+            self._file.close()
+
+    def _record(self, type_, channel, parts):
+        timestamp = time.monotonic()
+        with self._lock:
+            if self._file.closed:
+                return
+            channel_index = self._channels.get(channel)
+            if channel_index is None:
+                channel_index = self._channels[channel] = len(self._channels)
+                self._write(CHANNEL_RECORD, channel_index, timestamp,
+                            [channel.encode()])
+            self._write(type_, channel_index, timestamp, parts)
+
+    def _write(self, type_, channel_index, timestamp, parts):
+        write = self._file.write
+        write(_RECORD_HEADER.pack(type_, channel_index, timestamp, len(parts)))
+        for part in parts:
+            part = memoryview(part)
+            write(_PART_HEADER.pack(part.nbytes))
+            write(part)
+
+
+def _read_exactly(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise EOFError("Recording ends in the middle of a record")
+    return data
+
+
+def readRecords(file):
+    """Read records from a recording
+
+    This function is a generator yielding (session, record) pairs, where the
+    session is the index of the session the Record belongs to. The channel
+    records are not yielded. ValueError is raised if the file is not a
+    recording. A recording truncated in the middle of a record (for example
+    because the recording application crashed) ends at the last complete
+    record.
+
+    Keyword Arguments:
+    file -- the binary file object, or the name of the file
+    """
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            yield from readRecords(f)
+        return
+    session = -1
+    channels = []
+    while True:
+        type_byte = file.read(1)
+        if not type_byte:
+            return
+        try:
+            if type_byte == MAGIC[:1]:
+                if _read_exactly(file, len(MAGIC) - 1) != MAGIC[1:]:
+                    raise ValueError("Not a recording")
+                session += 1
+                channels = []
+                continue
+            if session < 0:
+                raise ValueError("Not a recording")
+            type_, channel_index, timestamp, count = _RECORD_HEADER.unpack(
+                type_byte + _read_exactly(file, _RECORD_HEADER.size - 1))
+            parts = []
+            for _ in range(count):
+                size, = _PART_HEADER.unpack(
+                    _read_exactly(file, _PART_HEADER.size))
+                parts.append(_read_exactly(file, size))
+        except EOFError as e:
+            logging.warning("%s", str(e))
+            return
+        if type_ == CHANNEL_RECORD:
+            channels.append(parts[0].decode())
+        elif type_ in (RECEIVED_RECORD, SENT_RECORD):
+            yield session, Record(
+                type_, channels[channel_index], timestamp, parts)
+        else:
+            raise ValueError("Unknown record type: %d" % type_)
+
+
+def readSession(file, session=0):
+    """Read the records of one session from a recording
+
+    Returns the list of records of the session.
+
+    Keyword Arguments:
+    file    -- the binary file object, or the name of the file
+    session -- the index of the session (default: the first session)
+    """
+    return [
+        record for (index, record) in readRecords(file) if index == session]
+
+
+class Replayer:
+    """Object replaying a recorded session to a live client
+
+    The replayer binds a ROUTER and an XPUB socket to the control and event
+    endpoints following the base endpoint, and replays the recorded replies
+    and events received by the control and event socket of the recorded
+    client. The messages are replayed in the recorded order, either paced by
+    the recorded timestamps or as fast as possible. A reply is replayed when
+    the live client has sent the command it is the reply to, and the events
+    are published when the live client has subscribed to them. The replay
+    starts when the first command of the live client is received.
+
+    The replayer is run either with run() in a thread of its own, or by calling
+    handleMessages() and handleTimeouts() from an event loop.
+    """
+
+    def __init__(
+            self, records, endpoint, speed=None, stallTimeout=STALL_TIMEOUT,
+            context=None):
+        """Initialize replayer
+
+        Keyword Arguments:
+        records      -- the records of the session (see readSession())
+        endpoint     -- the base endpoint the replayer binds to
+        speed        -- the speed of the replay relative to the recorded
+                        timestamps (default: as fast as possible)
+        stallTimeout -- the time in seconds to wait for the live client to
+                        send a command before the reply is skipped
+        context      -- the ZeroMQ context (default: the global instance)
+        """
+        self._context = context or zmq.Context.instance()
+        control_endpoint, event_endpoint = itertools.islice(
+            messaging.endpoints(endpoint), 2)
+        commands = {}
+        self._messages = collections.deque()
+        for record in records:
+            if record.type == SENT_RECORD and len(record.parts) >= 3:
+                commands[record.parts[1]] = record.parts[2]
+            elif record.type == RECEIVED_RECORD and record.parts:
+                message = self._classify(record, commands)
+                if message:
+                    self._messages.append(message)
+        self._total = len(self._messages)
+        self._origin = records[0].timestamp if records else 0
+        self._speed = speed
+        self._stall_timeout = stallTimeout
+        self._control_socket = self._context.socket(zmq.ROUTER)
+        self._control_socket.bind(control_endpoint)
+        self._event_socket = self._context.socket(zmq.XPUB)
+        # The replayed events are not dropped even if the client falls behind
+        self._event_socket.sndhwm = 0
+        self._event_socket.bind(event_endpoint)
+        self._poller = zmq.Poller()
+        self._poller.register(self._control_socket, zmq.POLLIN)
+        self._poller.register(self._event_socket, zmq.POLLIN)
+        self._commands = collections.defaultdict(collections.deque)
+        self._subscribed = False
+        self._start_time = None
+        self._stall_time = None
+        self._skipped = 0
+        self._running = False
+
+    def gameUuid(self):
+        """Return the UUID of the recorded game, or None
+
+        The live client joins the game with this UUID.
+        """
+        for (command, parts) in (
+                (message[1], message[2]) for message in self._messages):
+            if command in (client.GAME_COMMAND, client.JOIN_COMMAND):
+                arguments = dict(zip(parts[3::2], parts[4::2]))
+                game = arguments.get(_GAME_KEY)
+                if game is not None:
+                    return messaging.getCodec().decode(game)
+            elif command is None:
+                return parts[0].split(b':', 1)[0].decode()
+        return None
+
+    def remaining(self):
+        """Return the number of messages not yet replayed"""
+        return len(self._messages)
+
+    def replayed(self):
+        """Return the number of messages replayed"""
+        return self._total - len(self._messages) - self._skipped
+
+    def skipped(self):
+        """Return the number of replies skipped"""
+        return self._skipped
+
+    def isFinished(self):
+        """Return True if all messages have been replayed or skipped"""
+        return not self._messages
+
+    def handleMessages(self):
+        """Receive the commands and subscriptions of the live client"""
+        for socket, _ in self._poller.poll(0):
+            self._receive(socket)
+
+    def nextDeadline(self):
+        """Return the time the next message is due, or None
+
+        None is returned if the next message waits for the live client. The
+        time is compared to time.monotonic().
+        """
+        if not self._messages or self._start_time is None:
+            return None
+        if self._stall_time is not None:
+            return self._stall_time + self._stall_timeout
+        return self._due(self._messages[0])
+
+    def handleTimeouts(self, now=None):
+        """Replay the messages that are due
+
+        Keyword Arguments:
+        now -- the current time (default: time.monotonic())
+        """
+        if self._start_time is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        while self._messages:
+            message = self._messages[0]
+            due = self._due(message)
+            if due is not None and due > now:
+                break
+            if not self._replay(message, now):
+                break
+            self._messages.popleft()
+            self._stall_time = None
+
+    def run(self, keepOpen=False):
+        """Replay the session until it is finished or stop() is called
+
+        The sockets are closed when the method returns.
+
+        Keyword Arguments:
+        keepOpen -- if True, the sockets are kept open after the session has
+                    been replayed until stop() is called, so that the live
+                    client stays connected
+        """
+        self._running = True
+        try:
+            while self._running and (keepOpen or self._messages):
+                timeout = POLL_INTERVAL
+                deadline = self.nextDeadline()
+                if deadline is not None:
+                    timeout = max(0, min(timeout, deadline - time.monotonic()))
+                for socket, _ in self._poller.poll(int(timeout * 1000)):
+                    self._receive(socket)
+                self.handleTimeouts()
+        finally:
+            self.close()
+
+    def stop(self):
+        """Stop replaying
+
+        The replayer stops within POLL_INTERVAL. It is safe to call this
+        method from another thread.
+        """
+        self._running = False
+
+    def close(self):
+        """Close the sockets of the replayer"""
+        self._control_socket.close(linger=0)
+        self._event_socket.close(linger=0)
+
+    @staticmethod
+    def _classify(record, commands):
+        # Returns (timestamp, command, parts) for replies, (timestamp, None,
+        # parts) for events, and None for other messages (e.g. the events of
+        # the socket monitor)
+        parts = record.parts
+        if parts[0] == messaging.EMPTY_FRAME and len(parts) >= 3:
+            command = commands.get(
+                parts[1], messaging._get_command_for_tag(parts[1]))
+            return record.timestamp, command, parts
+        if len(parts) == 2 and len(parts[0]) == _MONITOR_EVENT_SIZE:
+            return None
+        return record.timestamp, None, parts
+
+    def _due(self, message):
+        if self._speed is None:
+            return None
+        return self._start_time + (message[0] - self._origin) / self._speed
+
+    def _receive(self, socket):
+        while socket.events & zmq.POLLIN:
+            parts = socket.recv_multipart()
+            if socket is self._event_socket:
+                if parts[0][:1] == b'\x01':
+                    self._subscribed = True
+            elif len(parts) >= 4:
+                if self._start_time is None:
+                    self._start_time = time.monotonic()
+                identity, _, tag, command = parts[:4]
+                self._commands[command].append((identity, tag))
+
+    def _replay(self, message, now):
+        _, command, parts = message
+        if command is None:
+            if not self._subscribed:
+                return self._stall(now)
+            self._event_socket.send_multipart(parts)
+            return True
+        pending = self._commands.get(command)
+        if pending:
+            identity, tag = pending.popleft()
+            self._control_socket.send_multipart(
+                [identity, messaging.EMPTY_FRAME, tag] + parts[2:])
+            return True
+        if command in _OPTIONAL_COMMANDS:
+            self._skipped += 1
+            return True
+        return self._stall(now)
+
+    def _stall(self, now):
+        if self._stall_time is None:
+            self._stall_time = now
+            return False
+        if now < self._stall_time + self._stall_timeout:
+            return False
+        logging.warning("Live client stalled. Skipping message.")
+        self._skipped += 1
+        return True
+
+
+class _HeadlessObserver(client.GameObserver):
+    # Observer registering the sockets of a headless client to a poller
+
+    def __init__(self, poller):
+        self._poller = poller
+        self.sockets = []
+
+    def messageQueueAdded(self, socket, queue):
+        self._poller.register(socket, zmq.POLLIN)
+        self.sockets.append(socket)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""Replay a recorded session into a headless client. The
+                    graphical frontend replays recordings with the --replay
+                    option.""")
+    parser.add_argument(
+        "recording", help="""The recording file.""")
+    parser.add_argument(
+        "--session", type=int, default=0,
+        help="""The index of the session replayed if the recording contains
+             several sessions.""")
+    parser.add_argument(
+        "--speed", type=float,
+        help="""Replay the session at the given speed relative to the recorded
+             timestamps, for example 1 for real time. If omitted, the session
+             is replayed as fast as possible.""")
+    parser.add_argument(
+        "--endpoint", default="inproc://bridgegui-replay",
+        help="""Base endpoint the replayer binds to.""")
+    parser.add_argument(
+        "--pipelined-startup", action="store_true",
+        help="""If given, the client sends the commands needed to join the game
+             without waiting for the replies to the earlier commands.""")
+    parser.add_argument(
+        "--verbose", "-v", action="count", default=0,
+        help="""Increase logging levels. Repeat for even more logging.""")
+    args = parser.parse_args()
+
+    logging_level = logging.WARNING
+    if args.verbose == 1:
+        logging_level = logging.INFO
+    elif args.verbose >= 2:
+        logging_level = logging.DEBUG
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s', level=logging_level)
+
+    try:
+        records = readSession(args.recording, args.session)
+        replayer = Replayer(records, args.endpoint, speed=args.speed)
+    except (OSError, ValueError, zmq.ZMQError) as e:
+        parser.error(str(e))
+    if replayer.isFinished():
+        parser.error("No messages to replay in the session")
+
+    zmqctx = zmq.Context.instance()
+    poller = zmq.Poller()
+    observer = _HeadlessObserver(poller)
+    control_socket = zmqctx.socket(zmq.DEALER)
+    event_socket = zmqctx.socket(zmq.SUB)
+    game_client = client.GameClient(
+        control_socket, event_socket, gameUuid=replayer.gameUuid(),
+        pipelinedStartup=args.pipelined_startup,
+        endpoints=[tuple(itertools.islice(messaging.endpoints(args.endpoint), 2))],
+        observer=observer)
+    # The replayer is kept open until the client has handled the messages,
+    # because the client cannot send commands to a closed replayer
+    thread = threading.Thread(target=replayer.run, kwargs={"keepOpen": True})
+    start_time = time.monotonic()
+    thread.start()
+    game_client.start()
+    errors = 0
+    try:
+        while not replayer.isFinished() or game_client.hasMessages():
+            timeout = 0 if game_client.hasMessages() else POLL_INTERVAL
+            deadline = game_client.nextDeadline()
+            if deadline is not None:
+                timeout = max(0, min(timeout, deadline - time.monotonic()))
+            poller.poll(int(timeout * 1000))
+            if not game_client.handleMessages():
+                errors += 1
+            if not game_client.handleTimeouts():
+                errors += 1
+    except KeyboardInterrupt:
+        pass
+    replayer.stop()
+    thread.join()
+    elapsed = time.monotonic() - start_time
+    for socket in [control_socket, event_socket] + observer.sockets:
+        socket.close(linger=0)
+    zmqctx.destroy(linger=0)
+
+    print("Replayed %d messages (%d skipped) in %.3f s, %.0f messages/s, "
+          "%d errors" % (
+              replayer.replayed(), replayer.skipped(), elapsed,
+              replayer.replayed() / elapsed if elapsed else 0, errors))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,920 @@
+"""Stand-in bridge backend
+
+This module contains a lightweight backend implementing the part of the bridge
+protocol used by the frontend: the bridgehlo, game, join, get, call and play
+commands, and the events published to the players with counters. It is meant
+for testing and benchmarking the frontend, the load generator and the other
+clients without the real backend, all on one machine.
+
+The deals are either random (optionally seeded, so that runs can be repeated)
+or scripted, in which case the hands are given in advance. The deals are
+played by the usual rules of contract bridge. The dealer and the
+vulnerabilities rotate as in duplicate bridge.
+
+The server does not depend on Qt. The usage of the command line tool is
+documented when the module is run with the -h argument.
+
+Functions:
+randomHands -- return random hands
+
+Classes:
+Deal   -- model of one deal
+Game   -- game played by four players
+Server -- object serving the bridge protocol
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import random
+import sys
+import uuid
+
+import zmq
+
+import bridgegui.calls as calls
+import bridgegui.deck as deck
+import bridgegui.messaging as messaging
+import bridgegui.positions as positions
+from bridgegui.client import (
+    HELLO_COMMAND, GAME_COMMAND, JOIN_COMMAND, GET_COMMAND,
+    DEAL_COMMAND, CALL_COMMAND, BIDDING_COMMAND, PLAY_COMMAND, TURN_COMMAND,
+    DUMMY_COMMAND, TRICK_COMMAND, DEALEND_COMMAND, PLAYER_COMMAND, CLIENT_TAG,
+    POSITION_TAG, GAME_TAG, PUBSTATE_TAG, PRIVSTATE_TAG, SELF_TAG,
+    POSITION_IN_TURN_TAG, ALLOWED_CALLS_TAG, CALLS_TAG, CALL_TAG, DECLARER_TAG,
+    CONTRACT_TAG, ALLOWED_CARDS_TAG, CARDS_TAG, CARD_TAG, TRICKS_TAG,
+    WINNER_TAG, VULNERABILITY_TAG)
+
+PARTNERSHIP_TAG = "partnership"
+SCORE_TAG = "score"
+REPLY_SUCCESS = b'OK'
+REPLY_FAILURE = b'ERR'
+
+N_CARDS_IN_HAND = len(deck.RANK_TAGS)
+# The vulnerabilities of the partnerships in the boards of a duplicate session
+VULNERABILITIES = (
+    (False, False), (True, False), (False, True), (True, True),
+    (True, False), (False, True), (True, True), (False, False),
+    (False, True), (True, True), (False, False), (True, False),
+    (True, True), (False, False), (True, False), (False, True),
+)
+# The maximum number of messages handled at once by Server.handleMessages()
+MAX_MESSAGES = 256
+# The maximum time in seconds Server.run() waits for messages before checking
+# whether it has been stopped
+POLL_INTERVAL = 0.1
+
+_ALL_CARDS = tuple(
+    deck.Card(rank, suit) for suit in deck.SUIT_TAGS for rank in deck.RANK_TAGS)
+_CARD_ORDER = { card: n for (n, card) in enumerate(_ALL_CARDS) }
+_BIDS = tuple(
+    calls.Bid(level, strain) for level in range(1, calls.LEVELS + 1)
+    for strain in calls.STRAIN_TAGS)
+_BID_ORDER = { bid: n for (n, bid) in enumerate(_BIDS) }
+_TRICK_SIZE = len(positions.Position)
+_TRICKS_IN_BOOK = 6
+_STATE_TAGS = (PUBSTATE_TAG, PRIVSTATE_TAG, SELF_TAG)
+
+
+def randomHands(rng=random):
+    """Return random hands
+
+    Returns a mapping from Position enumerations to the lists of the cards
+    held by the players.
+
+    Keyword Arguments:
+    rng -- random.Random used to shuffle the deck (default: the random module)
+    """
+    cards = list(_ALL_CARDS)
+    rng.shuffle(cards)
+    return {
+        position: cards[position::len(positions.Position)]
+        for position in positions.Position
+    }
+
+
+class Deal:
+    """Model of one deal
+
+    The deal keeps track of the bidding and the play. The calls and the cards
+    are checked against the rules, and ProtocolError is raised if a position
+    tries to make a call or play a card it is not allowed to.
+    """
+
+    def __init__(self, opener, vulnerability, hands):
+        """Initialize deal
+
+        Keyword Arguments:
+        opener        -- the position making the first call
+        vulnerability -- mapping from Partnership enumerations to booleans
+                         telling whether the partnership is vulnerable
+        hands         -- mapping from positions to the lists of the cards held
+                         by the players
+        """
+        self._opener = positions.asPosition(opener)
+        self._vulnerability = {
+            positions.asPartnership(partnership): vulnerable
+            for (partnership, vulnerable) in vulnerability.items()
+        }
+        self._hands = {
+            positions.asPosition(position):
+            sorted((deck.asCard(card) for card in hand), key=_CARD_ORDER.get)
+            for (position, hand) in hands.items()
+        }
+        if (sorted(itertools.chain.from_iterable(self._hands.values()),
+                   key=_CARD_ORDER.get) != list(_ALL_CARDS) or
+                any(len(self._hands.get(position, ())) != N_CARDS_IN_HAND
+                    for position in positions.Position)):
+            raise ValueError("The hands must divide the deck between players")
+        self._position_in_turn = self._opener
+        self._calls = []
+        self._declarer = None
+        self._contract = None
+        self._bidding_ended = False
+        self._tricks = []
+        self._dummy_revealed = False
+        self._result = None
+
+    def opener(self):
+        """Return the position making the first call"""
+        return self._opener
+
+    def vulnerability(self):
+        """Return the vulnerabilities of the partnerships"""
+        return dict(self._vulnerability)
+
+    def hands(self):
+        """Return mapping from positions to the cards not yet played"""
+        return { position: list(hand) for (position, hand) in self._hands.items() }
+
+    def positionInTurn(self):
+        """Return the position in turn, or None if the deal has ended"""
+        return self._position_in_turn
+
+    def calls(self):
+        """Return the calls as list of (position, call) pairs"""
+        return list(self._calls)
+
+    def declarer(self):
+        """Return the declarer, or None if not determined"""
+        return self._declarer
+
+    def dummy(self):
+        """Return the dummy, or None if not determined"""
+        return (
+            positions.partner(self._declarer) if self._declarer is not None
+            else None)
+
+    def contract(self):
+        """Return the contract as (bid, doubling) pair, or None"""
+        return self._contract
+
+    def isDummyRevealed(self):
+        """Return True if the cards of the dummy are visible to everyone"""
+        return self._dummy_revealed
+
+    def tricks(self):
+        """Return the tricks as list of (cards, winner) pairs
+
+        The cards of a trick are a list of (position, card) pairs, and the
+        winner is None for the trick in progress.
+        """
+        return [(list(cards), winner) for (cards, winner) in self._tricks]
+
+    def isOver(self):
+        """Return True if the deal has ended"""
+        return self._result is not None
+
+    def result(self):
+        """Return the result as (partnership, score) pair, or None
+
+        The partnership is None if the deal was passed out.
+        """
+        return self._result
+
+    def allowedCalls(self):
+        """Return the calls the position in turn is allowed to make"""
+        if self._bidding_ended:
+            return []
+        allowed = [calls.makePass()]
+        last_bid = None
+        last_call = None
+        for (position, call) in self._calls:
+            if call.type != calls.PASS_TAG:
+                last_call = (position, call)
+            if call.type == calls.BID_TAG:
+                last_bid = call.bid
+        if last_call is not None:
+            position, call = last_call
+            by_opponent = (
+                positions.partnershipFor(position) !=
+                positions.partnershipFor(self._position_in_turn))
+            if by_opponent and call.type == calls.BID_TAG:
+                allowed.append(calls.makeDouble())
+            elif by_opponent and call.type == calls.DOUBLE_TAG:
+                allowed.append(calls.makeRedouble())
+        first_bid = _BID_ORDER[last_bid] + 1 if last_bid is not None else 0
+        allowed.extend(
+            calls.makeBid(bid.level, bid.strain) for bid in _BIDS[first_bid:])
+        return allowed
+
+    def makeCall(self, position, call):
+        """Make call
+
+        Returns True if the call ended the bidding, and False otherwise.
+
+        Keyword Arguments:
+        position -- the position making the call
+        call     -- the call
+        """
+        position = positions.asPosition(position)
+        call = calls.asCall(call)
+        if position != self._position_in_turn or call not in self.allowedCalls():
+            raise messaging.ProtocolError(
+                "Call not allowed: %r by %r" % (call, position))
+        self._calls.append((position, call))
+        self._position_in_turn = _next_position(position)
+        passes = list(itertools.takewhile(
+            lambda pair: pair[1].type == calls.PASS_TAG, reversed(self._calls)))
+        if len(passes) == len(self._calls) == len(positions.Position):
+            self._bidding_ended = True
+            self._position_in_turn = None
+            self._result = (None, 0)
+        elif len(passes) == len(positions.Position) - 1 and len(self._calls) > 3:
+            self._bidding_ended = True
+            self._determine_contract()
+        return self._bidding_ended
+
+    def allowedCards(self):
+        """Return the cards the position in turn is allowed to play"""
+        if not self._bidding_ended or self._position_in_turn is None:
+            return []
+        hand = self._hands[self._position_in_turn]
+        trick = self._current_trick()
+        if trick:
+            _, lead = trick[0]
+            following = [card for card in hand if card.suit == lead.suit]
+            if following:
+                return following
+        return list(hand)
+
+    def playCard(self, position, card):
+        """Play card
+
+        Returns the winner if the card completed a trick, and None otherwise.
+
+        Keyword Arguments:
+        position -- the position playing the card
+        card     -- the card
+        """
+        position = positions.asPosition(position)
+        card = deck.asCard(card)
+        if position != self._position_in_turn or card not in self.allowedCards():
+            raise messaging.ProtocolError(
+                "Card not allowed: %r by %r" % (card, position))
+        self._hands[position].remove(card)
+        if not self._tricks or self._tricks[-1][1] is not None:
+            self._tricks.append(([], None))
+        trick, _ = self._tricks[-1]
+        trick.append((position, card))
+        self._dummy_revealed = True
+        if len(trick) < _TRICK_SIZE:
+            self._position_in_turn = _next_position(position)
+            return None
+        winner = self._trick_winner(trick)
+        self._tricks[-1] = (trick, winner)
+        if len(self._tricks) == N_CARDS_IN_HAND:
+            self._position_in_turn = None
+            self._result = self._score()
+        else:
+            self._position_in_turn = winner
+        return winner
+
+    def _current_trick(self):
+        if self._tricks and self._tricks[-1][1] is None:
+            return self._tricks[-1][0]
+        return []
+
+    def _determine_contract(self):
+        last_bid_index, (last_bidder, last_call) = next(
+            (n, pair) for (n, pair) in reversed(list(enumerate(self._calls)))
+            if pair[1].type == calls.BID_TAG)
+        bid = last_call.bid
+        partnership = positions.partnershipFor(last_bidder)
+        self._declarer = next(
+            position for (position, call) in self._calls
+            if call.type == calls.BID_TAG and call.bid.strain == bid.strain and
+            positions.partnershipFor(position) == partnership)
+        doubling = calls.UNDOUBLED_TAG
+        for (_, call) in self._calls[last_bid_index + 1:]:
+            if call.type == calls.DOUBLE_TAG:
+                doubling = calls.DOUBLED_TAG
+            elif call.type == calls.REDOUBLE_TAG:
+                doubling = calls.REDOUBLED_TAG
+        self._contract = (bid, doubling)
+        self._position_in_turn = _next_position(self._declarer)
+
+    def _trick_winner(self, trick):
+        bid, _ = self._contract
+        _, lead = trick[0]
+        def _strength(pair):
+            _, card = pair
+            rank = deck.RANK_TAGS.index(card.rank)
+            if card.suit == bid.strain:
+                return 2 * len(deck.RANK_TAGS) + rank
+            if card.suit == lead.suit:
+                return len(deck.RANK_TAGS) + rank
+            return rank
+        position, _ = max(trick, key=_strength)
+        return position
+
+    def _score(self):
+        bid, doubling = self._contract
+        partnership = positions.partnershipFor(self._declarer)
+        tricks_won = sum(
+            1 for (_, winner) in self._tricks
+            if positions.partnershipFor(winner) == partnership)
+        score = _duplicate_score(
+            bid, doubling, self._vulnerability[partnership],
+            tricks_won - _TRICKS_IN_BOOK - bid.level)
+        if score < 0:
+            opponents = next(
+                other for other in positions.Partnership if other != partnership)
+            return (opponents, -score)
+        return (partnership, score)
+
+
+class Game:
+    """Game played by four players
+
+    The game seats the players and starts a new deal whenever the previous one
+    has ended and all positions are occupied. The changes are published as
+    events (see bridge protocol specification). ProtocolError is raised if a
+    command is not allowed.
+    """
+
+    def __init__(self, gameUuid, publish, hands):
+        """Initialize game
+
+        Keyword Arguments:
+        gameUuid -- the UUID of the game
+        publish  -- function publishing an event, called with the game, the
+                    event, and the arguments of the event
+        hands    -- iterator yielding the hands of successive deals (see Deal)
+        """
+        self._game_uuid = gameUuid
+        self._publish = publish
+        self._hands = hands
+        self._players = {}
+        self._deal = None
+        self._deal_counter = 0
+        self._counter = 0
+
+    def gameUuid(self):
+        """Return the UUID of the game"""
+        return self._game_uuid
+
+    def players(self):
+        """Return mapping from the UUIDs of the players to their positions"""
+        return dict(self._players)
+
+    def deal(self):
+        """Return the current Deal, or None if the game has not started"""
+        return self._deal
+
+    def counter(self):
+        """Return the counter of the next event
+
+        The events are numbered from zero, so the counter is also the number
+        of the sequenced events published so far.
+        """
+        return self._counter
+
+    def join(self, player, position=None):
+        """Seat the player and return the position
+
+        A player already seated keeps the position. Otherwise the preferred
+        position is given if it is free, and the first free position if not.
+        """
+        if player in self._players:
+            return self._players[player]
+        taken = set(self._players.values())
+        if position is not None:
+            position = positions.asPosition(position)
+            if position in taken:
+                raise messaging.ProtocolError(
+                    "Position already taken: %r" % position)
+        else:
+            position = next(
+                (position for position in positions.Position
+                 if position not in taken), None)
+            if position is None:
+                raise messaging.ProtocolError("Game is full")
+        self._players[player] = position
+        self._publish(
+            self, PLAYER_COMMAND, _sequenced=False, player=player,
+            position=_serialize_position(position))
+        if len(self._players) == len(positions.Position):
+            self._start_deal()
+        return position
+
+    def get(self, player, keys=None):
+        """Return the state visible to the player
+
+        Keyword Arguments:
+        player -- the UUID of the player
+        keys   -- the tags of the parts of the state (default: all)
+        """
+        keys = _STATE_TAGS if keys is None else keys
+        position = self._players.get(player)
+        state = {}
+        if PUBSTATE_TAG in keys:
+            state[PUBSTATE_TAG] = self._get_pubstate()
+        if PRIVSTATE_TAG in keys:
+            state[PRIVSTATE_TAG] = self._get_privstate(position)
+        if SELF_TAG in keys:
+            state[SELF_TAG] = self._get_self(position)
+        return state
+
+    def call(self, player, call):
+        """Make call on behalf of the player"""
+        deal = self._deal
+        position = deal and deal.positionInTurn()
+        if position is None or self._players.get(player) != position:
+            raise messaging.ProtocolError("Not in turn: %r" % player)
+        call = calls.asCall(call)
+        bidding_ended = deal.makeCall(position, call)
+        self._publish(
+            self, CALL_COMMAND, position=_serialize_position(position),
+            call=_serialize_call(call))
+        if bidding_ended and deal.isOver():
+            self._end_deal()
+            return
+        if bidding_ended:
+            bid, doubling = deal.contract()
+            self._publish(
+                self, BIDDING_COMMAND,
+                declarer=_serialize_position(deal.declarer()),
+                contract=_serialize_contract(bid, doubling))
+        self._publish_turn()
+
+    def play(self, player, card):
+        """Play card on behalf of the player
+
+        The declarer plays the cards of the dummy.
+        """
+        deal = self._deal
+        position = deal and deal.positionInTurn()
+        if position is None or not self._controls(
+                self._players.get(player), position):
+            raise messaging.ProtocolError("Not in turn: %r" % player)
+        card = deck.asCard(card)
+        dummy_revealed = deal.isDummyRevealed()
+        winner = deal.playCard(position, card)
+        self._publish(
+            self, PLAY_COMMAND, position=_serialize_position(position),
+            card=_serialize_card(card))
+        if not dummy_revealed:
+            dummy = deal.dummy()
+            self._publish(
+                self, DUMMY_COMMAND, position=_serialize_position(dummy),
+                cards=[_serialize_card(card) for card in deal.hands()[dummy]])
+        if winner is not None:
+            self._publish(
+                self, TRICK_COMMAND, winner=_serialize_position(winner))
+        if deal.isOver():
+            self._end_deal()
+        else:
+            self._publish_turn()
+
+    def nextCounter(self):
+        """Return the counter of the next event and increment it"""
+        counter = self._counter
+        self._counter += 1
+        return counter
+
+    def _controls(self, own_position, position):
+        # The declarer also plays the cards of the dummy
+        if own_position is None:
+            return False
+        if own_position == position:
+            return position != self._deal.dummy()
+        return (
+            own_position == self._deal.declarer() and
+            position == self._deal.dummy())
+
+    def _start_deal(self):
+        opener = positions.Position(self._deal_counter % len(positions.Position))
+        vulnerability = dict(zip(
+            positions.Partnership,
+            VULNERABILITIES[self._deal_counter % len(VULNERABILITIES)]))
+        self._deal_counter += 1
+        self._deal = Deal(opener, vulnerability, next(self._hands))
+        self._publish(
+            self, DEAL_COMMAND, opener=_serialize_position(opener),
+            vulnerability=_serialize_vulnerability(vulnerability))
+        self._publish_turn()
+
+    def _end_deal(self):
+        partnership, score = self._deal.result()
+        self._publish(
+            self, DEALEND_COMMAND, result={
+                PARTNERSHIP_TAG: _serialize_partnership(partnership),
+                SCORE_TAG: score,
+            })
+        self._start_deal()
+
+    def _publish_turn(self):
+        self._publish(
+            self, TURN_COMMAND,
+            position=_serialize_position(self._deal.positionInTurn()))
+
+    def _get_pubstate(self):
+        deal = self._deal
+        if deal is None:
+            return {}
+        contract = deal.contract()
+        dummy = deal.dummy() if deal.isDummyRevealed() else None
+        return {
+            POSITION_IN_TURN_TAG: _serialize_position(deal.positionInTurn()),
+            CALLS_TAG: [
+                { POSITION_TAG: _serialize_position(position),
+                  CALL_TAG: _serialize_call(call) }
+                for (position, call) in deal.calls()
+            ],
+            DECLARER_TAG: _serialize_position(deal.declarer()),
+            CONTRACT_TAG: _serialize_contract(*contract) if contract else None,
+            CARDS_TAG: {
+                _serialize_position(position): [
+                    _serialize_card(card) if position == dummy else None
+                    for card in hand
+                ] for (position, hand) in deal.hands().items()
+            },
+            TRICKS_TAG: [
+                { CARDS_TAG: [
+                    { POSITION_TAG: _serialize_position(position),
+                      CARD_TAG: _serialize_card(card) }
+                    for (position, card) in cards
+                  ],
+                  WINNER_TAG: _serialize_position(winner) }
+                for (cards, winner) in deal.tricks()
+            ],
+            VULNERABILITY_TAG: _serialize_vulnerability(deal.vulnerability()),
+        }
+
+    def _get_privstate(self, position):
+        if self._deal is None or position is None:
+            return {}
+        return {
+            CARDS_TAG: {
+                _serialize_position(position): [
+                    _serialize_card(card)
+                    for card in self._deal.hands()[position]
+                ]
+            }
+        }
+
+    def _get_self(self, position):
+        if position is None:
+            return {}
+        deal = self._deal
+        position_in_turn = deal and deal.positionInTurn()
+        in_turn = (
+            position_in_turn is not None and
+            self._controls(position, position_in_turn))
+        return {
+            POSITION_TAG: _serialize_position(position),
+            POSITION_IN_TURN_TAG: _serialize_position(position_in_turn),
+            ALLOWED_CALLS_TAG: [
+                _serialize_call(call) for call in deal.allowedCalls()
+            ] if in_turn else [],
+            ALLOWED_CARDS_TAG: [
+                _serialize_card(card) for card in deal.allowedCards()
+            ] if in_turn else [],
+        }
+
+
+class Server:
+    """Object serving the bridge protocol
+
+    The server receives commands from a ROUTER socket and publishes the events
+    to a PUB socket. The application either calls run(), or calls
+    handleMessages() whenever the control socket becomes readable.
+    """
+
+    def __init__(
+            self, controlSocket, eventSocket, codec=None, deals=None,
+            seed=None):
+        """Initialize server
+
+        Keyword Arguments:
+        controlSocket -- the ROUTER socket receiving the commands
+        eventSocket   -- the PUB socket publishing the events
+        codec         -- the codec used to serialize messages (optional, see
+                         messaging.getCodec())
+        deals         -- list of the hands of scripted deals (see Deal). If
+                         given, each game plays the deals in order, starting
+                         again from the first one after the last. Otherwise
+                         the deals are random. (optional)
+        seed          -- the seed of the random deals (optional)
+        """
+        self._control_socket = controlSocket
+        self._event_socket = eventSocket
+        self._codec = codec or messaging.getCodec()
+        self._deals = list(deals) if deals else None
+        for hands in self._deals or ():
+            # Fail early if a scripted deal is not valid
+            Deal(positions.Position.north, {}, hands)
+        self._rng = random.Random(seed)
+        self._games = {}
+        self._running = False
+        self._handlers = {
+            HELLO_COMMAND: self._handle_hello,
+            GAME_COMMAND: self._handle_game,
+            JOIN_COMMAND: self._handle_join,
+            GET_COMMAND: self._handle_get,
+            CALL_COMMAND: self._handle_call,
+            PLAY_COMMAND: self._handle_play,
+        }
+        self._keys = {}
+
+    def games(self):
+        """Return mapping from the UUIDs of the games to the Game objects"""
+        return dict(self._games)
+
+    def createGame(self, gameUuid=None):
+        """Create game and return it
+
+        Keyword Arguments:
+        gameUuid -- the UUID of the game (default: generated)
+        """
+        game_uuid = gameUuid or str(uuid.uuid4())
+        if game_uuid in self._games:
+            raise messaging.ProtocolError("Game already exists: %r" % game_uuid)
+        if self._deals:
+            hands = itertools.cycle(self._deals)
+        else:
+            rng = random.Random(self._rng.random())
+            hands = (randomHands(rng) for _ in itertools.count())
+        game = Game(game_uuid, self._publish, hands)
+        self._games[game_uuid] = game
+        return game
+
+    def handleMessages(self):
+        """Handle the commands received from the control socket
+
+        At most MAX_MESSAGES commands are handled at once. Returns True if
+        there may be more commands to be handled.
+        """
+        for _ in range(MAX_MESSAGES):
+            try:
+                parts = self._control_socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return False
+            self._handle_message(parts)
+        return True
+
+    def run(self):
+        """Serve until stop() is called"""
+        self._running = True
+        poller = zmq.Poller()
+        poller.register(self._control_socket, zmq.POLLIN)
+        while self._running:
+            if poller.poll(int(POLL_INTERVAL * 1000)):
+                while self.handleMessages():
+                    pass
+
+    def stop(self):
+        """Stop serving
+
+        The server stops within POLL_INTERVAL. It is safe to call this method
+        from another thread.
+        """
+        self._running = False
+
+    def _handle_message(self, parts):
+        logging.debug("Received command: %r", parts)
+        if len(parts) < 4 or parts[1] != messaging.EMPTY_FRAME:
+            logging.warning("Invalid command: %r", parts)
+            return
+        identity, empty, tag, command, *args = parts
+        handler = self._handlers.get(command)
+        reply = [identity, empty, tag]
+        try:
+            if handler is None or len(args) % 2:
+                raise messaging.ProtocolError("Invalid command: %r" % command)
+            kwargs = {
+                self._decode_key(key): self._codec.decode(value)
+                for (key, value) in zip(args[::2], args[1::2])
+            }
+            reply.append(REPLY_SUCCESS)
+            for (key, value) in (handler(**kwargs) or {}).items():
+                reply.extend((key.encode(), self._codec.encode(value)))
+        except (messaging.ProtocolError, ValueError, TypeError) as e:
+            logging.info("Command %r failed: %s", command, e)
+            reply[3:] = [REPLY_FAILURE]
+        self._control_socket.send_multipart(reply)
+
+    def _decode_key(self, key):
+        decoded = self._keys.get(key)
+        if decoded is None:
+            decoded = self._keys[key] = key.decode()
+        return decoded
+
+    def _publish(self, game, command, _sequenced=True, **kwargs):
+        if _sequenced:
+            kwargs[messaging.COUNTER_TAG] = game.nextCounter()
+        parts = [game.gameUuid().encode() + b':' + command]
+        for (key, value) in kwargs.items():
+            parts.extend((key.encode(), self._codec.encode(value)))
+        logging.debug("Publishing event: %r", parts)
+        self._event_socket.send_multipart(parts)
+
+    def _get_game(self, game):
+        try:
+            return self._games[game]
+        except (KeyError, TypeError):
+            raise messaging.ProtocolError("Unknown game: %r" % game)
+
+    def _handle_hello(self, version=None, role=None, **kwargs):
+        if role != CLIENT_TAG:
+            raise messaging.ProtocolError("Unsupported role: %r" % role)
+
+    def _handle_game(self, game=None, **kwargs):
+        return { GAME_TAG: self.createGame(game).gameUuid() }
+
+    def _handle_join(self, game=None, player=None, position=None, **kwargs):
+        if not isinstance(player, str):
+            raise messaging.ProtocolError("Invalid player: %r" % player)
+        if game is None:
+            # Join any game with a free seat
+            game = next(
+                (game for game in self._games.values()
+                 if len(game.players()) < len(positions.Position)), None)
+            game = game or self.createGame()
+        else:
+            game = self._get_game(game)
+        game.join(player, position)
+        return { GAME_TAG: game.gameUuid() }
+
+    def _handle_get(self, game=None, player=None, get=None, **kwargs):
+        game = self._get_game(game)
+        return { GET_COMMAND.decode(): game.get(player, get),
+                 messaging.COUNTER_TAG: game.counter() }
+
+    def _handle_call(self, game=None, player=None, call=None, **kwargs):
+        self._get_game(game).call(player, call)
+
+    def _handle_play(self, game=None, player=None, card=None, **kwargs):
+        self._get_game(game).play(player, card)
+
+
+def _next_position(position):
+    return positions.Position((position + 1) % len(positions.Position))
+
+
+def _duplicate_score(bid, doubling, vulnerable, overtricks):
+    multiplier = calls.DOUBLING_TAGS.index(doubling)
+    if overtricks < 0:
+        undertricks = -overtricks
+        if not multiplier:
+            return -undertricks * (100 if vulnerable else 50)
+        if vulnerable:
+            penalty = 200 + 300 * (undertricks - 1)
+        else:
+            penalty = (
+                100 + 200 * min(undertricks - 1, 2) +
+                300 * max(undertricks - 3, 0))
+        return -penalty * multiplier
+    trick_value = 20 if bid.strain in (calls.CLUBS_TAG, calls.DIAMONDS_TAG) else 30
+    trick_score = trick_value * bid.level
+    if bid.strain == calls.NOTRUMP_TAG:
+        trick_score += 10
+    trick_score *= 2 ** multiplier
+    score = trick_score
+    score += (500 if vulnerable else 300) if trick_score >= 100 else 50
+    if bid.level == 6:
+        score += 750 if vulnerable else 500
+    elif bid.level == 7:
+        score += 1500 if vulnerable else 1000
+    if multiplier:
+        score += 50 * multiplier
+        score += overtricks * (200 if vulnerable else 100) * multiplier
+    else:
+        score += overtricks * trick_value
+    return score
+
+
+def _serialize_position(position):
+    return positions.POSITION_TAGS[position] if position is not None else None
+
+
+def _serialize_partnership(partnership):
+    return (
+        positions.PARTNERSHIP_TAGS[partnership] if partnership is not None
+        else None)
+
+
+def _serialize_vulnerability(vulnerability):
+    return {
+        _serialize_partnership(partnership): vulnerable
+        for (partnership, vulnerable) in vulnerability.items()
+    }
+
+
+_SERIALIZED_CARDS = { card: card._asdict() for card in _ALL_CARDS }
+
+def _serialize_card(card):
+    return _SERIALIZED_CARDS[card]
+
+
+def _serialize_bid(bid):
+    return { calls.LEVEL_TAG: bid.level, calls.STRAIN_TAG: bid.strain }
+
+
+def _serialize_call(call):
+    if call.bid is not None:
+        return { calls.TYPE_TAG: call.type, calls.BID_TAG: _serialize_bid(call.bid) }
+    return { calls.TYPE_TAG: call.type }
+
+
+def _serialize_contract(bid, doubling):
+    return { calls.BID_TAG: _serialize_bid(bid), calls.DOUBLING_TAG: doubling }
+
+
+def _load_deals(path):
+    with open(path) as f:
+        deals = json.load(f)
+    if not isinstance(deals, list):
+        raise ValueError("The deals must be a list of hands")
+    return deals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stand-in backend for bridge frontend")
+    parser.add_argument(
+        "endpoint", nargs="?", default="tcp://127.0.0.1:5555",
+        help="""Base endpoint of the server. The control socket is bound to
+             the base endpoint and the event socket to the next one. Follows
+             ZeroMQ transmit protocol syntax. For example:
+             tcp://127.0.0.1:5555.""")
+    parser.add_argument(
+        "--deals", metavar="FILE",
+        help="""JSON file containing a list of scripted deals. Each deal is
+             an object mapping the positions to the lists of the cards held by
+             the players. If omitted, the deals are random.""")
+    parser.add_argument(
+        "--seed", type=int,
+        help="""The seed of the random deals.""")
+    parser.add_argument(
+        '--codec', choices=[codec.name for codec in messaging.CODECS],
+        help="""The codec used to serialize messages. If omitted, the fastest
+             available codec is used.""")
+    parser.add_argument(
+        "--verbose", "-v", action="count", default=0,
+        help="""Increase logging levels. Repeat for even more logging.""")
+    args = parser.parse_args()
+
+    logging_level = logging.WARNING
+    if args.verbose == 1:
+        logging_level = logging.INFO
+    elif args.verbose >= 2:
+        logging_level = logging.DEBUG
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s %(message)s', level=logging_level)
+
+    try:
+        codec = messaging.getCodec(args.codec)
+    except ImportError:
+        parser.error("codec %s is not available" % args.codec)
+    try:
+        control_endpoint, event_endpoint = itertools.islice(
+            messaging.endpoints(args.endpoint), 2)
+        deals = _load_deals(args.deals) if args.deals else None
+    except (OSError, ValueError, messaging.ProtocolError) as e:
+        parser.error(str(e))
+
+    zmqctx = zmq.Context.instance()
+    control_socket = zmqctx.socket(zmq.ROUTER)
+    control_socket.bind(control_endpoint)
+    event_socket = zmqctx.socket(zmq.PUB)
+    event_socket.bind(event_endpoint)
+    try:
+        server = Server(
+            control_socket, event_socket, codec=codec, deals=deals,
+            seed=args.seed)
+    except (ValueError, messaging.ProtocolError) as e:
+        parser.error(str(e))
+    logging.info("Serving at %s and %s", control_endpoint, event_endpoint)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    zmqctx.destroy(linger=0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""Utilities for tracking the game state
+
+This module contains utilities for applying the game state received from the
+backend incrementally. The backend always replies to get commands with full
+snapshots of the requested state. The state tracker compares the snapshots to
+the state already applied, so that only the parts that have changed need to be
+applied.
+
+The parts of the state are identified by keys, and the counter included in the
+replies and events (see bridge protocol specification) tells how recent each
+part is.
+
+Functions:
+flattenState -- split the state object into keys and values
+
+Classes:
+StateTracker -- object for tracking the state applied
+"""
+
+
+def flattenState(state, tags):
+    """Split the state object into keys and values
+
+    The state is an object that maps tags to objects containing the parts of
+    the state, like the reply to the get command. This function returns a
+    dictionary mapping (tag, key) pairs to the values of the parts. Only the
+    tags given as argument are included.
+
+    Keyword Arguments:
+    state -- the state object
+    tags  -- the tags to be included
+    """
+    values = {}
+    for tag in tags:
+        for key, value in (state.get(tag) or {}).items():
+            values[(tag, key)] = value
+    return values
+
+
+class StateTracker:
+    """Object for tracking the state applied
+
+    The tracker remembers the latest value of each part of the state, and the
+    counter telling how recent it is. When a new snapshot is received, update()
+    returns the parts of the snapshot that need to be applied.
+
+    The state may also be changed by events. invalidate() marks the parts
+    changed by an event, so that the next snapshot including the event is
+    applied again. reset() forgets the whole state, so that the next snapshot
+    including the resetting event is applied in full. A snapshot includes the
+    events whose counter is less than the counter of the snapshot.
+    """
+
+    _UNKNOWN = object()
+
+    def __init__(self):
+        """Initialize state tracker"""
+        self._values = {}
+        self._reset_counter = None
+
+    def update(self, counter, values):
+        """Update the state and return the parts that have changed
+
+        The parts older than the ones already applied, and the parts whose
+        values have not changed, are left out from the returned dictionary.
+
+        Keyword Arguments:
+        counter -- the counter of the snapshot (or None if unknown)
+        values  -- mapping from keys to the values of the parts
+        """
+        changed = {}
+        if _is_older(counter, self._reset_counter):
+            return changed
+        for key, value in values.items():
+            old_counter, old_value = self._values.get(
+                key, (None, self._UNKNOWN))
+            if _is_older(counter, old_counter):
+                continue
+            self._values[key] = (
+                old_counter if counter is None else counter, value)
+            if old_value is self._UNKNOWN or old_value != value:
+                changed[key] = value
+        return changed
+
+    def value(self, key, default=None):
+        """Return the latest value of the part, or default if not known"""
+        value = self._values.get(key, (None, self._UNKNOWN))[1]
+        return default if value is self._UNKNOWN else value
+
+    def invalidate(self, counter, *keys):
+        """Mark the parts changed by an event
+
+        The value of each part is forgotten, and the parts from snapshots not
+        including the event are no longer applied.
+
+        Keyword Arguments:
+        counter -- the counter of the event (or None if unknown)
+        *keys   -- the keys of the parts changed
+        """
+        counter = _next_counter(counter)
+        for key in keys:
+            self._values[key] = (counter, self._UNKNOWN)
+
+    def reset(self, counter=None):
+        """Forget the whole state
+
+        Keyword Arguments:
+        counter -- the counter of the event resetting the state (optional)
+        """
+        self._values.clear()
+        self._reset_counter = _next_counter(counter)
+
+
+def _next_counter(counter):
+    # The first snapshot including the event has counter at least this
+    return None if counter is None else counter + 1
+
+
+def _is_older(counter, other_counter):
+    return (
+        counter is not None and other_counter is not None and
+        counter < other_counter)
@@ -8,6 +8,11 @@ import os
 import pkg_resources
 
 
+def _get_image_path(filename):
+    filename = os.path.join("images", filename)
+    return pkg_resources.resource_filename(__name__, filename)
+
+
 def getImage(filename):
     """Load image from file
 
@@ -19,6 +24,18 @@ def getImage(filename):
     filename -- the filename of the image file
     """
     from PyQt5.QtGui import QImage
-    filename = os.path.join("images", filename)
-    path = pkg_resources.resource_filename(__name__, filename)
-    return QImage(path)
+    return QImage(_get_image_path(filename))
+
+
+def getImageSize(filename):
+    """Read the size of an image without loading it
+
+    This function only reads the metadata in the header of the image file, so
+    it is cheap compared to getImage(). The return value is a QSize object. The
+    filename argument is prepended with the path to image directory.
+
+    Keyword Arguments:
+    filename -- the filename of the image file
+    """
+    from PyQt5.QtGui import QImageReader
+    return QImageReader(_get_image_path(filename)).size()
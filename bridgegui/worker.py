@@ -0,0 +1,213 @@
+"""Message worker for bridge frontend
+
+This module contains the worker that receives the messages from the backend in
+a separate thread. The worker owns the sockets, and decodes and validates the
+messages using the decodeMessage() method of the message queue of each socket.
+The decoded messages are delivered to the thread of the worker object (usually
+the GUI thread) with a queued signal, and dispatched to their handlers there.
+
+The sockets must not be used by other threads once they have been added to the
+worker. Sending messages, connecting, subscribing etc. are done through
+SocketProxy objects that perform the operations in the worker thread.
+
+Classes:
+SocketProxy   -- proxy for performing socket operations in the worker thread
+MessageWorker -- object receiving and decoding messages in a worker thread
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import logging
+import threading
+
+from PyQt5.QtCore import pyqtSignal, QObject
+import zmq
+
+import bridgegui.messaging as messaging
+
+_worker_counter = itertools.count()
+
+
+class SocketProxy:
+    """Proxy for performing socket operations in the worker thread
+
+    The proxy implements the part of the socket interface used by the frontend
+    for sending messages and managing connections. The operations are queued
+    to the worker thread, and errors are logged there. The proxy has no
+    incoming messages of its own, because the worker receives them.
+    """
+
+    events = 0
+
+    def __init__(self, worker, socket):
+        """Initialize socket proxy
+
+        Keyword Arguments:
+        worker -- the MessageWorker owning the socket
+        socket -- the socket
+        """
+        self._worker = worker
+        self._socket = socket
+
+    def send_multipart(self, parts, flags=0):
+        """Send message in the worker thread"""
+        parts = list(parts)
+        self._worker.call(lambda: self._socket.send_multipart(parts, flags))
+
+    def connect(self, endpoint):
+        """Connect the socket in the worker thread"""
+        self._worker.call(lambda: self._socket.connect(endpoint))
+
+    def disconnect(self, endpoint):
+        """Disconnect the socket in the worker thread"""
+        self._worker.call(lambda: self._socket.disconnect(endpoint))
+
+    def setsockopt(self, option, value):
+        """Set socket option in the worker thread"""
+        self._worker.call(lambda: self._socket.setsockopt(option, value))
+
+    def get_monitor_socket(self, events=None):
+        """Create monitor socket in the worker thread and return it
+
+        The monitor socket is not owned by the worker, so it can be used by
+        the calling thread. Blocks until the worker thread has created it.
+        """
+        future = concurrent.futures.Future()
+        def _get_monitor_socket():
+            try:
+                future.set_result(self._socket.get_monitor_socket(events))
+            except zmq.ZMQError as e:
+                future.set_exception(e)
+        self._worker.call(_get_monitor_socket)
+        return future.result()
+
+
+class MessageWorker(QObject):
+    """Object receiving and decoding messages in a worker thread
+
+    The worker receives the messages from the sockets added to it, decodes
+    them with the message queue of the socket, and emits messagesDecoded with
+    the queue and the list of decoded messages. The signal is delivered to the
+    thread of the worker object, where the messages can be dispatched with the
+    dispatchMessages() method of the queue.
+    """
+
+    messagesDecoded = pyqtSignal(object, list)
+
+    def __init__(self, parent=None, context=None, maxMessages=64):
+        """Initialize message worker
+
+        Keyword Arguments:
+        parent      -- the parent object
+        context     -- the ZeroMQ context (default: the global instance)
+        maxMessages -- the maximum number of messages delivered at once
+        """
+        super().__init__(parent)
+        context = context or zmq.Context.instance()
+        endpoint = "inproc://bridgegui-worker-%d" % next(_worker_counter)
+        self._wakeup_receiver = context.socket(zmq.PAIR)
+        self._wakeup_receiver.bind(endpoint)
+        self._wakeup_sender = context.socket(zmq.PAIR)
+        self._wakeup_sender.connect(endpoint)
+        self._max_messages = maxMessages
+        self._calls = collections.deque()
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._poller = zmq.Poller()
+        self._poller.register(self._wakeup_receiver, zmq.POLLIN)
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="bridgegui-worker", daemon=True)
+
+    def start(self):
+        """Start the worker thread"""
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread and wait until it has finished
+
+        The sockets added to the worker are closed by the worker thread.
+        """
+        def _stop():
+            self._running = False
+        self.call(_stop)
+        self._thread.join()
+        self._wakeup_sender.close()
+
+    def createProxy(self, socket):
+        """Hand the socket over to the worker and return SocketProxy for it
+
+        After calling this method, the socket must only be accessed through the
+        proxy.
+        """
+        return SocketProxy(self, socket)
+
+    def addQueue(self, proxy, queue):
+        """Receive messages from the socket and decode them with the queue
+
+        Keyword Arguments:
+        proxy -- the SocketProxy of the socket
+        queue -- the message queue used to decode the messages
+        """
+        socket = proxy._socket
+        def _add_queue():
+            self._queues[socket] = queue
+            self._poller.register(socket, zmq.POLLIN)
+        self.call(_add_queue)
+
+    def call(self, function):
+        """Call function in the worker thread
+
+        The calls are made in the order this method is called.
+        """
+        with self._lock:
+            self._calls.append(function)
+            self._wakeup_sender.send(b'')
+
+    def _run(self):
+        try:
+            while self._running:
+                for socket, _ in self._poller.poll():
+                    if socket is self._wakeup_receiver:
+                        self._run_calls()
+                    else:
+                        self._receive_messages(socket)
+        except zmq.ContextTerminated: # It's okay as we're about to exit
+            return
+        for socket in self._queues:
+            socket.close(linger=0)
+        self._wakeup_receiver.close()
+
+    def _run_calls(self):
+        while self._wakeup_receiver.poll(0):
+            self._wakeup_receiver.recv()
+        while self._calls:
+            function = self._calls.popleft()
+            try:
+                function()
+            except zmq.ZMQError as e:
+                logging.error(
+                    "Error %d in message worker: %s", e.errno, str(e))
+
+    def _receive_messages(self, socket):
+        queue = self._queues[socket]
+        messages = []
+        while (len(messages) < self._max_messages and
+               socket.poll(0, zmq.POLLIN)):
+            parts = socket.recv_multipart()
+            logging.debug("Received message: %r", parts)
+            messaging.recordReceived(queue.name(), parts)
+            try:
+                messages.append(queue.decodeMessage(parts))
+            except messaging.ProtocolError as e:
+                messages.append(e)
+            except Exception as e:
+                # Any error is reported with the message, so that the worker
+                # thread keeps receiving the later ones
+                logging.exception("Unable to decode message: %r", parts)
+                messages.append(
+                    messaging.ProtocolError(
+                        "Unable to decode message: %s" % str(e)))
+        if messages:
+            self.messagesDecoded.emit(queue, messages)
@@ -6,7 +6,13 @@ setup(
     url="https://github.com/jasujm/bridgegui",
     packages=["bridgegui"],
     entry_points={
-        "gui_scripts": ["bridgegui=bridgegui.__main__:main"]
+        "gui_scripts": ["bridgegui=bridgegui.__main__:main"],
+        "console_scripts": [
+            "bridgegui-loadgen=bridgegui.loadgen:main",
+            "bridgegui-server=bridgegui.server:main",
+            "bridgegui-proxy=bridgegui.proxy:main",
+            "bridgegui-replay=bridgegui.recording:main",
+        ],
     },
     package_data={
         "bridgegui": ["images/*.png"]
@@ -89,6 +89,11 @@ class CallTableTest(unittest.TestCase):
         with self.assertRaises(messaging.ProtocolError):
             self._call_table.addCall(position, 'invalid')
 
+    def testAddCallInvalidType(self):
+        position = random.choice(POSITION_TAGS)
+        with self.assertRaises(messaging.ProtocolError):
+            self._call_table.addCall(position, { "type": "invalid" })
+
     def testAddSingleCall(self):
         rows = 0,
         ns = random.randrange(len(positions.Position)),
@@ -2,7 +2,8 @@ import unittest
 import sys
 import random
 
-from PyQt5.QtCore import QPointF, Qt
+from PyQt5.QtCore import QEvent, QPointF, QRectF, QSize, QSizeF, Qt
+from PyQt5.QtGui import QImage, QMouseEvent, QPainter
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtTest import QSignalSpy, QTest
 
@@ -20,6 +21,91 @@ def _generate_random_card():
     return cards.Card(random.choice(RANK_TAGS), random.choice(SUIT_TAGS))
 
 
+class CardImageCacheTest(unittest.TestCase):
+    """Test suite for card image cache"""
+
+    @classmethod
+    def setUpClass(cls):
+        random.seed(str(cls))
+
+    def setUp(self):
+        self._app = QApplication(sys.argv)
+        self._cache = cards.CardImageCache(maxSize=4)
+
+    def tearDown(self):
+        del self._app
+
+    def testImagesAreNotLoadedInitially(self):
+        self.assertEqual(self._cache.loadedCards(), [])
+
+    def testImage(self):
+        card = _generate_random_card()
+        image = self._cache.image(card)
+        self.assertFalse(image.isNull())
+        self.assertIs(self._cache.image(card), image)
+        self.assertEqual(self._cache.loadedCards(), [card])
+
+    def testBackImage(self):
+        self.assertFalse(self._cache.image(None).isNull())
+
+    def testLeastRecentlyUsedImageIsDiscarded(self):
+        card, *other_cards = _generate_random_cards() + [None]
+        self._cache.image(card)
+        for other_card in other_cards:
+            self._cache.image(other_card)
+        self.assertNotIn(card, self._cache.loadedCards())
+        self.assertEqual(self._cache.loadedCards(), other_cards)
+
+    def testWarmUp(self):
+        self._cache.warmUp()
+        while len(self._cache.loadedCards()) < 4:
+            self._app.processEvents()
+        self._app.processEvents()
+        self.assertEqual(len(self._cache.loadedCards()), 4)
+
+
+class CardAtlasTest(unittest.TestCase):
+    """Test suite for card atlas"""
+
+    @classmethod
+    def setUpClass(cls):
+        random.seed(str(cls))
+
+    def setUp(self):
+        self._app = QApplication(sys.argv)
+        self._atlas = cards.CardAtlas()
+
+    def tearDown(self):
+        del self._app
+
+    def testSourceRectsAreDistinct(self):
+        card, other_card = _generate_random_cards()[:2]
+        self.assertNotEqual(
+            self._atlas.sourceRect(card), self._atlas.sourceRect(other_card))
+        self.assertTrue(
+            self._atlas.pixmap().rect().contains(
+                self._atlas.sourceRect(None).toRect()))
+
+    def testDrawCards(self):
+        card = _generate_random_card()
+        size = self._atlas.sourceRect(card).size().toSize()
+        rect = QRectF(QPointF(0, 0), QSizeF(size - QSize(1, 1)))
+        def draw_with_images(painter):
+            painter.drawImage(rect, cards.CARD_IMAGES.image(card))
+            painter.drawRect(rect)
+        def draw_with_atlas(painter):
+            self._atlas.drawCards(painter, [(card, rect, 1)])
+        images = []
+        for draw in (draw_with_images, draw_with_atlas):
+            image = QImage(size, QImage.Format_ARGB32_Premultiplied)
+            image.fill(Qt.transparent)
+            painter = QPainter(image)
+            draw(painter)
+            painter.end()
+            images.append(image)
+        self.assertEqual(images[0], images[1])
+
+
 class HandPanelTest(unittest.TestCase):
     """Test suite for hand panel"""
 
@@ -53,6 +139,17 @@ class HandPanelTest(unittest.TestCase):
         self._click_card_helper(card)
         self.assertEqual(spy[0][0], card)
 
+    def testPlayTopmostAllowedCard(self):
+        spy = QSignalSpy(self._hand_panel.cardPlayed)
+        self._hand_panel.setCards(self._cards)
+        (card, rect), (next_card, next_rect) = self._hand_panel.cards()[:2]
+        self._hand_panel.setAllowedCards((card, next_card))
+        point = (next_rect.topLeft() + QPointF(1, 1)).toPoint()
+        self.assertTrue(rect.contains(QPointF(point)))
+        QTest.mouseMove(self._hand_panel, point)
+        QTest.mouseClick(self._hand_panel, Qt.LeftButton, Qt.NoModifier, point)
+        self.assertEqual(spy[0][0], next_card)
+
     def testPlayNotAllowedCard(self):
         spy = QSignalSpy(self._hand_panel.cardPlayed)
         self._hand_panel.setCards(self._cards)
@@ -84,6 +181,29 @@ class HandPanelTest(unittest.TestCase):
         remaining_cards = [card for (card, _) in self._hand_panel.cards()]
         self.assertEqual(remaining_cards, [None, None])
 
+    def testPaintedHandIsUpdatedWhenCardsChange(self):
+        self._hand_panel.setCards(self._cards)
+        image = self._hand_panel.grab().toImage()
+        self._hand_panel.playCard(random.choice(self._cards))
+        self.assertNotEqual(self._hand_panel.grab().toImage(), image)
+        self._hand_panel.setCards(self._cards)
+        self.assertEqual(self._hand_panel.grab().toImage(), image)
+
+    def testSelectionIsClearedWhenCardsChange(self):
+        self._hand_panel.setCards(self._cards)
+        card, rect = self._hand_panel.cards()[-1]
+        self._hand_panel.setAllowedCards((card,))
+        point = rect.bottomRight() - QPointF(1, 1)
+        QApplication.sendEvent(
+            self._hand_panel,
+            QMouseEvent(
+                QEvent.MouseMove, point, Qt.NoButton, Qt.NoButton,
+                Qt.NoModifier))
+        self._hand_panel.setCards(self._cards[:1])
+        image = self._hand_panel.grab().toImage()
+        self._hand_panel.setCards(self._cards[:1])
+        self.assertEqual(self._hand_panel.grab().toImage(), image)
+
     def _click_card_helper(self, card):
         rects = dict(self._hand_panel.cards())
         point = (rects[card].topLeft() + QPointF(1, 1)).toPoint()
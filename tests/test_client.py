@@ -0,0 +1,276 @@
+import json
+import time
+import unittest
+
+import zmq
+
+from bridgegui.calls import makeBid
+from bridgegui.client import (
+    FAILOVER_TIMEOUT, GameClient, GameObserver, GameState)
+from bridgegui.deck import Card
+from bridgegui.positions import Partnership, Position
+
+CONTROL_ENDPOINT = 'inproc://testing-control'
+EVENT_ENDPOINT = 'inproc://testing-event'
+GAME = "game"
+TIMEOUT = 5
+
+
+class _RecordingObserver(GameObserver):
+
+    def __init__(self):
+        self.sockets = []
+        self.notifications = []
+
+    def messageQueueAdded(self, socket, queue):
+        self.sockets.append(socket)
+
+    def positionChanged(self, position):
+        self.notifications.append(("position", position))
+
+    def cardsChanged(self, cards):
+        self.notifications.append(("cards", cards))
+
+    def cardPlayed(self, position, card):
+        self.notifications.append(("play", position, card))
+
+    def trickCompleted(self, winner):
+        self.notifications.append(("trick", winner))
+
+    def connectionStateChanged(self, connected):
+        self.notifications.append(("connected", connected))
+
+
+class GameStateTest(unittest.TestCase):
+    """Unit test suite for game state"""
+
+    def setUp(self):
+        self._observer = _RecordingObserver()
+        self._state = GameState(self._observer)
+
+    def testSetCards(self):
+        card = Card("2", "clubs")
+        self._state.setCards({ "north": [card], "other": [] })
+        self.assertEqual(self._state.cards(), { Position.north: [card] })
+        self.assertEqual(
+            self._observer.notifications,
+            [("cards", { Position.north: [card] })])
+
+    def testPlayCard(self):
+        card = Card("2", "clubs")
+        self._state.setCards({ "north": [card], "east": [None, None] })
+        self._state.playCard(Position.north, card)
+        self._state.playCard(Position.east, Card("3", "clubs"))
+        self.assertEqual(
+            self._state.cards(), { Position.north: [], Position.east: [None] })
+        self.assertEqual(
+            [play["card"] for play in self._state.trick()],
+            [card, Card("3", "clubs")])
+
+    def testNewTrickStartsAfterFullTrick(self):
+        for position in Position:
+            self._state.playCard(position, Card("2", "clubs"))
+        self._state.playCard(Position.north, Card("3", "clubs"))
+        self.assertEqual(
+            self._state.trick(),
+            [{ "position": Position.north, "card": Card("3", "clubs") }])
+
+    def testAddTrick(self):
+        self._state.addTrick(Position.east)
+        self.assertEqual(
+            self._state.tricksWon(),
+            { Partnership.northSouth: 0, Partnership.eastWest: 1 })
+        self.assertEqual(
+            self._observer.notifications, [("trick", Position.east)])
+
+
+class GameClientTest(unittest.TestCase):
+    """Unit test suite for game client"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._backend = self._zmqctx.socket(zmq.ROUTER)
+        self._backend.bind(CONTROL_ENDPOINT)
+        self._publisher = self._zmqctx.socket(zmq.PUB)
+        self._publisher.bind(EVENT_ENDPOINT)
+        self._observer = _RecordingObserver()
+        self._client = self._create_client(gameUuid=GAME)
+        self._commands = []
+        self._failing_commands = set()
+        self._dropped_commands = set()
+        self._game_reply = GAME
+
+    def tearDown(self):
+        self._zmqctx.destroy(linger=0)
+
+    def testJoinGame(self):
+        self._client.start()
+        self._run_until(lambda: len(self._observer.sockets) == 3)
+        self.assertEqual(
+            self._commands, [b'bridgehlo', b'join', b'get'])
+        self.assertEqual(self._client.state().position(), "south")
+        self.assertEqual(
+            self._client.state().cards(),
+            { Position.north: [Card("2", "clubs")] })
+
+    def testEvents(self):
+        self._client.start()
+        self._run_until(lambda: len(self._observer.sockets) == 3)
+        # Events published before the subscription has reached the publisher
+        # would be lost
+        time.sleep(0.1)
+        self._publisher.send_multipart([
+            b'game:play', b'position', b'"north"',
+            b'card', b'{"rank":"2","suit":"clubs"}', b'counter', b'1'])
+        self._run_until(lambda: ("play", Position.north, Card("2", "clubs"))
+                        in self._observer.notifications)
+        self.assertEqual(self._client.state().cards(), { Position.north: [] })
+
+    def testCall(self):
+        self._client.start()
+        self._run_until(lambda: len(self._observer.sockets) == 3)
+        future = self._client.call(makeBid(1, "clubs"))
+        self._run_until(future.done)
+        self.assertEqual(self._commands[-1], b'call')
+        self.assertIsNone(self._client.nextDeadline())
+
+    def testFailedHello(self):
+        self._failing_commands.add(b'bridgehlo')
+        self._assert_handshake_failed([b'bridgehlo', b'join', b'get'])
+
+    def testFailedGame(self):
+        self._client = self._create_client(gameUuid=GAME, createGame=True)
+        self._failing_commands.add(b'game')
+        self._assert_handshake_failed(
+            [b'bridgehlo', b'game', b'join', b'get'])
+
+    def testFailedJoin(self):
+        self._failing_commands.add(b'join')
+        self._assert_handshake_failed([b'bridgehlo', b'join', b'get'])
+
+    def testUnexpectedGameCreated(self):
+        self._client = self._create_client(gameUuid=GAME, createGame=True)
+        self._game_reply = "other"
+        self._assert_handshake_failed(
+            [b'bridgehlo', b'game', b'join', b'get'])
+
+    def testUnexpectedGameJoined(self):
+        self._game_reply = "other"
+        self._assert_handshake_failed([b'bridgehlo', b'join', b'get'])
+
+    def testResumeBeforeInitialState(self):
+        endpoint = self._rebind_backend('tcp://127.0.0.1:*')
+        self._client = self._create_client(
+            gameUuid=GAME, pipelinedStartup=False, controlEndpoint=endpoint)
+        self._dropped_commands.add(b'get')
+        self._client.start()
+        self._run_until(lambda: b'get' in self._commands)
+        # The connection is lost before the reply to the initial get command
+        self._dropped_commands.clear()
+        self._commands.clear()
+        self._rebind_backend(endpoint)
+        self._run_until(lambda: len(self._observer.sockets) == 3)
+        self.assertEqual(self._commands, [b'bridgehlo', b'join', b'get'])
+        self.assertEqual(self._client.state().position(), "south")
+
+    def testFailOverAfterJoining(self):
+        endpoint = self._rebind_backend('tcp://127.0.0.1:*')
+        other_backend = self._zmqctx.socket(zmq.ROUTER)
+        other_backend.bind('tcp://127.0.0.1:*')
+        other_endpoint = other_backend.getsockopt_string(zmq.LAST_ENDPOINT)
+        self._client = self._create_client(
+            gameUuid=GAME, createGame=True,
+            endpoints=[
+                (endpoint, EVENT_ENDPOINT), (other_endpoint, EVENT_ENDPOINT)])
+        self._client.start()
+        self._run_until(lambda: len(self._observer.sockets) == 3)
+        self._backend.close(linger=0)
+        self._backend = other_backend
+        self._commands.clear()
+        self._run_until(
+            lambda: ("connected", False) in self._observer.notifications)
+        # The game created by the client is created again on the other backend
+        self._client.handleTimeouts(time.monotonic() + FAILOVER_TIMEOUT)
+        self._run_until(
+            lambda: len(self._commands) == 4 and
+            self._client.nextDeadline() is None)
+        self.assertEqual(
+            self._commands, [b'bridgehlo', b'game', b'join', b'get'])
+        self.assertEqual(self._client.state().position(), "south")
+
+    def _rebind_backend(self, endpoint):
+        self._backend.close(linger=0)
+        self._backend = self._zmqctx.socket(zmq.ROUTER)
+        # The port is released asynchronously after closing the socket
+        deadline = time.monotonic() + TIMEOUT
+        while True:
+            try:
+                self._backend.bind(endpoint)
+                break
+            except zmq.ZMQError:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        return self._backend.getsockopt_string(zmq.LAST_ENDPOINT)
+
+    def _create_client(self, controlEndpoint=CONTROL_ENDPOINT, **kwargs):
+        control_socket = self._zmqctx.socket(zmq.DEALER)
+        event_socket = self._zmqctx.socket(zmq.SUB)
+        if "endpoints" not in kwargs:
+            control_socket.connect(controlEndpoint)
+            event_socket.connect(EVENT_ENDPOINT)
+        kwargs.setdefault("pipelinedStartup", True)
+        return GameClient(
+            control_socket, event_socket, observer=self._observer, **kwargs)
+
+    def _assert_handshake_failed(self, commands):
+        # The whole handshake is sent at once, but the replies to the commands
+        # after the failed one are not applied
+        self._client.start()
+        success = self._run_until(
+            lambda: len(self._commands) == len(commands) and
+            self._client.nextDeadline() is None, check=False)
+        self.assertFalse(success)
+        self.assertEqual(self._commands, commands)
+        self.assertIsNone(self._client.state().position())
+        self.assertEqual(self._client.state().cards(), {})
+        # Only the control socket and its monitor are handled
+        self.assertEqual(len(self._observer.sockets), 2)
+
+    def _run_until(self, condition, check=True):
+        # Returns False if handling any message or timeout failed
+        deadline = time.monotonic() + TIMEOUT
+        ret = True
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            self._serve()
+            success = self._client.handleMessages()
+            success = self._client.handleTimeouts() and success
+            if check:
+                self.assertTrue(success)
+            ret = ret and success
+            time.sleep(0.001)
+        return ret
+
+    def _serve(self):
+        while self._backend.poll(0):
+            identity, empty, tag, command, *args = (
+                self._backend.recv_multipart())
+            self._commands.append(command)
+            if command in self._dropped_commands:
+                continue
+            if command in self._failing_commands:
+                self._backend.send_multipart([identity, empty, tag, b'ERR'])
+                continue
+            reply = []
+            if command in (b'game', b'join'):
+                reply = [b'game', json.dumps(self._game_reply).encode()]
+            elif command == b'get':
+                state = {
+                    "self": { "position": "south" },
+                    "pubstate": {
+                        "cards": { "north": [{ "rank": "2", "suit": "clubs" }] },
+                    },
+                }
+                reply = [b'get', json.dumps(state).encode(), b'counter', b'1']
+            self._backend.send_multipart(
+                [identity, empty, tag, b'OK'] + reply)
@@ -0,0 +1,98 @@
+import io
+import json
+import threading
+import unittest
+
+import zmq
+
+from bridgegui.loadgen import (
+    CALL_TAG, JOIN_TAG, LoadGenerator, Statistics, percentile)
+
+CONTROL_ENDPOINT = 'inproc://testing-loadgen'
+EVENT_ENDPOINT = 'inproc://testing-loadgen-1'
+
+
+class PercentileTest(unittest.TestCase):
+    """Unit test suite for percentile"""
+
+    def testEmpty(self):
+        self.assertIsNone(percentile([], 0.5))
+
+    def testNearestRank(self):
+        values = list(range(1, 11))
+        self.assertEqual(percentile(values, 0.5), 5)
+        self.assertEqual(percentile(values, 0.9), 9)
+        self.assertEqual(percentile(values, 0.99), 10)
+        self.assertEqual(percentile(values, 1), 10)
+        self.assertEqual(percentile(values, 0), 1)
+
+
+class StatisticsTest(unittest.TestCase):
+    """Unit test suite for statistics"""
+
+    def testReport(self):
+        statistics = Statistics()
+        statistics.addLatency(CALL_TAG, 0.002)
+        statistics.addLatency(CALL_TAG, 0.001)
+        statistics.addFailure(CALL_TAG)
+        self.assertEqual(statistics.latencies(CALL_TAG), [0.001, 0.002])
+        self.assertEqual(statistics.failures(CALL_TAG), 1)
+        statistics.setDuration(0.5)
+        output = io.StringIO()
+        statistics.report(output)
+        self.assertIn("call", output.getvalue())
+        self.assertIn("4.0", output.getvalue())
+
+
+class LoadGeneratorTest(unittest.TestCase):
+    """Unit test suite for load generator"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._backend = self._zmqctx.socket(zmq.ROUTER)
+        self._backend.bind(CONTROL_ENDPOINT)
+        self._publisher = self._zmqctx.socket(zmq.PUB)
+        self._publisher.bind(EVENT_ENDPOINT)
+        self._commands = []
+        self._running = True
+        self._server = threading.Thread(target=self._serve)
+        self._server.start()
+
+    def tearDown(self):
+        self._running = False
+        self._server.join()
+        self._zmqctx.destroy(linger=0)
+
+    def testRun(self):
+        generator = LoadGenerator(
+            CONTROL_ENDPOINT, 5, context=self._zmqctx, seed=1)
+        statistics = generator.run(0.5)
+        self.assertEqual(len(generator.bots()), 5)
+        self.assertEqual(len(statistics.latencies(JOIN_TAG)), 5)
+        self.assertEqual(self._commands.count(b'game'), 2)
+        self.assertEqual(self._commands.count(b'call'), 5)
+        self.assertEqual(len(statistics.latencies(CALL_TAG)), 5)
+        self.assertEqual(statistics.errors(), 0)
+        self.assertGreaterEqual(statistics.duration(), 0.5)
+
+    def _serve(self):
+        while self._running:
+            if not self._backend.poll(10):
+                continue
+            identity, empty, tag, command, *args = (
+                self._backend.recv_multipart())
+            self._commands.append(command)
+            arguments = dict(zip(args[::2], args[1::2]))
+            reply = []
+            if command in (b'game', b'join'):
+                reply = [b'game', arguments[b'game']]
+            elif command == b'get':
+                state = {
+                    "self": {
+                        "position": "south",
+                        "allowedCalls": [{ "type": "pass" }],
+                    },
+                }
+                reply = [b'get', json.dumps(state).encode(), b'counter', b'1']
+            self._backend.send_multipart(
+                [identity, empty, tag, b'OK'] + reply)
@@ -1,13 +1,23 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import threading
+import time
 import unittest
 
-from PyQt5.QtTest import QSignalSpy
 import zmq.decorators
 import zmq
 
 from bridgegui.messaging import (
-    endpoints, sendCommand, MessageQueue, validateControlReply)
+    CODECS, CommandFailure, CommandQueue, CommandTimeout, ConnectionMonitor,
+    EventSequencer, JsonCodec, MessageQueue, MessageScheduler, PreparedCommand,
+    ProtocolError, RequestAggregator, endpoints, getCodec, probeEndpoints,
+    sendCommand, setupHeartbeat, validateControlReply)
 
 ENDPOINT = 'inproc://testing'
+
+Card = collections.namedtuple("Card", ("rank", "suit"))
 COMMAND = b'command'
 REPLY_SUCCESS_PREFIX = [b'', COMMAND, b'OK']
 
@@ -20,10 +30,27 @@ class MessagingTest(unittest.TestCase):
         self.assertEqual(next(gen), "tcp://127.0.0.1:5555")
         self.assertEqual(next(gen), "tcp://127.0.0.1:5556")
 
+    def testIpcEndpoints(self):
+        gen = endpoints("ipc:///tmp/bridge09")
+        self.assertEqual(next(gen), "ipc:///tmp/bridge09")
+        self.assertEqual(next(gen), "ipc:///tmp/bridge10")
+
+    def testInprocEndpointsWithoutNumber(self):
+        gen = endpoints("inproc://bridge")
+        self.assertEqual(next(gen), "inproc://bridge")
+        self.assertEqual(next(gen), "inproc://bridge-1")
+        self.assertEqual(next(gen), "inproc://bridge-2")
+
+    def testUnsupportedEndpoint(self):
+        self.assertRaises(ValueError, next, endpoints("udp://127.0.0.1:5555"))
+
 
 class MessageQueueTest(unittest.TestCase):
     """Unit test suite for message queue"""
 
+    COPY = True
+    CODEC = None
+
     def setUp(self):
         self._zmqctx = zmq.Context()
         self._back_socket = self._zmqctx.socket(zmq.PAIR)
@@ -32,18 +59,30 @@ class MessageQueueTest(unittest.TestCase):
         self._front_socket.connect(ENDPOINT)
         self._message_queue = MessageQueue(
             self._back_socket, "test message queue",
-            validateControlReply, { COMMAND: self._handle_command })
+            validateControlReply, { COMMAND: self._handle_command },
+            copy=self.COPY, codec=self.CODEC)
         self._command_handled = False
 
     def tearDown(self):
         self._zmqctx.destroy()
 
     def testSendCommand(self):
-        sendCommand(self._front_socket, COMMAND, arg=1)
+        sendCommand(self._front_socket, COMMAND, _codec=self.CODEC, arg=1)
         self.assertEqual(
             self._back_socket.recv_multipart(flags=zmq.NOBLOCK),
             [b'', COMMAND, COMMAND, b'arg', b'1'])
 
+    def testPreparedCommand(self):
+        command = PreparedCommand(COMMAND, _codec=self.CODEC, arg=1)
+        command.send(self._front_socket, other=2)
+        command.send(self._front_socket, b'tag')
+        self.assertEqual(
+            self._back_socket.recv_multipart(flags=zmq.NOBLOCK),
+            [b'', COMMAND, COMMAND, b'arg', b'1', b'other', b'2'])
+        self.assertEqual(
+            self._back_socket.recv_multipart(flags=zmq.NOBLOCK),
+            [b'', b'tag', COMMAND, b'arg', b'1'])
+
     def testIncorrectPrefix(self):
         self._front_socket.send_multipart([b'this', b'is', b'incorrect'])
         self.assertFalse(self._message_queue.handleMessages())
@@ -75,6 +114,571 @@ class MessageQueueTest(unittest.TestCase):
         self.assertTrue(self._message_queue.handleMessages())
         self.assertTrue(self._command_handled)
 
+    def testWaitForMessages(self):
+        async def wait_and_handle():
+            wait = asyncio.ensure_future(
+                self._message_queue.waitForMessages())
+            await asyncio.sleep(0)
+            self.assertFalse(wait.done())
+            self._front_socket.send_multipart(
+                REPLY_SUCCESS_PREFIX + [b'arg', b'123'])
+            await asyncio.wait_for(wait, 1)
+            return self._message_queue.handleMessages()
+        for _ in range(2):
+            self._command_handled = False
+            self.assertTrue(asyncio.run(wait_and_handle()))
+            self.assertTrue(self._command_handled)
+
+    def testHandleMessageWithLargeArgument(self):
+        arg = list(range(1000))
+        self._front_socket.send_multipart(
+            REPLY_SUCCESS_PREFIX + [b'arg', json.dumps(arg).encode()])
+        self.assertTrue(self._message_queue.handleMessages())
+        self.assertEqual(self._large_arg, arg)
+
+    def testIncorrectEncoding(self):
+        self._front_socket.send_multipart(
+            REPLY_SUCCESS_PREFIX + [b'arg', b'"\xff"'])
+        self.assertFalse(self._message_queue.handleMessages())
+
+    def testMaxMessages(self):
+        message_queue = MessageQueue(
+            self._back_socket, "test message queue", validateControlReply,
+            { COMMAND: self._count_command }, maxMessages=2)
+        self._command_count = 0
+        for _ in range(3):
+            self._front_socket.send_multipart(REPLY_SUCCESS_PREFIX)
+        self.assertTrue(message_queue.handleMessages())
+        self.assertEqual(self._command_count, 2)
+        self.assertTrue(message_queue.hasMessages())
+        self.assertTrue(message_queue.handleMessages())
+        self.assertEqual(self._command_count, 3)
+        self.assertFalse(message_queue.hasMessages())
+
+    def testTimeSlice(self):
+        message_queue = MessageQueue(
+            self._back_socket, "test message queue", validateControlReply,
+            { COMMAND: self._count_command }, timeSlice=0)
+        self._command_count = 0
+        for _ in range(2):
+            self._front_socket.send_multipart(REPLY_SUCCESS_PREFIX)
+        self.assertTrue(message_queue.handleMessages())
+        self.assertEqual(self._command_count, 1)
+        self.assertTrue(message_queue.hasMessages())
+
+    def testConverters(self):
+        message_queue = MessageQueue(
+            self._back_socket, "test message queue", validateControlReply,
+            { COMMAND: self._handle_command },
+            converters={ COMMAND: lambda kwargs: { "arg": kwargs["arg"] + 1 } })
+        self._front_socket.send_multipart(
+            REPLY_SUCCESS_PREFIX + [b'arg', b'122'])
+        self.assertTrue(message_queue.handleMessages())
+        self.assertTrue(self._command_handled)
+
+    def testDecodeAndDispatchMessages(self):
+        message = self._message_queue.decodeMessage(
+            REPLY_SUCCESS_PREFIX + [b'arg', b'123'])
+        self.assertFalse(self._command_handled)
+        self.assertEqual(message, (COMMAND, { "arg": 123 }))
+        self.assertTrue(self._message_queue.dispatchMessages([message]))
+        self.assertTrue(self._command_handled)
+
+    def testDispatchProtocolError(self):
+        with self.assertRaises(ProtocolError) as context:
+            self._message_queue.decodeMessage([b'this', b'is', b'incorrect'])
+        self.assertFalse(
+            self._message_queue.dispatchMessages([context.exception]))
+
+    def testOffloadLargeMessage(self):
+        decoded = threading.Event()
+        args = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            message_queue = MessageQueue(
+                self._back_socket, "test message queue", validateControlReply,
+                { COMMAND: lambda arg: args.append(arg) },
+                copy=self.COPY, codec=self.CODEC, executor=executor,
+                offloadThreshold=1000, offloadCallback=decoded.set)
+            large_arg = list(range(1000))
+            self._front_socket.send_multipart(
+                REPLY_SUCCESS_PREFIX + [b'arg', json.dumps(large_arg).encode()])
+            self._front_socket.send_multipart(
+                REPLY_SUCCESS_PREFIX + [b'arg', b'123'])
+            self.assertTrue(message_queue.handleMessages())
+            self.assertTrue(decoded.wait(5))
+            self.assertEqual(args, [])
+            self.assertTrue(message_queue.hasMessages())
+            self.assertTrue(message_queue.handleMessages())
+            self.assertEqual(args, [large_arg, 123])
+
+    def testOffloadInvalidMessage(self):
+        decoded = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            message_queue = MessageQueue(
+                self._back_socket, "test message queue", validateControlReply,
+                { COMMAND: self._handle_command }, executor=executor,
+                offloadThreshold=10, offloadCallback=decoded.set)
+            self._front_socket.send_multipart(
+                REPLY_SUCCESS_PREFIX + [b'arg', b'"invalid'])
+            self.assertTrue(message_queue.handleMessages())
+            self.assertTrue(decoded.wait(5))
+            self.assertFalse(message_queue.handleMessages())
+
+    def testOffloadMessageFailingConversion(self):
+        decoded = threading.Event()
+        def convert(kwargs):
+            raise KeyError("arg")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            message_queue = MessageQueue(
+                self._back_socket, "test message queue", validateControlReply,
+                { COMMAND: self._handle_command },
+                converters={ COMMAND: convert }, executor=executor,
+                offloadThreshold=10, offloadCallback=decoded.set)
+            self._front_socket.send_multipart(
+                REPLY_SUCCESS_PREFIX + [b'arg', b'123'])
+            self.assertTrue(message_queue.handleMessages())
+            self.assertTrue(decoded.wait(5))
+            with self.assertLogs(level="ERROR"):
+                self.assertFalse(message_queue.handleMessages())
+
     def _handle_command(self, arg):
+        if isinstance(arg, list):
+            self._large_arg = arg
+            return
         self.assertEqual(arg, 123)
         self._command_handled = True
+
+    def _count_command(self):
+        self._command_count += 1
+
+
+class ZeroCopyMessageQueueTest(MessageQueueTest):
+    """Unit test suite for message queue receiving messages without copying"""
+
+    COPY = False
+
+
+class JsonCodecMessageQueueTest(MessageQueueTest):
+    """Unit test suite for message queue using the standard library codec"""
+
+    CODEC = JsonCodec()
+
+
+class CodecTest(unittest.TestCase):
+    """Unit test suite for codecs"""
+
+    VALUE = {
+        "card": Card("ace", "spades")._asdict(),
+        "get": ["pubstate", "self"],
+        "counter": 123,
+        "vulnerability": {"northSouth": True, "eastWest": False},
+        "declarer": None,
+    }
+
+    def setUp(self):
+        self._codecs = []
+        for codec_type in CODECS:
+            try:
+                self._codecs.append(getCodec(codec_type.name))
+            except ImportError:
+                pass
+
+    def testDefaultCodec(self):
+        self.assertIn(type(getCodec()), CODECS)
+
+    def testJsonCodecIsAlwaysAvailable(self):
+        self.assertIsInstance(getCodec("json"), JsonCodec)
+
+    def testUnknownCodec(self):
+        with self.assertRaises(ValueError):
+            getCodec("invalid")
+
+    def testEncodeAndDecode(self):
+        for codec in self._codecs:
+            data = codec.encode(self.VALUE)
+            self.assertEqual(json.loads(data.decode()), self.VALUE)
+            self.assertEqual(codec.decode(data), self.VALUE)
+            self.assertEqual(codec.decode(memoryview(data)), self.VALUE)
+
+    def testEncodeNamedTuple(self):
+        for codec in self._codecs:
+            self.assertEqual(
+                codec.decode(codec.encode(Card("ace", "spades"))),
+                ["ace", "spades"])
+
+    def testDecodeInvalid(self):
+        for codec in self._codecs:
+            for data in (b'not json', b'"\xff"'):
+                with self.assertRaises(ValueError):
+                    codec.decode(data)
+
+
+class CommandQueueTest(unittest.TestCase):
+    """Unit test suite for command queue"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._back_socket = self._zmqctx.socket(zmq.PAIR)
+        self._back_socket.bind(ENDPOINT)
+        self._front_socket = self._zmqctx.socket(zmq.PAIR)
+        self._front_socket.connect(ENDPOINT)
+        self._command_queue = CommandQueue(
+            self._back_socket, "test command queue",
+            { COMMAND: self._handle_command }, timeout=10)
+        self._command_handled = False
+
+    def tearDown(self):
+        self._zmqctx.destroy()
+
+    def testReply(self):
+        future = self._command_queue.sendCommand(COMMAND, arg=1)
+        self.assertEqual(self._command_queue.pendingCommands(), 1)
+        _, tag, command, *_ = self._reply(b'OK', b'result', b'2')
+        self.assertNotEqual(tag, COMMAND)
+        self.assertEqual(command, COMMAND)
+        self.assertTrue(self._command_queue.handleMessages())
+        self.assertEqual(future.result(timeout=0), { "result": 2 })
+        self.assertEqual(self._command_queue.pendingCommands(), 0)
+        self.assertFalse(self._command_handled)
+
+    def testFailure(self):
+        future = self._command_queue.sendCommand(COMMAND)
+        self._reply(b'ERR')
+        self.assertTrue(self._command_queue.handleMessages())
+        self.assertRaises(CommandFailure, future.result, timeout=0)
+
+    def testInvalidReply(self):
+        future = self._command_queue.sendCommand(COMMAND)
+        self._reply(b'OK', b'result', b'invalid')
+        self.assertFalse(self._command_queue.handleMessages())
+        self.assertRaises(ProtocolError, future.result, timeout=0)
+
+    def testPipelinedCommands(self):
+        futures = [
+            self._command_queue.sendCommand(COMMAND, arg=n) for n in range(3)]
+        requests = [
+            self._front_socket.recv_multipart(flags=zmq.NOBLOCK)
+            for _ in futures]
+        for (_, tag, _, _, arg) in reversed(requests):
+            self._front_socket.send_multipart(
+                [b'', tag, b'OK', b'result', arg])
+        self.assertTrue(self._command_queue.handleMessages())
+        self.assertEqual(
+            [future.result(timeout=0) for future in futures],
+            [{ "result": n } for n in range(3)])
+
+    def testTimeout(self):
+        future = self._command_queue.sendCommand(COMMAND, _timeout=1)
+        deadline = self._command_queue.nextDeadline()
+        self.assertEqual(self._command_queue.expireCommands(deadline - 0.5), 0)
+        self.assertEqual(self._command_queue.expireCommands(deadline), 1)
+        self.assertRaises(CommandTimeout, future.result, timeout=0)
+        self.assertIsNone(self._command_queue.nextDeadline())
+        self._reply(b'OK')
+        self.assertTrue(self._command_queue.handleMessages())
+        self.assertFalse(self._command_handled)
+
+    def testCancel(self):
+        future = self._command_queue.sendCommand(COMMAND)
+        self.assertTrue(future.cancel())
+        self._reply(b'OK')
+        self.assertTrue(self._command_queue.handleMessages())
+        self.assertTrue(future.cancelled())
+        self.assertFalse(self._command_handled)
+
+    def testCancelCommands(self):
+        future = self._command_queue.sendCommand(COMMAND)
+        self._command_queue.cancelCommands()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(self._command_queue.pendingCommands(), 0)
+
+    def testPreparedCommand(self):
+        command = PreparedCommand(COMMAND, arg=1)
+        future = self._command_queue.sendCommand(command, other=2)
+        _, _, _, *args = self._reply(b'OK')
+        self.assertEqual(args, [b'arg', b'1', b'other', b'2'])
+        self.assertTrue(self._command_queue.handleMessages())
+        self.assertEqual(future.result(timeout=0), {})
+
+    def testOtherReplies(self):
+        self._front_socket.send_multipart(REPLY_SUCCESS_PREFIX)
+        self.assertTrue(self._command_queue.handleMessages())
+        self.assertTrue(self._command_handled)
+
+    def _reply(self, status, *args):
+        request = self._front_socket.recv_multipart(flags=zmq.NOBLOCK)
+        self._front_socket.send_multipart(
+            [b'', request[1], status] + list(args))
+        return request
+
+    def _handle_command(self):
+        self._command_handled = True
+
+
+class ProbeEndpointsTest(unittest.TestCase):
+    """Unit test suite for probing endpoints"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._threads = []
+        self._stopped = threading.Event()
+
+    def tearDown(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        self._zmqctx.destroy(linger=0)
+
+    def testProbeEndpoints(self):
+        slow_endpoint = self._start_server(0.2)
+        fast_endpoint = self._start_server(0)
+        failing_endpoint = self._start_server(0, b'ERR')
+        unreachable_endpoint = "inproc://unreachable"
+        results = probeEndpoints(
+            [slow_endpoint, unreachable_endpoint, failing_endpoint,
+             fast_endpoint],
+            COMMAND, timeout=0.5, context=self._zmqctx, arg=1)
+        self.assertEqual(
+            [endpoint for (_, endpoint) in results],
+            [fast_endpoint, slow_endpoint])
+        self.assertGreaterEqual(results[1][0], 0.2)
+
+    def _start_server(self, delay, status=b'OK'):
+        socket = self._zmqctx.socket(zmq.ROUTER)
+        endpoint = "%s-server%d" % (ENDPOINT, len(self._threads))
+        socket.bind(endpoint)
+        def _serve():
+            with socket:
+                while not self._stopped.is_set():
+                    if socket.poll(10):
+                        identity, _, tag, *_ = socket.recv_multipart()
+                        time.sleep(delay)
+                        socket.send_multipart([identity, b'', tag, status])
+        thread = threading.Thread(target=_serve)
+        thread.start()
+        self._threads.append(thread)
+        return endpoint
+
+
+class ConnectionMonitorTest(unittest.TestCase):
+    """Unit test suite for connection monitor"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._server_socket = self._zmqctx.socket(zmq.ROUTER)
+        self._port = self._server_socket.bind_to_random_port("tcp://127.0.0.1")
+        self._client_socket = self._zmqctx.socket(zmq.DEALER)
+        setupHeartbeat(self._client_socket, 0.1, 0.05, 0.2)
+        self._states = []
+        self._connection_monitor = ConnectionMonitor(
+            self._client_socket, "test connection monitor",
+            self._states.append)
+        self._client_socket.connect("tcp://127.0.0.1:%d" % self._port)
+
+    def tearDown(self):
+        self._zmqctx.destroy(linger=0)
+
+    def testHeartbeatOptions(self):
+        self.assertEqual(self._client_socket.heartbeat_ivl, 100)
+        self.assertEqual(self._client_socket.heartbeat_timeout, 300)
+        self.assertEqual(self._client_socket.reconnect_ivl_max, 200)
+
+    def testConnectionState(self):
+        self._wait_for_states(1)
+        self.assertEqual(self._states, [True])
+        self.assertTrue(self._connection_monitor.isConnected())
+        self._server_socket.close(linger=0)
+        self._wait_for_states(2)
+        self.assertEqual(self._states, [True, False])
+        self._server_socket = self._zmqctx.socket(zmq.ROUTER)
+        self._server_socket.bind("tcp://127.0.0.1:%d" % self._port)
+        self._wait_for_states(3)
+        self.assertEqual(self._states, [True, False, True])
+
+    def _wait_for_states(self, count):
+        monitor_socket = self._connection_monitor.monitorSocket()
+        deadline = time.monotonic() + 5
+        while len(self._states) < count and time.monotonic() < deadline:
+            monitor_socket.poll(100)
+            self.assertTrue(self._connection_monitor.handleMessages())
+
+
+class RequestAggregatorTest(unittest.TestCase):
+    """Unit test suite for request aggregator"""
+
+    def setUp(self):
+        self._sent = []
+        self._request_aggregator = RequestAggregator(self._send)
+
+    def testMergeRequests(self):
+        self._request_aggregator.request("a", "b")
+        self._request_aggregator.request("b", "c")
+        self.assertEqual(self._request_aggregator.pendingKeys(), ("a", "b", "c"))
+        self._request_aggregator.flush()
+        self.assertEqual([keys for (keys, _) in self._sent], [("a", "b", "c")])
+        self.assertEqual(self._request_aggregator.pendingKeys(), ())
+        self.assertIsNone(self._request_aggregator.flush())
+        self.assertEqual(len(self._sent), 1)
+
+    def testSuppressDuplicateRequests(self):
+        self._request_aggregator.request("a")
+        self._request_aggregator.flush()
+        self._request_aggregator.request("a", "b")
+        self._request_aggregator.flush()
+        self.assertEqual([keys for (keys, _) in self._sent], [("a",), ("b",)])
+        self._sent[0][1].set_result({ "counter": 1 })
+        self.assertEqual(self._request_aggregator.inFlightKeys(), ("b",))
+        self._request_aggregator.request("a")
+        self.assertEqual(self._request_aggregator.pendingKeys(), ("a",))
+
+    def testRequestAgainIfReplyIsOld(self):
+        self._request_aggregator.request("a", "b", counter=1)
+        self._request_aggregator.flush()
+        self._request_aggregator.request("a", counter=3)
+        self.assertEqual(self._request_aggregator.pendingKeys(), ())
+        self._sent[0][1].set_result({ "counter": 2 })
+        self.assertEqual(self._request_aggregator.pendingKeys(), ("a",))
+        self._request_aggregator.flush()
+        self._sent[1][1].set_result({ "counter": 4 })
+        self.assertEqual(self._request_aggregator.pendingKeys(), ())
+        self.assertEqual(self._request_aggregator.inFlightKeys(), ())
+
+    def testRequestAgainIfReplyDoesNotIncludeEvent(self):
+        # The reply with the same counter as the event precedes the event
+        self._request_aggregator.request("a")
+        self._request_aggregator.flush()
+        self._request_aggregator.request("a", counter=3)
+        self._sent[0][1].set_result({ "counter": 3 })
+        self.assertEqual(self._request_aggregator.pendingKeys(), ("a",))
+
+    def testFailedRequest(self):
+        self._request_aggregator.request("a", counter=3)
+        self._request_aggregator.flush()
+        self._sent[0][1].set_exception(CommandTimeout())
+        self.assertEqual(self._request_aggregator.pendingKeys(), ())
+        self.assertEqual(self._request_aggregator.inFlightKeys(), ())
+
+    def _send(self, keys):
+        future = concurrent.futures.Future()
+        self._sent.append((keys, future))
+        return future
+
+
+class EventSequencerTest(unittest.TestCase):
+    """Unit test suite for event sequencer"""
+
+    def setUp(self):
+        self._handled = []
+        self._resyncs = []
+        self._event_sequencer = EventSequencer(
+            self._resyncs.append, gapTimeout=1, maxBuffered=3)
+        self._event_sequencer.setCounter(5)
+
+    def testHandleEventsInOrder(self):
+        self._handle_events(5, 6)
+        self.assertEqual(self._handled, [5, 6])
+        self.assertIsNone(self._event_sequencer.nextDeadline())
+
+    def testEventsWithoutCounter(self):
+        self._handle_events(None)
+        self.assertEqual(self._handled, [None])
+
+    def testStaleEvents(self):
+        self._handle_events(4, 5, 5)
+        self.assertEqual(self._handled, [5])
+
+    def testReset(self):
+        self._handle_events(7)
+        self._event_sequencer.reset()
+        self.assertEqual(self._event_sequencer.bufferedEvents(), 0)
+        self.assertIsNone(self._event_sequencer.nextDeadline())
+        self._handle_events(0)
+        self.assertEqual(self._handled, [0])
+
+    def testReorderEvents(self):
+        self._handle_events(7, 6)
+        self.assertEqual(self._handled, [])
+        self.assertEqual(self._event_sequencer.bufferedEvents(), 2)
+        self.assertIsNotNone(self._event_sequencer.nextDeadline())
+        self._handle_events(5)
+        self.assertEqual(self._handled, [5, 6, 7])
+        self.assertIsNone(self._event_sequencer.nextDeadline())
+        self.assertFalse(self._event_sequencer.checkGaps())
+        self.assertEqual(self._resyncs, [])
+
+    def testResyncAfterGapTimeout(self):
+        self._handle_events(6)
+        deadline = self._event_sequencer.nextDeadline()
+        self.assertFalse(self._event_sequencer.checkGaps(deadline - 0.5))
+        self.assertTrue(self._event_sequencer.checkGaps(deadline))
+        self.assertEqual(self._resyncs, [5])
+        self.assertIsNone(self._event_sequencer.nextDeadline())
+        self._handle_events(7)
+        self._event_sequencer.setCounter(7)
+        self.assertEqual(self._handled, [7])
+        self.assertEqual(self._event_sequencer.bufferedEvents(), 0)
+
+    def testResyncWhenBufferIsFull(self):
+        self._handle_events(6, 7, 8)
+        self.assertEqual(self._resyncs, [])
+        self._handle_events(9)
+        self.assertEqual(self._resyncs, [5])
+        self._handle_events(10)
+        self.assertEqual(self._resyncs, [5])
+
+    def testResyncFailed(self):
+        self._handle_events(6)
+        self._event_sequencer.checkGaps(self._event_sequencer.nextDeadline())
+        self._event_sequencer.resyncFailed()
+        self.assertIsNotNone(self._event_sequencer.nextDeadline())
+
+    def _handle_events(self, *counters):
+        for counter in counters:
+            self._event_sequencer.handleEvent(self._handle_event, counter=counter)
+
+    def _handle_event(self, counter):
+        self._handled.append(counter)
+
+
+class MessageSchedulerTest(unittest.TestCase):
+    """Unit test suite for message scheduler"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._front_sockets = []
+        self._handled = []
+        queues = []
+        for n in range(2):
+            back_socket = self._zmqctx.socket(zmq.PAIR)
+            back_socket.bind("%s%d" % (ENDPOINT, n))
+            front_socket = self._zmqctx.socket(zmq.PAIR)
+            front_socket.connect("%s%d" % (ENDPOINT, n))
+            self._front_sockets.append(front_socket)
+            queues.append(
+                MessageQueue(
+                    back_socket, "test message queue %d" % n,
+                    validateControlReply,
+                    { COMMAND: lambda n=n: self._handled.append(n) },
+                    maxMessages=2))
+        self._message_scheduler = MessageScheduler(queues[:1])
+        self._message_scheduler.addQueue(queues[1])
+
+    def tearDown(self):
+        self._zmqctx.destroy()
+
+    def testHandleMessages(self):
+        for front_socket in reversed(self._front_sockets):
+            for _ in range(3):
+                front_socket.send_multipart(REPLY_SUCCESS_PREFIX)
+        self.assertTrue(self._message_scheduler.handleMessages())
+        self.assertEqual(self._handled, [0, 0, 1, 1])
+        self.assertTrue(self._message_scheduler.hasMessages())
+        self.assertTrue(self._message_scheduler.handleMessages())
+        self.assertEqual(self._handled, [0, 0, 1, 1, 0, 1])
+        self.assertFalse(self._message_scheduler.hasMessages())
+
+    def testHandleMessagesWithError(self):
+        self._front_sockets[0].send_multipart([b'invalid'])
+        self._front_sockets[1].send_multipart(REPLY_SUCCESS_PREFIX)
+        self.assertFalse(self._message_scheduler.handleMessages())
+        self.assertEqual(self._handled, [1])
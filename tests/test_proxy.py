@@ -0,0 +1,101 @@
+import time
+import unittest
+
+import zmq
+
+from bridgegui.proxy import ImpairmentProxy, Profile
+
+FRONTEND = 'inproc://testing-proxy'
+BACKEND = 'inproc://testing-proxy-backend'
+DELAY = 0.05
+TIMEOUT = 5
+
+
+class ImpairmentProxyTest(unittest.TestCase):
+    """Unit test suite for impairment proxy"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._backend = self._zmqctx.socket(zmq.ROUTER)
+        self._backend.bind(BACKEND)
+        self._publisher = self._zmqctx.socket(zmq.PUB)
+        self._publisher.bind(BACKEND + '-1')
+        self._proxy = ImpairmentProxy(
+            FRONTEND, BACKEND, Profile(DELAY, 0, 0, 0), seed=1,
+            context=self._zmqctx)
+        self._control_socket = self._zmqctx.socket(zmq.DEALER)
+        self._control_socket.connect(FRONTEND)
+        self._event_socket = self._zmqctx.socket(zmq.SUB)
+        self._event_socket.connect(FRONTEND + '-1')
+        self._event_socket.setsockopt(zmq.SUBSCRIBE, b'game')
+
+    def tearDown(self):
+        self._proxy.close()
+        self._zmqctx.destroy(linger=0)
+
+    def testForwardCommandAndReply(self):
+        send_time = time.monotonic()
+        self._control_socket.send_multipart([b'', b'tag', b'command'])
+        identity, *parts = self._run_until_received(self._backend)
+        self.assertEqual(parts, [b'', b'tag', b'command'])
+        self.assertGreaterEqual(time.monotonic() - send_time, DELAY)
+        self._backend.send_multipart([identity, b'', b'tag', b'OK'])
+        self.assertEqual(
+            self._run_until_received(self._control_socket),
+            [b'', b'tag', b'OK'])
+        self.assertGreaterEqual(time.monotonic() - send_time, 2 * DELAY)
+
+    def testForwardEvents(self):
+        self._subscribe()
+        self._publisher.send_multipart([b'game:play'])
+        self.assertEqual(
+            self._run_until_received(self._event_socket), [b'game:play'])
+
+    def testDropEvents(self):
+        self._subscribe()
+        self._proxy.setProfile(Profile(0, 0, 0, 1))
+        self._publisher.send_multipart([b'game:play', b'counter', b'1'])
+        # Over inproc the message is ready to be received immediately
+        self._proxy.handleMessages()
+        self._proxy.setProfile(Profile(0, 0, 0, 0))
+        self._publisher.send_multipart([b'game:play', b'counter', b'2'])
+        self.assertEqual(
+            self._run_until_received(self._event_socket),
+            [b'game:play', b'counter', b'2'])
+
+    def testReorderEvents(self):
+        self._subscribe()
+        self._proxy.setProfile(Profile(0, 0, 1, 0))
+        self._publisher.send_multipart([b'game:play', b'counter', b'1'])
+        self._run_until(lambda: self._proxy.nextDeadline() is not None)
+        self._proxy.setProfile(Profile(0, 0, 0, 0))
+        self._publisher.send_multipart([b'game:play', b'counter', b'2'])
+        self.assertEqual(
+            self._run_until_received(self._event_socket),
+            [b'game:play', b'counter', b'2'])
+        self.assertEqual(
+            self._run_until_received(self._event_socket),
+            [b'game:play', b'counter', b'1'])
+
+    def _subscribe(self):
+        # The subscription reaches the publisher after the delay, so probes
+        # are published until one of them gets through
+        def _probe():
+            self._publisher.send(b'game:probe')
+            return self._event_socket.poll(0)
+        self._run_until(_probe)
+        self._run_until(lambda: self._proxy.nextDeadline() is None)
+        while self._event_socket.poll(0):
+            self._event_socket.recv_multipart()
+
+    def _run_until_received(self, socket):
+        self._run_until(lambda: socket.poll(0))
+        return socket.recv_multipart()
+
+    def _run_until(self, condition):
+        deadline = time.monotonic() + TIMEOUT
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            self._proxy.handleMessages()
+            self._proxy.handleTimeouts()
+            time.sleep(0.001)
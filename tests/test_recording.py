@@ -0,0 +1,168 @@
+import io
+import json
+import threading
+import time
+import unittest
+import unittest.mock
+
+import zmq
+
+from bridgegui.client import GameClient
+from bridgegui.deck import Card, RANK_TAGS, SUIT_TAGS
+from bridgegui.messaging import SENT_CHANNEL, sendCommand, setRecorder
+from bridgegui.positions import Position
+from bridgegui.recording import (
+    MAGIC, RECEIVED_RECORD, SENT_RECORD, Record, Recorder, Replayer,
+    readRecords, readSession)
+from bridgegui.server import Server
+
+SERVER_ENDPOINT = 'inproc://testing-recording-server'
+REPLAY_ENDPOINT = 'inproc://testing-recording-replay'
+TIMEOUT = 5
+
+HANDS = {
+    position: [Card(rank, suit) for rank in RANK_TAGS]
+    for (position, suit) in zip(Position, SUIT_TAGS)
+}
+
+
+class RecorderTest(unittest.TestCase):
+    """Unit test suite for recorder"""
+
+    def setUp(self):
+        self._file = io.BytesIO()
+        self._recorder = Recorder(self._file)
+
+    def tearDown(self):
+        setRecorder(None)
+
+    def testRoundTrip(self):
+        self._recorder.recordSent("control", [b'', b'tag', b'command'])
+        self._recorder.recordReceived("events", [b'topic', zmq.Frame(b'x')])
+        records = self._read()
+        self.assertEqual(
+            [(record.type, record.channel, record.parts) for record in records],
+            [(SENT_RECORD, "control", [b'', b'tag', b'command']),
+             (RECEIVED_RECORD, "events", [b'topic', b'x'])])
+        self.assertLessEqual(records[0].timestamp, records[1].timestamp)
+
+    def testSessions(self):
+        self._recorder.recordSent("control", [b'first'])
+        Recorder(self._file).recordSent("other", [b'second'])
+        self._file.seek(0)
+        self.assertEqual(
+            [(session, record.channel, record.parts)
+             for (session, record) in readRecords(self._file)],
+            [(0, "control", [b'first']), (1, "other", [b'second'])])
+        self._file.seek(0)
+        self.assertEqual(readSession(self._file, 1)[0].parts, [b'second'])
+
+    def testTruncatedRecording(self):
+        self._recorder.recordSent("control", [b'first'])
+        self._recorder.recordSent("control", [b'second'])
+        self._file.truncate(len(self._file.getvalue()) - 1)
+        with self.assertLogs(level="WARNING"):
+            records = self._read()
+        self.assertEqual([record.parts for record in records], [[b'first']])
+
+    def testNotRecording(self):
+        self.assertRaises(
+            ValueError, list, readRecords(io.BytesIO(b'not a recording')))
+
+    def testRecordSentCommand(self):
+        setRecorder(self._recorder)
+        zmqctx = zmq.Context()
+        try:
+            socket = zmqctx.socket(zmq.PUB)
+            sendCommand(socket, b'command', key="value")
+        finally:
+            zmqctx.destroy(linger=0)
+        self.assertEqual(
+            self._read(),
+            [Record(SENT_RECORD, SENT_CHANNEL, unittest.mock.ANY,
+                    [b'', b'command', b'command', b'key', b'"value"'])])
+
+    def _read(self):
+        self._file.seek(0)
+        self.assertEqual(self._file.read(len(MAGIC)), MAGIC)
+        self._file.seek(0)
+        return readSession(self._file)
+
+
+class ReplayerTest(unittest.TestCase):
+    """Unit test suite for replayer"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        self._file = io.BytesIO()
+
+    def tearDown(self):
+        setRecorder(None)
+        self._zmqctx.destroy(linger=0)
+
+    def testReplay(self):
+        self._record_session()
+        self._file.seek(0)
+        replayer = Replayer(
+            readSession(self._file), REPLAY_ENDPOINT, context=self._zmqctx)
+        self.assertEqual(replayer.gameUuid(), self._game_uuid)
+        thread = threading.Thread(
+            target=replayer.run, kwargs={"keepOpen": True})
+        thread.start()
+        try:
+            client = self._create_client(
+                REPLAY_ENDPOINT, gameUuid=replayer.gameUuid())
+            self._run_until(
+                client, lambda: client.state().cards().get(Position.north))
+        finally:
+            replayer.stop()
+            thread.join()
+        self.assertEqual(client.state().position(), "north")
+        self.assertEqual(
+            client.state().cards()[Position.north], HANDS[Position.north])
+        self.assertEqual(replayer.skipped(), 1)
+
+    def _record_session(self):
+        # Records a client creating a game in the stand-in backend
+        control_socket = self._zmqctx.socket(zmq.ROUTER)
+        control_socket.bind(SERVER_ENDPOINT)
+        event_socket = self._zmqctx.socket(zmq.PUB)
+        event_socket.bind(SERVER_ENDPOINT + '-1')
+        server = Server(control_socket, event_socket, deals=[HANDS])
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        setRecorder(Recorder(self._file))
+        try:
+            client = self._create_client(SERVER_ENDPOINT, createGame=True)
+            self._run_until(client, lambda: client.state().position())
+            # The other players join without the recorder seeing them
+            for n in range(len(Position) - 1):
+                socket = self._zmqctx.socket(zmq.DEALER)
+                socket.connect(SERVER_ENDPOINT)
+                socket.send_multipart([
+                    b'', b'join', b'join',
+                    b'game', json.dumps(client.gameUuid()).encode(),
+                    b'player', json.dumps("player%d" % n).encode()])
+            self._run_until(
+                client, lambda: client.state().cards().get(Position.north))
+        finally:
+            setRecorder(None)
+            server.stop()
+            thread.join()
+        self._game_uuid = client.gameUuid()
+
+    def _create_client(self, endpoint, **kwargs):
+        client = GameClient(
+            self._zmqctx.socket(zmq.DEALER), self._zmqctx.socket(zmq.SUB),
+            pipelinedStartup=True,
+            endpoints=[(endpoint, endpoint + '-1')], **kwargs)
+        client.start()
+        return client
+
+    def _run_until(self, client, condition):
+        deadline = time.monotonic() + TIMEOUT
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            self.assertTrue(client.handleMessages())
+            self.assertTrue(client.handleTimeouts())
+            time.sleep(0.001)
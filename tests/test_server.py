@@ -0,0 +1,217 @@
+import threading
+import time
+import unittest
+import unittest.mock
+
+import zmq
+
+from bridgegui.calls import makeBid, makeDouble, makePass, makeRedouble
+from bridgegui.client import EVENT_GAP_TIMEOUT, GameClient
+from bridgegui.deck import Card, RANK_TAGS, SUIT_TAGS
+from bridgegui.loadgen import CALL_TAG, LoadGenerator
+from bridgegui.messaging import ProtocolError
+from bridgegui.positions import Partnership, Position
+from bridgegui.server import Deal, Server, _duplicate_score
+
+CONTROL_ENDPOINT = 'inproc://testing-server'
+EVENT_ENDPOINT = 'inproc://testing-server-1'
+TIMEOUT = 5
+
+# Each position holds one suit: north clubs, east diamonds etc.
+HANDS = {
+    position: [Card(rank, suit) for rank in RANK_TAGS]
+    for (position, suit) in zip(Position, SUIT_TAGS)
+}
+VULNERABILITY = { Partnership.northSouth: False, Partnership.eastWest: True }
+
+
+class DealTest(unittest.TestCase):
+    """Unit test suite for deal"""
+
+    def setUp(self):
+        self._deal = Deal(Position.north, VULNERABILITY, HANDS)
+
+    def testInvalidHands(self):
+        hands = dict(HANDS, north=HANDS[Position.east])
+        self.assertRaises(ValueError, Deal, Position.north, {}, hands)
+
+    def testInitialAllowedCalls(self):
+        allowed_calls = self._deal.allowedCalls()
+        self.assertEqual(allowed_calls[0], makePass())
+        self.assertEqual(allowed_calls[1], makeBid(1, "clubs"))
+        self.assertEqual(len(allowed_calls), 36)
+
+    def testDoubleAndRedouble(self):
+        self._deal.makeCall(Position.north, makeBid(1, "notrump"))
+        self.assertIn(makeDouble(), self._deal.allowedCalls())
+        self.assertEqual(self._deal.allowedCalls()[2], makeBid(2, "clubs"))
+        self._deal.makeCall(Position.east, makeDouble())
+        self.assertIn(makeRedouble(), self._deal.allowedCalls())
+        self._deal.makeCall(Position.south, makePass())
+        self.assertNotIn(makeDouble(), self._deal.allowedCalls())
+        self.assertNotIn(makeRedouble(), self._deal.allowedCalls())
+
+    def testCallOutOfTurn(self):
+        self.assertRaises(
+            ProtocolError, self._deal.makeCall, Position.east, makePass())
+
+    def testPassedOut(self):
+        for position in Position:
+            self._deal.makeCall(position, makePass())
+        self.assertTrue(self._deal.isOver())
+        self.assertEqual(self._deal.result(), (None, 0))
+
+    def testContract(self):
+        self._deal.makeCall(Position.north, makeBid(1, "clubs"))
+        self._deal.makeCall(Position.east, makePass())
+        self._deal.makeCall(Position.south, makeBid(2, "clubs"))
+        self._deal.makeCall(Position.west, makeDouble())
+        for position in (Position.north, Position.east):
+            self.assertFalse(self._deal.makeCall(position, makePass()))
+        self.assertTrue(self._deal.makeCall(Position.south, makePass()))
+        self.assertEqual(self._deal.declarer(), Position.north)
+        self.assertEqual(self._deal.contract(), (makeBid(2, "clubs").bid, "doubled"))
+        self.assertEqual(self._deal.positionInTurn(), Position.east)
+
+    def testPlay(self):
+        self._bid_and_pass(makeBid(1, "spades"))
+        self.assertEqual(self._deal.declarer(), Position.north)
+        self.assertEqual(self._deal.dummy(), Position.south)
+        self.assertEqual(self._deal.allowedCards(), HANDS[Position.east])
+        self.assertIsNone(
+            self._deal.playCard(Position.east, Card("2", "diamonds")))
+        self.assertTrue(self._deal.isDummyRevealed())
+        self.assertIsNone(
+            self._deal.playCard(Position.south, Card("ace", "hearts")))
+        self.assertIsNone(
+            self._deal.playCard(Position.west, Card("2", "spades")))
+        self.assertEqual(
+            self._deal.playCard(Position.north, Card("ace", "clubs")),
+            Position.west)
+        self.assertEqual(self._deal.positionInTurn(), Position.west)
+
+    def testMustFollowSuit(self):
+        deal = Deal(Position.north, VULNERABILITY, {
+            position: [
+                Card(rank, suit) for (n, rank) in enumerate(RANK_TAGS)
+                for suit in SUIT_TAGS if (n + SUIT_TAGS.index(suit)) % 4 == position
+            ] for position in Position
+        })
+        self._deal = deal
+        self._bid_and_pass(makeBid(1, "notrump"))
+        lead = deal.allowedCards()[0]
+        deal.playCard(deal.positionInTurn(), lead)
+        allowed_cards = deal.allowedCards()
+        self.assertTrue(allowed_cards)
+        self.assertTrue(all(card.suit == lead.suit for card in allowed_cards))
+
+    def testFullDeal(self):
+        self._bid_and_pass(makeBid(7, "spades"))
+        while not self._deal.isOver():
+            self._deal.playCard(
+                self._deal.positionInTurn(), self._deal.allowedCards()[0])
+        # West holds all spades, so east-west take all tricks
+        self.assertEqual(self._deal.result(), (Partnership.eastWest, 650))
+
+    def testDuplicateScore(self):
+        self.assertEqual(
+            _duplicate_score(makeBid(4, "spades").bid, "undoubled", False, 0),
+            420)
+        self.assertEqual(
+            _duplicate_score(makeBid(3, "notrump").bid, "undoubled", True, 1),
+            630)
+        self.assertEqual(
+            _duplicate_score(makeBid(1, "clubs").bid, "doubled", False, 1),
+            240)
+        self.assertEqual(
+            _duplicate_score(makeBid(6, "hearts").bid, "undoubled", True, 0),
+            1430)
+        self.assertEqual(
+            _duplicate_score(makeBid(3, "clubs").bid, "doubled", False, -4),
+            -800)
+        self.assertEqual(
+            _duplicate_score(makeBid(3, "clubs").bid, "redoubled", True, -2),
+            -1000)
+
+    def _bid_and_pass(self, call):
+        self._deal.makeCall(self._deal.positionInTurn(), call)
+        for _ in range(3):
+            self._deal.makeCall(self._deal.positionInTurn(), makePass())
+
+
+class ServerTest(unittest.TestCase):
+    """Unit test suite for server"""
+
+    def setUp(self):
+        self._zmqctx = zmq.Context()
+        control_socket = self._zmqctx.socket(zmq.ROUTER)
+        control_socket.bind(CONTROL_ENDPOINT)
+        event_socket = self._zmqctx.socket(zmq.PUB)
+        event_socket.bind(EVENT_ENDPOINT)
+        self._server = Server(control_socket, event_socket, deals=[HANDS])
+        self._thread = threading.Thread(target=self._server.run)
+        self._thread.start()
+
+    def tearDown(self):
+        self._server.stop()
+        self._thread.join()
+        self._zmqctx.destroy(linger=0)
+
+    def testJoinGame(self):
+        clients = self._join_clients()
+        self._run_until(
+            clients, lambda: clients[0].state().allowedCalls() and
+            clients[2].state().cards().get(Position.south))
+        self.assertEqual(
+            [client.state().position() for client in clients],
+            ["north", "east", "south", "west"])
+        self.assertEqual(
+            clients[2].state().cards()[Position.south], HANDS[Position.south])
+        self.assertEqual(
+            clients[0].state().allowedCalls()[0], { "type": "pass" })
+
+    def testJoinWithoutResync(self):
+        with unittest.mock.patch.object(GameClient, "_resync") as resync:
+            clients = self._join_clients()
+            self._run_until(clients, lambda: clients[0].state().allowedCalls())
+            clients[0].call(makePass())
+            self._run_until(
+                clients,
+                lambda: all(client.state().calls() for client in clients))
+            deadline = time.monotonic() + 2 * EVENT_GAP_TIMEOUT
+            self._run_until(clients, lambda: time.monotonic() >= deadline)
+        resync.assert_not_called()
+        for client in clients:
+            self.assertEqual(len(client.state().calls()), 1)
+
+    def testLoadGenerator(self):
+        generator = LoadGenerator(
+            CONTROL_ENDPOINT, 4, context=self._zmqctx, seed=1)
+        statistics = generator.run(0.5)
+        self.assertTrue(statistics.latencies(CALL_TAG))
+        self.assertEqual(statistics.failures(CALL_TAG), 0)
+        self.assertEqual(statistics.errors(), 0)
+
+    def _join_clients(self):
+        clients = []
+        for n in range(len(Position)):
+            control_socket = self._zmqctx.socket(zmq.DEALER)
+            event_socket = self._zmqctx.socket(zmq.SUB)
+            client = GameClient(
+                control_socket, event_socket, createGame=not clients,
+                gameUuid=clients[0].gameUuid() if clients else None,
+                pipelinedStartup=True,
+                endpoints=[(CONTROL_ENDPOINT, EVENT_ENDPOINT)])
+            client.start()
+            clients.append(client)
+            self._run_until(clients, lambda: clients[-1].state().position())
+        return clients
+
+    def _run_until(self, clients, condition):
+        deadline = time.monotonic() + TIMEOUT
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            for client in clients:
+                self.assertTrue(client.handleMessages())
+                self.assertTrue(client.handleTimeouts())
+            time.sleep(0.001)
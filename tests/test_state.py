@@ -0,0 +1,64 @@
+import unittest
+
+import bridgegui.state as state
+
+STATE = {
+    "pubstate": { "calls": [], "cards": {} },
+    "self": { "position": "north" },
+    "privstate": { "cards": {} },
+}
+
+
+class StateTest(unittest.TestCase):
+    """Unit test suite for state utilities"""
+
+    def testFlattenState(self):
+        self.assertEqual(
+            state.flattenState(STATE, ("pubstate", "self", "other")),
+            {
+                ("pubstate", "calls"): [],
+                ("pubstate", "cards"): {},
+                ("self", "position"): "north",
+            })
+
+
+class StateTrackerTest(unittest.TestCase):
+    """Unit test suite for state tracker"""
+
+    def setUp(self):
+        self._state_tracker = state.StateTracker()
+
+    def testUpdate(self):
+        self.assertEqual(
+            self._state_tracker.update(1, { "a": 1, "b": 2 }),
+            { "a": 1, "b": 2 })
+        self.assertEqual(
+            self._state_tracker.update(2, { "a": 1, "b": 3, "c": 4 }),
+            { "b": 3, "c": 4 })
+        self.assertEqual(self._state_tracker.value("b"), 3)
+        self.assertIsNone(self._state_tracker.value("d"))
+
+    def testOlderSnapshotIsIgnored(self):
+        self._state_tracker.update(2, { "a": 1 })
+        self.assertEqual(self._state_tracker.update(1, { "a": 2, "b": 3 }), { "b": 3 })
+        self.assertEqual(self._state_tracker.value("a"), 1)
+
+    def testSnapshotWithoutCounter(self):
+        self._state_tracker.update(2, { "a": 1 })
+        self.assertEqual(self._state_tracker.update(None, { "a": 2 }), { "a": 2 })
+        self.assertEqual(self._state_tracker.update(1, { "a": 3 }), {})
+
+    def testInvalidate(self):
+        self._state_tracker.update(1, { "a": 1, "b": 2 })
+        self._state_tracker.invalidate(3, "a")
+        self.assertIsNone(self._state_tracker.value("a"))
+        self.assertEqual(self._state_tracker.update(2, { "a": 1, "b": 2 }), {})
+        self.assertEqual(self._state_tracker.update(3, { "a": 1, "b": 2 }), {})
+        self.assertEqual(self._state_tracker.update(4, { "a": 1, "b": 2 }), { "a": 1 })
+
+    def testReset(self):
+        self._state_tracker.update(1, { "a": 1 })
+        self._state_tracker.reset(3)
+        self.assertEqual(self._state_tracker.update(2, { "a": 1 }), {})
+        self.assertEqual(self._state_tracker.update(3, { "a": 1 }), {})
+        self.assertEqual(self._state_tracker.update(4, { "a": 1 }), { "a": 1 })
@@ -0,0 +1,90 @@
+import sys
+import time
+import unittest
+
+from PyQt5.QtCore import QCoreApplication, QThread
+import zmq
+
+from bridgegui.messaging import MessageQueue, ProtocolError, validateControlReply
+from bridgegui.worker import MessageWorker
+
+ENDPOINT = 'inproc://testing-worker'
+COMMAND = b'command'
+REPLY_SUCCESS_PREFIX = [b'', COMMAND, b'OK']
+TIMEOUT = 5
+
+
+class MessageWorkerTest(unittest.TestCase):
+    """Unit test suite for message worker"""
+
+    def setUp(self):
+        self._app = QCoreApplication(sys.argv)
+        self._zmqctx = zmq.Context()
+        back_socket = self._zmqctx.socket(zmq.PAIR)
+        back_socket.bind(ENDPOINT)
+        self._front_socket = self._zmqctx.socket(zmq.PAIR)
+        self._front_socket.connect(ENDPOINT)
+        self._worker = MessageWorker(context=self._zmqctx)
+        self._worker.messagesDecoded.connect(self._handle_messages)
+        self._worker.start()
+        self._proxy = self._worker.createProxy(back_socket)
+        self._message_queue = MessageQueue(
+            self._proxy, "test message queue", validateControlReply,
+            { COMMAND: self._handle_command },
+            converters={ COMMAND: self._convert_arguments })
+        self._worker.addQueue(self._proxy, self._message_queue)
+        self._messages = []
+        self._args = []
+        self._conversion_threads = []
+
+    def tearDown(self):
+        self._worker.stop()
+        self._front_socket.close(linger=0)
+        self._zmqctx.destroy()
+        del self._app
+
+    def testMessagesAreDecodedInWorkerThread(self):
+        self._front_socket.send_multipart(REPLY_SUCCESS_PREFIX + [b'arg', b'1'])
+        self._wait_until(lambda: self._args)
+        self.assertEqual(self._args, [2])
+        self.assertEqual(len(self._conversion_threads), 1)
+        self.assertNotEqual(
+            self._conversion_threads[0], QCoreApplication.instance().thread())
+
+    def testInvalidMessagesAreDeliveredAsErrors(self):
+        self._front_socket.send_multipart([b'this', b'is', b'incorrect'])
+        self._wait_until(lambda: self._messages)
+        self.assertIsInstance(self._messages[0], ProtocolError)
+
+    def testDecodingErrorsAreDeliveredAsErrors(self):
+        with self.assertLogs(level="ERROR"):
+            self._front_socket.send_multipart(REPLY_SUCCESS_PREFIX)
+            self._front_socket.send_multipart(
+                REPLY_SUCCESS_PREFIX + [b'arg', b'1'])
+            self._wait_until(lambda: self._args)
+        self.assertIsInstance(self._messages[0], ProtocolError)
+        self.assertEqual(self._args, [2])
+
+    def testSendThroughProxy(self):
+        self._proxy.send_multipart([b'message'])
+        self.assertTrue(self._front_socket.poll(TIMEOUT * 1000))
+        self.assertEqual(self._front_socket.recv_multipart(), [b'message'])
+
+    def _wait_until(self, condition):
+        deadline = time.monotonic() + TIMEOUT
+        while not condition() and time.monotonic() < deadline:
+            QCoreApplication.processEvents()
+            time.sleep(0.01)
+
+    def _handle_messages(self, message_queue, messages):
+        self.assertIs(message_queue, self._message_queue)
+        self._messages.extend(messages)
+        message_queue.dispatchMessages(messages)
+
+    def _convert_arguments(self, kwargs):
+        self._conversion_threads.append(QThread.currentThread())
+        return { "arg": kwargs["arg"] + 1 }
+
+    def _handle_command(self, arg):
+        self._args.append(arg)
+